@@ -0,0 +1,181 @@
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+# --- Cache dei risultati di analisi indirizzata per contenuto ---
+# La chiave dipende solo da ciò che determina l'output dell'LLM: testo normalizzato,
+# presenza del business plan, modello e versione del prompt. Due caricamenti dello stesso
+# pitch deck producono la stessa chiave e il secondo non paga una nuova chiamata OpenAI.
+
+ANALYSIS_CACHE_BACKEND = os.environ.get("ANALYSIS_CACHE_BACKEND", "firestore")  # firestore | sqlite | none
+ANALYSIS_CACHE_TTL_S = int(os.environ.get("ANALYSIS_CACHE_TTL_S", str(30 * 24 * 3600)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "5000"))
+# Il limite di voci del backend Firestore è verificato (count() aggregato) solo ogni N scritture per istanza
+ANALYSIS_CACHE_EVICT_EVERY = int(os.environ.get("ANALYSIS_CACHE_EVICT_EVERY", "50"))
+ANALYSIS_CACHE_SQLITE_PATH = os.environ.get("ANALYSIS_CACHE_SQLITE_PATH", "/tmp/validatr_analysis_cache.sqlite3")
+
+# Campi specifici della singola richiesta che non devono finire nella cache
+_REQUEST_SPECIFIC_FIELDS = ("document_name", "stage_timings", "token_usage", "cache")
+
+
+def normalize_text(text):
+    """Normalizza il testo estratto (spazi, righe vuote) così che differenze irrilevanti non cambino la chiave."""
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def hash_content(value):
+    """Restituisce lo SHA-256 esadecimale di una stringa o di un oggetto serializzabile in JSON."""
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False, default=list)
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def build_analysis_cache_key(text, has_business_plan, model, prompt_hash):
+    """Costruisce la chiave di cache a partire da testo, flag business plan, modello e hash del prompt."""
+    return hash_content({
+        "text": hash_content(normalize_text(text)),
+        "has_business_plan": bool(has_business_plan),
+        "model": model,
+        "prompt": prompt_hash,
+    })
+
+
+def _strip_request_fields(analysis):
+    cached = copy.deepcopy(analysis)
+    for field in _REQUEST_SPECIFIC_FIELDS:
+        cached.pop(field, None)
+    return cached
+
+
+class SQLiteAnalysisCache:
+    """
+    Backend locale su SQLite (test, esecuzioni offline, benchmark).
+    Eviction: le voci scadute vengono ignorate e rimosse; oltre max_entries
+    vengono eliminate le voci usate meno di recente.
+    """
+
+    def __init__(self, path=ANALYSIS_CACHE_SQLITE_PATH, ttl_s=ANALYSIS_CACHE_TTL_S, max_entries=ANALYSIS_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_cache ("
+            " key TEXT PRIMARY KEY, analysis TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_access ON analysis_cache(last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT analysis, created_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            if self.ttl_s and now - row[1] > self.ttl_s:
+                self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE analysis_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, analysis):
+        now = time.time()
+        payload = json.dumps(_strip_request_fields(analysis), ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, analysis, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl_s:
+            self._conn.execute("DELETE FROM analysis_cache WHERE created_at < ?", (now - self.ttl_s,))
+        if self.max_entries:
+            self._conn.execute(
+                "DELETE FROM analysis_cache WHERE key IN ("
+                " SELECT key FROM analysis_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class FirestoreAnalysisCache:
+    """
+    Backend persistente su Firestore: un documento per chiave in
+    artifacts/{APP_ID}/analysis_cache/{key}.
+    Le voci scadute sono eliminate dalla TTL policy nativa di Firestore sul campo `expires_at`
+    (da configurare sul gruppo di collezioni analysis_cache) e ignorate in lettura nel frattempo.
+    Il limite sul numero di voci, che elimina quelle con `last_access` più vecchio, costa un'aggregazione
+    count(): viene verificato solo ogni `evict_every` scritture dell'istanza, quindi può essere superato
+    temporaneamente di qualche voce.
+    """
+
+    def __init__(self, db, app_id, ttl_s=ANALYSIS_CACHE_TTL_S, max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+                 evict_every=ANALYSIS_CACHE_EVICT_EVERY):
+        self.collection_ref = db.collection('artifacts', app_id, 'analysis_cache')
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.evict_every = max(1, evict_every)
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        snapshot = self.collection_ref.document(key).get()
+        if not snapshot.exists:
+            return None
+        entry = snapshot.to_dict()
+        now = time.time()
+        if self.ttl_s and now - entry.get('created_at', 0) > self.ttl_s:
+            snapshot.reference.delete()
+            return None
+        snapshot.reference.update({'last_access': now})
+        return entry.get('analysis')
+
+    def put(self, key, analysis):
+        now = time.time()
+        self.collection_ref.document(key).set({
+            'analysis': _strip_request_fields(analysis),
+            'created_at': now,
+            'last_access': now,
+            # Timestamp (non float): la TTL policy di Firestore considera solo campi di tipo data
+            'expires_at': datetime.fromtimestamp(now + self.ttl_s, tz=timezone.utc) if self.ttl_s else None,
+        })
+        with self._lock:
+            self._puts += 1
+            due = self._puts % self.evict_every == 0
+        if due:
+            self._evict()
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        count = self.collection_ref.count().get()[0][0].value
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        oldest = self.collection_ref.order_by('last_access').limit(excess).stream()
+        for doc in oldest:
+            doc.reference.delete()
+        print(f"INFO: Cache analisi: eliminate {excess} voci meno recenti.")
+
+
+def create_analysis_cache(db, app_id, backend=ANALYSIS_CACHE_BACKEND):
+    """Crea il backend di cache configurato (firestore, sqlite o none)."""
+    if backend == "none":
+        return None
+    if backend == "sqlite":
+        return SQLiteAnalysisCache()
+    return FirestoreAnalysisCache(db, app_id)
@@ -0,0 +1,136 @@
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import count
+
+# --- Job asincroni di analisi ---
+# start_analysis crea un documento di job e lo accoda; il worker (process_analysis_job, attivato da
+# Pub/Sub) esegue estrazione, analisi e salvataggio aggiornando lo stato del job. Il documento si trova
+# in artifacts/{APP_ID}/users/{uid}/analysis_jobs/{job_id}: la dashboard può interrogarlo o sottoscriverlo.
+
+JOB_QUEUED = "queued"
+JOB_EXTRACTING = "extracting"
+JOB_SCORING = "scoring"
+JOB_SAVED = "saved"
+JOB_FAILED = "failed"
+TERMINAL_JOB_STATUSES = {JOB_SAVED, JOB_FAILED}
+
+# Backend della coda: "pubsub" (default, produzione) oppure "local" (thread nel processo, per test e
+# sviluppo). La coda locale va scelta esplicitamente con ANALYSIS_QUEUE_BACKEND=local: un deploy senza
+# ANALYSIS_JOBS_TOPIC non deve ripiegare in silenzio su thread che muoiono con l'istanza
+# (vedi check_queue_config, chiamata all'avvio della funzione).
+ANALYSIS_JOBS_TOPIC = os.environ.get("ANALYSIS_JOBS_TOPIC")
+ANALYSIS_QUEUE_BACKEND = os.environ.get("ANALYSIS_QUEUE_BACKEND", "pubsub")
+QUEUE_BACKENDS = ("pubsub", "local")
+# Parallelismo dei worker della coda locale (con Pub/Sub lo controlla il max-instances del worker)
+ANALYSIS_LOCAL_WORKERS = int(os.environ.get("ANALYSIS_LOCAL_WORKERS", "2"))
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class AnalysisJobStore:
+    """Documenti di stato dei job di analisi, uno per job nella collezione dell'utente."""
+
+    def __init__(self, db, app_id):
+        self.db = db
+        self.app_id = app_id
+
+    def _ref(self, user_id, job_id):
+        return self.db.collection('artifacts', self.app_id, 'users', user_id, 'analysis_jobs').document(job_id)
+
+    def create(self, job):
+        now = time.time()
+        self._ref(job["user_id"], job["job_id"]).set({
+            "status": JOB_QUEUED,
+            "document_name": job["original_file_name"],
+            "document_id": job["document_id"],
+            # Percorsi e chiavi del testo estratto servono a ritentare il job senza un nuovo caricamento
+            "pitch_deck_path": job["pitch_deck_path"],
+            "business_plan_path": job.get("business_plan_path"),
+            "text_keys": job.get("text_keys") or {},
+            "retry_of": job.get("retry_of"),
+            "created_at": now,
+            "updated_at": now,
+            "stage_timings": {},
+            "error": None,
+        })
+        count("firestore_writes")
+
+    def get(self, user_id, job_id):
+        snapshot = self._ref(user_id, job_id).get()
+        count("firestore_reads")
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def update(self, user_id, job_id, status, **fields):
+        self._ref(user_id, job_id).set({"status": status, "updated_at": time.time(), **fields}, merge=True)
+        count("firestore_writes")
+
+
+class PubSubJobQueue:
+    """Pubblica i job sul topic Pub/Sub che attiva il worker process_analysis_job."""
+
+    def __init__(self, topic=ANALYSIS_JOBS_TOPIC):
+        from google.cloud import pubsub_v1
+        if not topic:
+            raise ValueError("ANALYSIS_JOBS_TOPIC non configurato per la coda Pub/Sub.")
+        self.publisher = pubsub_v1.PublisherClient()
+        self.topic = topic
+
+    def enqueue(self, job):
+        self.publisher.publish(self.topic, json.dumps(job).encode("utf-8")).result(timeout=30)
+
+
+class LocalJobQueue:
+    """
+    Coda nel processo: i job vengono eseguiti da un pool di thread chiamando `handler(job)`.
+    Sostituisce Pub/Sub nei test e nello sviluppo locale; join() attende i job accodati.
+    """
+
+    def __init__(self, handler, workers=ANALYSIS_LOCAL_WORKERS):
+        self.handler = handler
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis-job")
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, job):
+        with self._lock:
+            self._futures = [future for future in self._futures if not future.done()]
+            self._futures.append(self._executor.submit(self.handler, job))
+
+    def join(self):
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+
+def check_queue_config(backend=ANALYSIS_QUEUE_BACKEND, topic=ANALYSIS_JOBS_TOPIC):
+    """Solleva ValueError se la configurazione della coda non è utilizzabile."""
+    if backend not in QUEUE_BACKENDS:
+        raise ValueError(f"Backend di coda non supportato: {backend}")
+    if backend == "pubsub" and not topic:
+        raise ValueError(
+            "ANALYSIS_JOBS_TOPIC non configurato per la coda Pub/Sub: impostare il topic "
+            "oppure ANALYSIS_QUEUE_BACKEND=local (solo test e sviluppo)."
+        )
+
+
+def create_job_queue(handler, backend=ANALYSIS_QUEUE_BACKEND):
+    """Crea la coda dei job secondo la configurazione; `handler` serve solo alla coda locale."""
+    if backend == "pubsub":
+        return PubSubJobQueue()
+    if backend == "local":
+        return LocalJobQueue(handler)
+    raise ValueError(f"Backend di coda non supportato: {backend}")
+
+
+def decode_pubsub_job(cloud_event):
+    """Estrae il job (dict) dal CloudEvent di un messaggio Pub/Sub."""
+    return json.loads(base64.b64decode(cloud_event.data["message"]["data"]).decode("utf-8"))
@@ -0,0 +1,190 @@
+import json
+import re
+from typing import Annotated, Union
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from rubrics import PREDEFINED_SECTORS, RUBRICS, COHERENCE_PAIRS
+
+# --- Validazione dell'output strutturato dell'analisi ---
+# I modelli pydantic rispecchiano il formato di output del prompt di analisi. Ogni variabile e
+# ogni coppia di coerenza viene validata singolarmente: così si sa esattamente quali delle 7
+# variabili e delle 21 coppie mancano o non sono valide e si possono richiedere solo quelle.
+
+EXPECTED_VARIABLES = list(RUBRICS)
+EXPECTED_PAIRS = [f"{var1} - {var2}" for var1, var2 in COHERENCE_PAIRS]
+_PAIR_LOOKUP = {}
+for _var1, _var2 in COHERENCE_PAIRS:
+    _PAIR_LOOKUP[(_var1, _var2)] = _PAIR_LOOKUP[(_var2, _var1)] = f"{_var1} - {_var2}"
+
+Score = Annotated[Union[int, float], Field(ge=0, le=100)]
+
+
+class Motivation(BaseModel):
+    it: str = Field(min_length=1)
+    en: str = Field(min_length=1)
+
+
+def _coerce_motivation(value):
+    # Una motivazione in sola stringa viene accettata per entrambe le lingue invece di richiederla di nuovo
+    if isinstance(value, str):
+        return {"it": value, "en": value}
+    return value
+
+
+class VariableScore(BaseModel):
+    nome: str
+    punteggio: Score
+    motivazione: Motivation
+
+    _coerce = field_validator("motivazione", mode="before")(_coerce_motivation)
+
+    @field_validator("nome")
+    @classmethod
+    def _known_variable(cls, value):
+        if value.strip() not in RUBRICS:
+            raise ValueError(f"variabile sconosciuta: {value}")
+        return value.strip()
+
+
+class CoherencePairScore(BaseModel):
+    coppia: str
+    punteggio: Score
+    motivazione: Motivation
+
+    _coerce = field_validator("motivazione", mode="before")(_coerce_motivation)
+
+    @field_validator("coppia")
+    @classmethod
+    def _known_pair(cls, value):
+        # Accetta varianti di formato ("A-B", "A – B") e l'ordine invertito, normalizzando al nome canonico
+        parts = [part.strip() for part in re.split(r"\s*[-–—]\s*", value.strip(), maxsplit=1)]
+        canonical = _PAIR_LOOKUP.get(tuple(parts)) if len(parts) == 2 else None
+        if not canonical:
+            raise ValueError(f"coppia sconosciuta: {value}")
+        return canonical
+
+
+def repair_truncated_json(text):
+    """
+    Ripara un JSON troncato (es. risposta interrotta da max_tokens): taglia il testo dopo l'ultimo
+    oggetto completo e chiude le parentesi rimaste aperte. Restituisce il dict o None.
+    """
+    stack = []
+    cut_points = []
+    in_string = escaped = False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]" and stack:
+            stack.pop()
+            if char == "}" and stack:
+                cut_points.append((position, tuple(stack)))
+    for position, open_brackets in reversed(cut_points):
+        closers = "".join("}" if bracket == "{" else "]" for bracket in reversed(open_brackets))
+        try:
+            data = json.loads(text[:position + 1] + closers)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def extract_json_object(content):
+    """Interpreta la risposta dell'LLM come oggetto JSON, riparandola se troncata; None se impossibile."""
+    if not content:
+        return None
+    text = content.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(json)?\s*|\s*```$", "", text)
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = text[start:]
+    try:
+        data = json.loads(text)
+        return data if isinstance(data, dict) else None
+    except json.JSONDecodeError:
+        repaired = repair_truncated_json(text)
+        if repaired is not None:
+            print("ATTENZIONE: risposta JSON troncata o malformata, riparata tenendo gli elementi completi.")
+        return repaired
+
+
+def _valid_items(items, model, key):
+    valid = {}
+    for item in items if isinstance(items, list) else []:
+        try:
+            parsed = model.model_validate(item)
+        except ValidationError as e:
+            print(f"ATTENZIONE: elemento '{item.get(key) if isinstance(item, dict) else item}' non valido: {e.errors()[0]['msg']}")
+            continue
+        valid.setdefault(getattr(parsed, key), parsed.model_dump())
+    return valid
+
+
+def validate_analysis(data, previous=None):
+    """
+    Valida l'output dell'analisi (eventualmente parziale) e lo unisce a `previous`.
+    Restituisce (analisi nel formato canonico, variabili mancanti, coppie mancanti).
+    """
+    data = data if isinstance(data, dict) else {}
+    previous = previous or {}
+    variables = {item["nome"]: item for item in previous.get("variabili_valutate", [])}
+    pairs = {item["coppia"]: item for item in previous.get("coerenza_coppie", [])}
+    variables.update({k: v for k, v in _valid_items(data.get("variabili_valutate"), VariableScore, "nome").items() if k not in variables})
+    pairs.update({k: v for k, v in _valid_items(data.get("coerenza_coppie"), CoherencePairScore, "coppia").items() if k not in pairs})
+
+    sector = previous.get("settore") or data.get("settore")
+    if sector not in PREDEFINED_SECTORS:
+        # Validazione del settore: assicurati che sia uno dei predefiniti
+        print(f"ATTENZIONE: Settore '{sector}' non riconosciuto. Assegnando 'Altro'.")
+        sector = "Altro"
+
+    analysis = {
+        "settore": sector,
+        "variabili_valutate": [variables[name] for name in EXPECTED_VARIABLES if name in variables],
+        "coerenza_coppie": [pairs[name] for name in EXPECTED_PAIRS if name in pairs],
+    }
+    missing_variables = [name for name in EXPECTED_VARIABLES if name not in variables]
+    missing_pairs = [name for name in EXPECTED_PAIRS if name not in pairs]
+    return analysis, missing_variables, missing_pairs
+
+
+def build_reask_messages(analysis, missing_variables, missing_pairs):
+    """
+    Messaggi da aggiungere alla conversazione originale per il follow-up: la risposta precedente
+    (come JSON riparato e validato, non il testo troncato) e la richiesta dei soli elementi mancanti.
+    Il modello vede così cosa ha già restituito e a cosa si riferisce "la risposta precedente".
+    """
+    return [
+        {"role": "assistant", "content": json.dumps(analysis, ensure_ascii=False)},
+        {"role": "user", "content": build_reask_instruction(missing_variables, missing_pairs)},
+    ]
+
+
+def build_reask_instruction(missing_variables, missing_pairs):
+    """Messaggio di follow-up che richiede solo le variabili e le coppie mancanti."""
+    lines = ["La risposta precedente era incompleta. Restituisci SOLO un oggetto JSON con gli elementi seguenti, nello stesso formato:"]
+    if missing_variables:
+        lines.append(f'- "variabili_valutate": {", ".join(missing_variables)}')
+    if missing_pairs:
+        lines.append(f'- "coerenza_coppie": {", ".join(missing_pairs)}')
+    lines.append('Includi anche "settore". Non ripetere gli altri elementi.')
+    return "\n".join(lines)
+
+
+def estimate_reask_max_tokens(missing_variables, missing_pairs, per_item=220, overhead=100, cap=3800):
+    """max_tokens per la richiesta di follow-up, proporzionale al numero di elementi mancanti."""
+    return min(cap, overhead + per_item * (len(missing_variables) + len(missing_pairs)))
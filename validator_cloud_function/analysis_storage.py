@@ -0,0 +1,201 @@
+import argparse
+import json
+import time
+
+# --- Documenti di analisi "hot" e "cold" ---
+# Le motivazioni bilingui delle 7 variabili e delle 21 coppie di coerenza sono la gran parte di
+# un'analisi, ma la dashboard le mostra solo per il deck selezionato. Ogni analisi è quindi
+# salvata in due documenti con lo stesso ID:
+#   .../pitch_deck_analyses/{id}           hot: nome, settore, executive_summary, core_metrics e i
+#                                           soli punteggi di variabili e coppie (grafici, "Il Mio Score",
+#                                           leaderboard, statistiche e re-scoring in blocco)
+#   .../pitch_deck_analysis_details/{id}   cold: variabili e coppie complete di motivazioni e i
+#                                           metadati dell'elaborazione (tempi, token)
+# Le liste e le classifiche leggono solo i documenti hot; fetchPitchData?detail={id} unisce i due.
+#
+# --- Forma canonica (schema_version) ---
+# Ogni analisi viene scritta in forma canonica: executive_summary come oggetto {it, en} (non la
+# stringa JSON restituita dall'LLM), metriche solo in core_metrics (mai nel vecchio calcoli_aggiuntivi),
+# variabili e coppie sempre liste. La lettura diventa così una semplice proiezione dei campi
+# (vedi pitch_data_transform). I documenti precedenti vengono normalizzati (e divisi) da
+#     python analysis_storage.py migrate [--dry-run] [--resume-from PERCORSO]
+# e, finché non sono migrati, alla lettura con la stessa normalize_analysis.
+
+SCHEMA_VERSION = 2
+DETAILS_COLLECTION = 'pitch_deck_analysis_details'
+# Campi spostati interamente nel documento cold
+COLD_FIELDS = ('stage_timings', 'token_usage')
+# Campi delle voci di variabili e coppie che restano nel documento hot
+HOT_ITEM_FIELDS = {
+    'variabili_valutate': ('nome', 'punteggio'),
+    'coerenza_coppie': ('coppia', 'punteggio'),
+}
+FIRESTORE_WRITE_BATCH_SIZE = 400
+# Corrispondenza delle chiavi del vecchio calcoli_aggiuntivi con core_metrics
+LEGACY_METRICS_KEYS = {
+    'indice_coerenza': 'indice_coerenza',
+    'classe': 'classe_pitch',
+    'z_score': 'z_score',
+    'final_adjusted_score': 'final_adjusted_score',
+    'final_score': 'final_score',
+    'userId': 'userId',
+}
+
+
+def normalize_analysis(data):
+    """
+    Restituisce l'analisi in forma canonica (SCHEMA_VERSION). Un executive_summary che non è un
+    JSON valido (es. il testo di fallback del riassunto) viene scartato, come faceva la lettura.
+    """
+    if data.get('schema_version') == SCHEMA_VERSION:
+        return data
+    normalized = dict(data)
+    summary = normalized.get('executive_summary')
+    if isinstance(summary, str):
+        try:
+            summary = json.loads(summary)
+        except json.JSONDecodeError:
+            summary = None
+    if isinstance(summary, dict) and summary:
+        normalized['executive_summary'] = summary
+    else:
+        normalized.pop('executive_summary', None)
+    legacy_metrics = normalized.pop('calcoli_aggiuntivi', None)
+    if not normalized.get('core_metrics') and legacy_metrics:
+        normalized['core_metrics'] = {
+            new_key: legacy_metrics[old_key] for old_key, new_key in LEGACY_METRICS_KEYS.items() if old_key in legacy_metrics
+        }
+    for field in HOT_ITEM_FIELDS:
+        normalized[field] = normalized.get(field) or []
+    normalized['schema_version'] = SCHEMA_VERSION
+    return normalized
+
+
+def details_ref(doc_ref):
+    """Documento cold di un'analisi: stessa posizione e stesso ID, nella collezione dei dettagli."""
+    return doc_ref.parent.parent.collection(DETAILS_COLLECTION).document(doc_ref.id)
+
+
+def split_analysis(data):
+    """Divide un'analisi completa in (hot, cold)."""
+    hot = {key: value for key, value in data.items() if key not in COLD_FIELDS}
+    cold = {key: data[key] for key in COLD_FIELDS if key in data}
+    for field, item_fields in HOT_ITEM_FIELDS.items():
+        if field in data:
+            items = data[field] or []
+            hot[field] = [{key: item.get(key) for key in item_fields} for item in items]
+            cold[field] = items
+    hot['has_details'] = True
+    if 'updated_at' in data:
+        cold['updated_at'] = data['updated_at']
+    return hot, cold
+
+
+def merge_analysis(hot, cold):
+    """Ricompone l'analisi completa; senza documento cold (analisi non ancora divise) restituisce hot."""
+    merged = dict(hot)
+    merged.pop('has_details', None)
+    if cold:
+        merged.update({key: value for key, value in cold.items() if key != 'updated_at'})
+    return merged
+
+
+def add_analysis_writes(writer, doc_ref, data):
+    """
+    Aggiunge a `writer` (batch o transazione) le scritture hot e cold di un'analisi completa
+    (2 operazioni), in forma canonica.
+    """
+    hot, cold = split_analysis(normalize_analysis(data))
+    writer.set(doc_ref, hot)
+    writer.set(details_ref(doc_ref), cold)
+
+
+def add_analysis_update(writer, doc_ref, update):
+    """
+    Aggiornamento parziale (merge) di un'analisi: i campi cold vanno nel documento dei dettagli,
+    il resto (con variabili e coppie ridotte ai punteggi) nel documento hot (2 operazioni).
+    """
+    hot, cold = split_analysis(update)
+    writer.set(doc_ref, hot, merge=True)
+    writer.set(details_ref(doc_ref), cold, merge=True)
+
+
+def read_analysis(doc_ref):
+    """Analisi completa (hot + cold) o None se il documento non esiste."""
+    snapshot = doc_ref.get()
+    if not snapshot.exists:
+        return None
+    hot = snapshot.to_dict()
+    if not hot.get('has_details'):
+        return hot
+    details = details_ref(doc_ref).get()
+    return merge_analysis(hot, details.to_dict() if details.exists else None)
+
+
+def migrate_analyses(db, app_id, dry_run=False, resume_from=None):
+    """
+    Migrazione una tantum: riscrive in forma canonica e divisa in hot/dettagli tutte le analisi
+    dell'app con schema_version precedente. I documenti sono letti in ordine di percorso: dopo
+    ogni batch viene stampato il percorso raggiunto, da passare come resume_from per riprendere;
+    in ogni caso i documenti già migrati vengono saltati. updated_at e la versione delle analisi
+    non cambiano, perché la risposta di fetchPitchData resta la stessa.
+    """
+    from google.cloud.firestore_v1.field_path import FieldPath
+    query = db.collection_group('pitch_deck_analyses').order_by(FieldPath.document_id())
+    if resume_from:
+        query = query.start_after(db.document(resume_from).get())
+    batch = db.batch()
+    pending = migrated = skipped = 0
+    bytes_before = bytes_after = 0
+    last_path = None
+    for doc in query.stream():
+        path = doc.reference.path.split('/')
+        if path[0] != 'artifacts' or path[1] != app_id:
+            continue
+        data = doc.to_dict()
+        if data.get('schema_version') == SCHEMA_VERSION:
+            skipped += 1
+            continue
+        if data.get('has_details'):
+            # Già divisa (analysis_storage precedente alla forma canonica): si parte dall'analisi completa
+            details = details_ref(doc.reference).get()
+            data = merge_analysis(data, details.to_dict() if details.exists else None)
+        hot, _ = split_analysis(normalize_analysis(data))
+        bytes_before += len(repr(data))
+        bytes_after += len(repr(hot))
+        migrated += 1
+        last_path = doc.reference.path
+        if dry_run:
+            continue
+        add_analysis_writes(batch, doc.reference, data)
+        pending += 2
+        if pending >= FIRESTORE_WRITE_BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+            print(f"INFO: {migrated} analisi migrate, ultimo documento: {last_path}")
+    if pending:
+        batch.commit()
+    ratio = f"{bytes_before / bytes_after:.1f}x" if bytes_after else "n/d"
+    print(
+        f"INFO: {migrated} analisi {'da migrare' if dry_run else 'migrate'}, {skipped} già alla versione {SCHEMA_VERSION}; "
+        f"dimensione dei documenti hot ridotta di {ratio} (stima)."
+    )
+    return {
+        "migrated": migrated, "skipped": skipped, "dry_run": dry_run, "last_path": last_path,
+        "bytes_before": bytes_before, "bytes_after": bytes_after,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gestione dei documenti hot/cold delle analisi.")
+    parser.add_argument(
+        "command", choices=["migrate"],
+        help="migrate: riscrive le analisi esistenti in forma canonica, divise in documenti hot e dettagli."
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Conta le analisi da migrare senza scrivere.")
+    parser.add_argument("--resume-from", help="Percorso dell'ultimo documento migrato (stampato durante l'esecuzione).")
+    args = parser.parse_args()
+    from clients import APP_ID, get_firestore_client
+    start = time.monotonic()
+    migrate_analyses(get_firestore_client(), APP_ID, dry_run=args.dry_run, resume_from=args.resume_from)
+    print(f"INFO: Completato in {time.monotonic() - start:.1f}s.")
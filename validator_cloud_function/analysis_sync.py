@@ -0,0 +1,130 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+
+# --- Versione delle analisi per utente: ETag e sincronizzazione incrementale ---
+# Ogni scrittura che modifica le analisi di un utente imposta `updated_at` (secondi epoch) sui
+# documenti toccati e aggiorna, nella stessa transazione o batch, il documento
+#     artifacts/{APP_ID}/users/{uid}/meta/pitch_deck_analyses  {version, updated_at}
+# Un'eliminazione lascia una tombstone in users/{uid}/deleted_analyses/{document_id}.
+# fetchPitchData legge solo il documento meta per calcolare l'ETag (304 se la dashboard ha già
+# quella versione) e, con `since`, restituisce solo i documenti e le tombstone più recenti.
+
+# Le scritture usano l'orologio dell'istanza che le esegue: la query `since` torna indietro di
+# questo margine per non perdere scritture concorrenti con un timestamp leggermente precedente
+# (un documento restituito due volte viene semplicemente sovrascritto dal client).
+SYNC_OVERLAP_S = 60
+# Le tombstone più vecchie possono essere eliminate: un `since` precedente richiede un ricaricamento completo
+TOMBSTONE_RETENTION_S = int(os.environ.get("TOMBSTONE_RETENTION_S", str(30 * 24 * 3600)))
+# Da incrementare se cambia il formato della risposta di fetchPitchData, per invalidare gli ETag già emessi
+SYNC_FORMAT_VERSION = 1
+FIRESTORE_WRITE_BATCH_SIZE = 400
+
+
+def sync_meta_ref(db, app_id, user_id):
+    return db.collection('artifacts', app_id, 'users', user_id, 'meta').document('pitch_deck_analyses')
+
+
+def tombstones_collection(db, app_id, user_id):
+    return db.collection('artifacts', app_id, 'users', user_id, 'deleted_analyses')
+
+
+def add_version_bump(writer, db, app_id, user_id, now=None):
+    """Aggiunge a `writer` (batch o transazione) l'incremento della versione delle analisi dell'utente."""
+    from firebase_admin import firestore
+    writer.set(sync_meta_ref(db, app_id, user_id), {
+        'version': firestore.Increment(1),
+        'updated_at': now or time.time(),
+    }, merge=True)
+
+
+def add_tombstone_writes(writer, db, app_id, user_id, document_ids, now=None):
+    """Registra l'eliminazione dei documenti indicati (una tombstone per documento)."""
+    now = now or time.time()
+    collection_ref = tombstones_collection(db, app_id, user_id)
+    for document_id in document_ids:
+        writer.set(collection_ref.document(document_id), {'deleted_at': now})
+
+
+def read_sync_meta(db, app_id, user_id):
+    """Versione corrente delle analisi dell'utente ({version, updated_at}) o None se mai registrata."""
+    snapshot = sync_meta_ref(db, app_id, user_id).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def compute_etag(user_id, meta, variant):
+    """
+    ETag della risposta: dipende dall'utente, dalla versione delle sue analisi e dai parametri
+    che cambiano il contenuto (campi, filtri, pagina). None se la versione non è nota.
+    """
+    if not meta or meta.get('version') is None:
+        return None
+    digest = hashlib.sha256(json.dumps(
+        [SYNC_FORMAT_VERSION, user_id, meta['version'], meta.get('updated_at'), variant], sort_keys=True, default=str
+    ).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def content_etag(body):
+    """ETag calcolato sul corpo della risposta, per gli utenti senza documento di versione (dati legacy)."""
+    return f'"{hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Confronto debole dell'header If-None-Match (lista di ETag o `*`) con l'ETag corrente."""
+    if not if_none_match or not etag:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(',')]
+    return '*' in candidates or any(value.removeprefix('W/') == etag for value in candidates)
+
+
+def parse_since(value, now=None):
+    """
+    Interpreta il parametro `since` (secondi epoch restituiti come sync_token).
+    Restituisce il limite inferiore della query (con il margine SYNC_OVERLAP_S), oppure None se
+    il valore è più vecchio della conservazione delle tombstone e serve un ricaricamento completo.
+    Solleva ValueError (risposta 400) per valori non finiti, negativi o nel futuro: una risposta
+    vuota con un nuovo sync_token impedirebbe al client di ricevere le modifiche.
+    """
+    since = float(value)
+    now = time.time() if now is None else now
+    if not math.isfinite(since) or since < 0:
+        raise ValueError("since deve essere un timestamp finito e positivo.")
+    if since > now + SYNC_OVERLAP_S:
+        raise ValueError("since è nel futuro: usare il sync_token di una risposta precedente.")
+    if since < now - TOMBSTONE_RETENTION_S:
+        return None
+    return since - SYNC_OVERLAP_S
+
+
+def purge_tombstones(db, app_id, retention_s=TOMBSTONE_RETENTION_S):
+    """Elimina le tombstone più vecchie della conservazione, per tutti gli utenti."""
+    from google.cloud.firestore_v1.base_query import FieldFilter
+    threshold = time.time() - retention_s
+    batch = db.batch()
+    pending = deleted = 0
+    for doc in db.collection_group('deleted_analyses').where(filter=FieldFilter('deleted_at', '<', threshold)).stream():
+        path = doc.reference.path.split('/')
+        if path[0] != 'artifacts' or path[1] != app_id:
+            continue
+        batch.delete(doc.reference)
+        pending += 1
+        deleted += 1
+        if pending >= FIRESTORE_WRITE_BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    print(f"INFO: {deleted} tombstone eliminate.")
+    return deleted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manutenzione della sincronizzazione incrementale delle analisi.")
+    parser.add_argument("command", choices=["purge-tombstones"], help="purge-tombstones: elimina le tombstone scadute.")
+    args = parser.parse_args()
+    from clients import APP_ID, get_firestore_client
+    purge_tombstones(get_firestore_client(), APP_ID)
@@ -0,0 +1,105 @@
+import collections
+import hashlib
+import os
+import threading
+import time
+
+from clients import get_auth
+from telemetry import count
+
+# --- Verifica degli ID token Firebase con cache nel processo ---
+# verify_id_token controlla firma e scadenza del token (con le chiavi pubbliche di Google, che
+# l'SDK Firebase Admin memorizza secondo il Cache-Control della risposta, per tutta la vita
+# del processo grazie all'app condivisa di clients) e, con check_revoked=True, interroga anche
+# Firebase Auth per sapere se le sessioni dell'utente sono state revocate: una chiamata di rete
+# a ogni richiesta. Qui i token già verificati vengono memorizzati (chiave: hash del token, mai
+# il token in chiaro) fino al minimo tra AUTH_CACHE_TTL_S e la loro scadenza; il controllo di
+# revoca viene ripetuto al più ogni AUTH_REVOCATION_CHECK_INTERVAL_S secondi per token.
+# Le verifiche fallite non vengono memorizzate.
+
+AUTH_CACHE_TTL_S = float(os.environ.get("AUTH_CACHE_TTL_S", "300"))
+AUTH_REVOCATION_CHECK_INTERVAL_S = float(os.environ.get("AUTH_REVOCATION_CHECK_INTERVAL_S", "300"))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", "10000"))
+# Margine prima della scadenza del token oltre il quale non lo si considera più valido dalla cache
+AUTH_CACHE_EXPIRY_SKEW_S = 30
+
+
+def token_key(id_token):
+    return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """Cache LRU dei token decodificati con scadenza per voce e data dell'ultimo controllo di revoca."""
+
+    def __init__(self, ttl_s=AUTH_CACHE_TTL_S, revocation_interval_s=AUTH_REVOCATION_CHECK_INTERVAL_S,
+                 max_entries=AUTH_CACHE_MAX_ENTRIES, verifier=None, clock=time.time):
+        self.ttl_s = ttl_s
+        self.revocation_interval_s = revocation_interval_s
+        self.max_entries = max_entries
+        self.verifier = verifier
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _verify(self, id_token, check_revoked):
+        verifier = self.verifier or get_auth().verify_id_token
+        return verifier(id_token, check_revoked=check_revoked)
+
+    def _lookup(self, key, check_revoked, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now >= entry["expires_at"]:
+                del self._entries[key]
+                return None
+            if check_revoked and (entry["revocation_checked_at"] is None
+                                  or now - entry["revocation_checked_at"] >= self.revocation_interval_s):
+                return None
+            self._entries.move_to_end(key)
+            return entry["claims"]
+
+    def verify(self, id_token, check_revoked=False):
+        """Restituisce i claim del token, dalla cache se possibile; solleva l'eccezione dell'SDK se non valido."""
+        if not id_token or self.ttl_s <= 0:
+            return self._verify(id_token, check_revoked)
+        key = token_key(id_token)
+        claims = self._lookup(key, check_revoked, self.clock())
+        if claims is not None:
+            count("auth_cache_hits")
+            return claims
+
+        count("auth_cache_misses")
+        claims = self._verify(id_token, check_revoked)
+        now = self.clock()
+        expires_at = now + self.ttl_s
+        if claims.get("exp"):
+            expires_at = min(expires_at, claims["exp"] - AUTH_CACHE_EXPIRY_SKEW_S)
+        if expires_at > now:
+            with self._lock:
+                previous = self._entries.get(key)
+                self._entries[key] = {
+                    "claims": claims,
+                    "expires_at": expires_at,
+                    "revocation_checked_at": now if check_revoked else (previous or {}).get("revocation_checked_at"),
+                }
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return claims
+
+    def invalidate(self, id_token=None):
+        """Rimuove un token dalla cache (o tutti, senza argomenti)."""
+        with self._lock:
+            if id_token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(token_key(id_token), None)
+
+
+token_cache = TokenCache()
+
+
+def verify_id_token(id_token, check_revoked=False):
+    """Verifica un ID token Firebase (con cache nel processo) e ne restituisce i claim decodificati."""
+    return token_cache.verify(id_token, check_revoked=check_revoked)
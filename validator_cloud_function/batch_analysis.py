@@ -0,0 +1,301 @@
+"""
+Analisi batch di molti pitch deck (es. l'intake di una cohort dell'acceleratore).
+
+Uso:
+    python batch_analysis.py --local-dir ./decks --user-id <UID> --manifest cohort.json
+    python batch_analysis.py --gcs-list paths.txt --user-id <UID> --manifest cohort.json
+
+paths.txt contiene un elemento per riga: "<pitch_deck_path>[,<business_plan_path>]"
+(percorsi relativi al bucket FIREBASE_STORAGE_BUCKET_NAME). In una cartella locale,
+un file "<nome>_bp.pdf" o "<nome>_business_plan.pdf" viene associato al deck "<nome>.pdf".
+
+Il manifest registra lo stato di ogni elemento: rilanciando lo stesso comando vengono
+rielaborati solo gli elementi non completati (falliti o mai partiti).
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import main as pipeline
+from clients import get_storage_client
+from leaderboard import leaderboard_write_ops
+from pdf_extraction import extract_pdf_pages, extract_blob_text
+from rate_limiting import RateLimiter
+
+BUSINESS_PLAN_SUFFIXES = ("_business_plan", "_bp")
+# Limite di Firestore: 500 operazioni per transazione
+FIRESTORE_MAX_TRANSACTION_OPS = 500
+
+
+def write_analyses_ops(document_count, user_id):
+    """
+    Scritture della transazione di pipeline.write_analyses per `document_count` analisi: documenti hot
+    e dettagli di ogni analisi, leaderboard (utente e shard globali toccati), versione delle analisi
+    dell'utente e statistiche di settore.
+    """
+    return 2 * document_count + leaderboard_write_ops(user_id, document_count) + (2 if user_id else 1)
+
+
+def max_documents_per_transaction(user_id):
+    """Numero massimo di analisi scrivibili in una sola transazione di write_analyses."""
+    document_count = FIRESTORE_MAX_TRANSACTION_OPS // 2
+    while write_analyses_ops(document_count, user_id) > FIRESTORE_MAX_TRANSACTION_OPS:
+        document_count -= 1
+    return document_count
+
+
+class BatchManifest:
+    """Manifest JSON dei risultati: salvato su disco (in modo atomico) a ogni cambio di stato."""
+
+    def __init__(self, path, user_id):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        else:
+            self.data = {"created_at": time.time(), "user_id": user_id, "items": {}}
+
+    def register(self, item):
+        with self._lock:
+            entry = self.data["items"].setdefault(item["id"], {"status": "pending", "attempts": 0})
+            entry.update({k: item[k] for k in ("pitch_deck", "business_plan", "document_id")})
+
+    def is_done(self, item_id):
+        return self.data["items"].get(item_id, {}).get("status") == "done"
+
+    def update(self, item_id, **fields):
+        with self._lock:
+            self.data["items"][item_id].update(fields)
+            self._save()
+
+    def summary(self):
+        counts = {}
+        for entry in self.data["items"].values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class BatchedFirestoreWriter:
+    """
+    Accumula le scritture delle analisi e le invia a Firestore in transazioni da `batch_size` documenti.
+    on_commit(item_ids, error) viene chiamato dopo ogni commit (error è None se è andato a buon fine).
+    """
+
+    def __init__(self, user_id, on_commit, batch_size=20):
+        self.user_id = user_id
+        self.on_commit = on_commit
+        self.batch_size = min(batch_size, max_documents_per_transaction(user_id))
+        self._pending = []
+        self._lock = threading.Lock()
+        self.commits = 0
+
+    def add(self, item_id, document_id, data):
+        with self._lock:
+            self._pending.append((item_id, document_id, data))
+            if len(self._pending) < self.batch_size:
+                return
+            to_commit, self._pending = self._pending, []
+        self._commit(to_commit)
+
+    def flush(self):
+        with self._lock:
+            to_commit, self._pending = self._pending, []
+        if to_commit:
+            self._commit(to_commit)
+
+    def _commit(self, entries):
+        analyses = {document_id: data for _, document_id, data in entries}
+        try:
+            # Transazione unica con leaderboard e statistiche di settore (z_score)
+            pipeline.write_analyses(analyses, self.user_id)
+            self.commits += 1
+            error = None
+        except Exception as e:
+            error = str(e)
+            print(f"ERRORE nel commit batch su Firestore ({len(entries)} documenti): {e}")
+        self.on_commit([item_id for item_id, _, _ in entries], error)
+
+
+def collect_local_items(directory):
+    """Elementi da una cartella locale di PDF, con associazione opzionale del business plan."""
+    pdfs = sorted(f for f in os.listdir(directory) if f.lower().endswith(".pdf"))
+    stems = {os.path.splitext(f)[0]: f for f in pdfs}
+    items = []
+    for stem, file_name in stems.items():
+        if any(stem.endswith(suffix) and stem[:-len(suffix)] in stems for suffix in BUSINESS_PLAN_SUFFIXES):
+            continue
+        business_plan = next(
+            (os.path.join(directory, stems[stem + suffix]) for suffix in BUSINESS_PLAN_SUFFIXES if stem + suffix in stems),
+            None
+        )
+        items.append({
+            "id": os.path.join(directory, file_name),
+            "source": "local",
+            "pitch_deck": os.path.join(directory, file_name),
+            "business_plan": business_plan,
+            "document_id": stem,
+        })
+    return items
+
+
+def collect_gcs_items(lines):
+    """Elementi da righe "<pitch_deck_path>[,<business_plan_path>]" relative al bucket Firebase."""
+    items = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = [part.strip() for part in line.split(",")]
+        pitch_deck = parts[0]
+        items.append({
+            "id": pitch_deck,
+            "source": "gcs",
+            "pitch_deck": pitch_deck,
+            "business_plan": parts[1] if len(parts) > 1 and parts[1] else None,
+            "document_id": os.path.splitext(os.path.basename(pitch_deck))[0],
+        })
+    return items
+
+
+def duplicate_document_ids(items):
+    """
+    {document_id: [id degli elementi]} per i document_id condivisi da più elementi distinti: ad es.
+    user_uploads/A/deck.pdf e user_uploads/B/deck.pdf, salvati altrimenti nello stesso documento.
+    """
+    by_document_id = {}
+    for item in items:
+        item_ids = by_document_id.setdefault(item["document_id"], [])
+        if item["id"] not in item_ids:
+            item_ids.append(item["id"])
+    return {document_id: item_ids for document_id, item_ids in by_document_id.items() if len(item_ids) > 1}
+
+
+def _extract_pages(item, path):
+    if item["source"] == "local":
+        report = extract_pdf_pages(path)
+    else:
+        # A differenza di start_analysis il blob sorgente non viene eliminato: l'elemento resta rielaborabile
+        blob = get_storage_client().bucket(pipeline.FIREBASE_STORAGE_BUCKET_NAME).blob(path)
+        report = extract_blob_text(blob)
+    return [page["text"] for page in report["pages"]]
+
+
+def process_item(item, extraction_slots):
+    """Estrae e analizza un elemento; restituisce (document_id, analisi) senza salvarla."""
+    stage_timings = {}
+    token_usage = {}
+    start = time.monotonic()
+    with extraction_slots:
+        deck_pages = _extract_pages(item, item["pitch_deck"])
+        business_plan_pages = _extract_pages(item, item["business_plan"]) if item["business_plan"] else None
+    stage_timings['extract'] = {"status": "ok", "duration_s": round(time.monotonic() - start, 3)}
+    if not any(page.strip() for page in deck_pages):
+        raise ValueError("Nessun testo estratto dal pitch deck.")
+
+    final_analysis = pipeline.analyze_extracted_pages(deck_pages, business_plan_pages, stage_timings, token_usage)
+    stage_timings['total_s'] = round(time.monotonic() - start, 3)
+    final_analysis['stage_timings'] = stage_timings
+    final_analysis['token_usage'] = token_usage
+    final_analysis['document_name'] = os.path.basename(item["pitch_deck"])
+    return item["document_id"], final_analysis
+
+
+def run_batch(items, manifest, user_id=None, concurrency=8, extraction_concurrency=None,
+              requests_per_minute=None, write_batch_size=20):
+    """
+    Elabora gli elementi non ancora completati con concorrenza limitata e salva i risultati
+    con scritture batch. Restituisce il riepilogo del manifest.
+    """
+    if requests_per_minute:
+        pipeline.openai_rate_limiter = RateLimiter(requests_per_minute)
+    extraction_slots = threading.BoundedSemaphore(extraction_concurrency or os.cpu_count() or 1)
+
+    for item in items:
+        manifest.register(item)
+    # Elementi con lo stesso document_id si sovrascriverebbero a vicenda: nessuno viene elaborato
+    duplicates = duplicate_document_ids(items)
+    for document_id, item_ids in duplicates.items():
+        print(f"ERRORE: document_id '{document_id}' condiviso da {len(item_ids)} elementi: {', '.join(item_ids)}")
+        for item_id in item_ids:
+            if not manifest.is_done(item_id):
+                manifest.update(item_id, status="failed", error=f"document_id '{document_id}' duplicato: rinominare i file.")
+    todo = [item for item in items if not manifest.is_done(item["id"]) and item["document_id"] not in duplicates]
+    print(f"INFO: Batch: {len(items)} elementi, {len(items) - len(todo)} già completati, {len(todo)} da elaborare.")
+
+    def on_commit(item_ids, error):
+        for item_id in item_ids:
+            if error:
+                manifest.update(item_id, status="failed", error=f"Salvataggio Firestore: {error}")
+            else:
+                manifest.update(item_id, status="done", error=None, completed_at=time.time())
+
+    writer = BatchedFirestoreWriter(user_id, on_commit, batch_size=write_batch_size)
+    batch_start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        futures = {}
+        for item in todo:
+            attempts = manifest.data["items"][item["id"]].get("attempts", 0) + 1
+            manifest.update(item["id"], status="running", attempts=attempts)
+            futures[executor.submit(process_item, item, extraction_slots)] = item
+        for completed, future in enumerate(as_completed(futures), start=1):
+            item = futures[future]
+            try:
+                document_id, final_analysis = future.result()
+                manifest.update(
+                    item["id"], status="analyzed",
+                    duration_s=final_analysis['stage_timings']['total_s'],
+                    final_adjusted_score=final_analysis.get('core_metrics', {}).get('final_adjusted_score')
+                )
+                writer.add(item["id"], document_id, final_analysis)
+            except Exception as e:
+                print(f"ERRORE nell'elaborazione di {item['id']}: {e}")
+                manifest.update(item["id"], status="failed", error=str(e))
+            print(f"INFO: Batch: {completed}/{len(todo)} elaborati.")
+    writer.flush()
+
+    elapsed = time.monotonic() - batch_start
+    summary = manifest.summary()
+    print(f"INFO: Batch completato in {elapsed:.1f}s ({writer.commits} commit Firestore): {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analisi batch di pitch deck.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--local-dir", help="Cartella locale con i PDF da analizzare.")
+    source.add_argument("--gcs-list", help="File con un percorso GCS per riga (deck[,business_plan]).")
+    parser.add_argument("--user-id", help="UID proprietario delle analisi (se assente: collezione pubblica).")
+    parser.add_argument("--manifest", default="batch_manifest.json", help="Percorso del manifest dei risultati.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Elementi elaborati in parallelo.")
+    parser.add_argument("--extraction-concurrency", type=int, default=None, help="Estrazioni PDF in parallelo.")
+    parser.add_argument("--requests-per-minute", type=float, default=None, help="Limite di richieste OpenAI al minuto.")
+    parser.add_argument("--write-batch-size", type=int, default=20, help="Documenti per batch di scrittura Firestore.")
+    args = parser.parse_args()
+
+    if args.local_dir:
+        items = collect_local_items(args.local_dir)
+    else:
+        with open(args.gcs_list, "r", encoding="utf-8") as f:
+            items = collect_gcs_items(f.readlines())
+
+    manifest = BatchManifest(args.manifest, args.user_id)
+    run_batch(
+        items, manifest, user_id=args.user_id, concurrency=args.concurrency,
+        extraction_concurrency=args.extraction_concurrency,
+        requests_per_minute=args.requests_per_minute, write_batch_size=args.write_batch_size
+    )
+
+
+if __name__ == "__main__":
+    main()
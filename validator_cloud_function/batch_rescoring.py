@@ -0,0 +1,337 @@
+"""
+Ri-valutazione offline dell'intero corpus tramite Batch API (es. dopo una modifica a RUBRICS
+o ai pesi di perform_additional_calculations). Non conta la latenza ma throughput e costo.
+
+Uso:
+    python batch_rescoring.py run --texts texts.jsonl --state rescoring_job.json
+    python batch_rescoring.py poll --state rescoring_job.json      # riprende un job già inviato
+    python batch_rescoring.py run --texts texts.jsonl --state job.json --backend fake
+    python batch_rescoring.py run --from-text-store --state rescoring_job.json
+
+texts.jsonl contiene una riga per documento:
+    {"user_id": "...", "document_id": "...", "text": "...", "has_business_plan": false}
+In alternativa, --from-text-store legge il testo estratto salvato dalla pipeline (campo source_text
+delle analisi, vedi text_store), senza scaricare né estrarre di nuovo i PDF.
+
+Fasi: build (file JSONL di richieste con lo stesso prompt di analyze_pitch_deck_with_gpt),
+submit (tramite backend batch), poll (fino al completamento) e merge (risultati riscritti nei
+documenti pitch_deck_analyses dei rispettivi utenti). Lo stato del job è salvato su file,
+quindi ogni fase può essere ripresa dopo un'interruzione.
+"""
+import argparse
+import io
+import json
+import os
+import time
+
+import main as pipeline
+from clients import APP_ID, get_firestore_client
+from leaderboard import add_leaderboard_writes
+from analysis_sync import add_version_bump
+from analysis_storage import add_analysis_update
+from llm_backends import fake_analysis_content, get_openai_client
+from prompt_templates import PROMPT_VERSION
+from sector_stats import rebuild_sector_stats
+from text_condensation import condense_for_llm, ANALYSIS_INPUT_TOKEN_BUDGET
+from text_store import create_text_store
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+MAX_REQUESTS_PER_FILE = int(os.environ.get("BATCH_MAX_REQUESTS_PER_FILE", "5000"))
+FIRESTORE_WRITE_BATCH_SIZE = 400
+
+
+class OpenAIBatchBackend:
+    """Backend reale: file JSONL caricati su OpenAI ed elaborati dalla Batch API (finestra 24h)."""
+
+    def __init__(self, client=None):
+        self.client = client or get_openai_client()
+
+    def submit(self, jsonl_bytes, metadata=None):
+        input_file = self.client.files.create(file=("requests.jsonl", io.BytesIO(jsonl_bytes)), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h", metadata=metadata
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        return batch.status
+
+    def results(self, batch_id):
+        """Restituisce {custom_id: contenuto della risposta o None se la richiesta è fallita}."""
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                body = response.get("body") or {}
+                choices = body.get("choices") or []
+                ok = response.get("status_code") == 200 and choices
+                results[record["custom_id"]] = choices[0]["message"]["content"] if ok else None
+        if batch.error_file_id:
+            for line in self.client.files.content(batch.error_file_id).text.splitlines():
+                if line.strip():
+                    results.setdefault(json.loads(line)["custom_id"], None)
+        return results
+
+
+class LocalFakeBatchBackend:
+    """
+    Backend locale per test ed esecuzioni offline: nessuna chiamata di rete.
+    Il batch risulta completato dopo `polls_until_complete` chiamate a status();
+    le risposte sono prodotte da `responder(request_body)`.
+    Con `path` i batch inviati sono salvati in un file JSON (accanto allo stato del job), così
+    `poll` funziona anche in un processo diverso da quello che ha eseguito `run`.
+    """
+
+    def __init__(self, responder=fake_analysis_content, polls_until_complete=1, path=None):
+        self.responder = responder
+        self.polls_until_complete = polls_until_complete
+        self.path = path
+        self._batches = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._batches = json.load(f)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._batches, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _batch(self, batch_id):
+        try:
+            return self._batches[batch_id]
+        except KeyError:
+            raise ValueError(
+                f"Batch fake sconosciuto: {batch_id}. Lo stato del backend fake non è stato trovato"
+                f"{f' in {self.path}' if self.path else ' (solo in memoria)'}: rilanciare il comando run."
+            ) from None
+
+    def submit(self, jsonl_bytes, metadata=None):
+        batch_id = f"fake_batch_{len(self._batches) + 1}"
+        requests = [json.loads(line) for line in jsonl_bytes.decode("utf-8").splitlines() if line.strip()]
+        self._batches[batch_id] = {"requests": requests, "polls": 0}
+        self._save()
+        return batch_id
+
+    def status(self, batch_id):
+        batch = self._batch(batch_id)
+        batch["polls"] += 1
+        self._save()
+        return "completed" if batch["polls"] >= self.polls_until_complete else "in_progress"
+
+    def results(self, batch_id):
+        return {request["custom_id"]: self.responder(request["body"]) for request in self._batch(batch_id)["requests"]}
+
+
+BATCH_BACKENDS = {"openai": OpenAIBatchBackend, "fake": LocalFakeBatchBackend}
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def load_texts_jsonl(path):
+    """Legge i testi dei deck da un file JSONL (user_id, document_id, text, has_business_plan)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_texts_from_store(db, app_id, text_store):
+    """
+    Testi dei deck delle analisi che hanno source_text, letti dal text store e condensati entro il
+    budget dell'analisi come nella pipeline. Le analisi senza testo salvato vengono saltate.
+    """
+    documents = []
+    missing = 0
+    for doc in db.collection_group('pitch_deck_analyses').select(['source_text']).stream():
+        path = doc.reference.path.split('/')
+        if path[0] != 'artifacts' or path[1] != app_id:
+            continue
+        source = (doc.to_dict() or {}).get('source_text') or {}
+        deck_pages = text_store.get(source['pitch_deck']) if source.get('pitch_deck') else None
+        business_plan_pages = text_store.get(source['business_plan']) if source.get('business_plan') else None
+        if deck_pages is None or (source.get('business_plan') and business_plan_pages is None):
+            missing += 1
+            continue
+        text, _ = condense_for_llm(deck_pages, business_plan_pages, ANALYSIS_INPUT_TOKEN_BUDGET)
+        documents.append({
+            "user_id": path[3] if path[2] == 'users' else None,
+            "document_id": doc.id,
+            "text": text,
+            "has_business_plan": business_plan_pages is not None,
+        })
+    print(f"INFO: {len(documents)} testi letti dal text store, {missing} analisi senza testo salvato saltate.")
+    return documents
+
+
+def build_request_files(documents, max_requests_per_file=MAX_REQUESTS_PER_FILE):
+    """
+    Costruisce i file JSONL (bytes) della Batch API e la mappa custom_id -> documento.
+    Ogni richiesta usa lo stesso corpo di analyze_pitch_deck_with_gpt.
+    """
+    files = []
+    targets = {}
+    lines = []
+    for index, document in enumerate(documents):
+        custom_id = f"req-{index}"
+        targets[custom_id] = {"user_id": document.get("user_id"), "document_id": document["document_id"]}
+        body = pipeline.build_analysis_request(document["text"], document.get("has_business_plan", False))
+        lines.append(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}, ensure_ascii=False))
+        if len(lines) >= max_requests_per_file:
+            files.append(("\n".join(lines) + "\n").encode("utf-8"))
+            lines = []
+    if lines:
+        files.append(("\n".join(lines) + "\n").encode("utf-8"))
+    return files, targets
+
+
+class RescoringJob:
+    """Stato persistente del job di re-scoring (batch inviati, destinazioni, esito del merge)."""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        else:
+            self.state = {"created_at": time.time(), "prompt_version": PROMPT_VERSION, "batches": [], "targets": {}, "merged": {}}
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def submit_job(job, backend, documents):
+    """Costruisce i file di richieste e li invia al backend; salva gli id dei batch nello stato."""
+    if job.state["batches"]:
+        print("INFO: Job già inviato, salto la fase di submit.")
+        return
+    files, targets = build_request_files(documents)
+    job.state["targets"] = targets
+    for index, jsonl_bytes in enumerate(files):
+        batch_id = backend.submit(jsonl_bytes, metadata={"job": "rescoring", "prompt_version": PROMPT_VERSION})
+        job.state["batches"].append({"id": batch_id, "status": "submitted", "file_index": index})
+        print(f"INFO: Inviato batch {batch_id} ({len(jsonl_bytes)} byte).")
+    job.save()
+
+
+def poll_job(job, backend, interval_s=60, timeout_s=26 * 3600):
+    """Attende che tutti i batch raggiungano uno stato finale."""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        pending = [batch for batch in job.state["batches"] if batch["status"] not in TERMINAL_STATUSES]
+        for batch in pending:
+            batch["status"] = backend.status(batch["id"])
+        job.save()
+        pending = [batch for batch in job.state["batches"] if batch["status"] not in TERMINAL_STATUSES]
+        if not pending:
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{len(pending)} batch non completati entro il timeout.")
+        print(f"INFO: {len(pending)} batch ancora in corso, nuovo controllo tra {interval_s}s.")
+        time.sleep(interval_s)
+
+
+def merge_results(job, backend):
+    """
+    Applica i risultati ai documenti pitch_deck_analyses: variabili, coppie di coerenza, settore
+    e core_metrics vengono sostituiti; executive_summary, document_name e gli altri campi restano.
+    Le motivazioni vanno nel documento dei dettagli (vedi analysis_storage).
+    """
+    writes = 0
+    batch = get_firestore_client().batch()
+    pending_ids = []
+    # Aggiornamenti dei leaderboard raggruppati per utente: {user_id: {document_id: dati}}
+    pending_leaderboard = {}
+
+    def commit():
+        nonlocal batch, pending_ids, pending_leaderboard
+        if not pending_ids:
+            return
+        for user_id, analyses in pending_leaderboard.items():
+            add_leaderboard_writes(batch, get_firestore_client(), APP_ID, user_id, analyses)
+            if user_id:
+                add_version_bump(batch, get_firestore_client(), APP_ID, user_id)
+        batch.commit()
+        for custom_id in pending_ids:
+            job.state["merged"][custom_id] = "done"
+        job.save()
+        batch, pending_ids, pending_leaderboard = get_firestore_client().batch(), [], {}
+
+    for batch_info in job.state["batches"]:
+        if batch_info["status"] != "completed":
+            print(f"ATTENZIONE: batch {batch_info['id']} in stato '{batch_info['status']}', risultati ignorati.")
+            continue
+        for custom_id, content in backend.results(batch_info["id"]).items():
+            if job.state["merged"].get(custom_id) == "done":
+                continue
+            target = job.state["targets"].get(custom_id)
+            analysis = pipeline.parse_analysis_response(content) if content else None
+            if not target or not analysis:
+                job.state["merged"][custom_id] = "failed"
+                continue
+            analysis = pipeline.perform_additional_calculations(analysis)
+            doc_ref = pipeline.get_analyses_collection(target["user_id"]).document(target["document_id"])
+            update = {
+                "settore": analysis["settore"],
+                "variabili_valutate": analysis.get("variabili_valutate", []),
+                "coerenza_coppie": analysis.get("coerenza_coppie", []),
+                "core_metrics": analysis["core_metrics"],
+                "rescoring": {"prompt_version": job.state["prompt_version"], "rescored_at": time.time()},
+                "updated_at": time.time(),
+            }
+            add_analysis_update(batch, doc_ref, update)
+            pending_leaderboard.setdefault(target["user_id"], {})[target["document_id"]] = update
+            pending_ids.append(custom_id)
+            writes += 1
+            # Due scritture per analisi (hot e dettagli) più al massimo uno shard globale del leaderboard;
+            # leaderboard e versione dell'utente (due per utente)
+            if 3 * len(pending_ids) + 2 * len(pending_leaderboard) >= FIRESTORE_WRITE_BATCH_SIZE:
+                commit()
+    commit()
+    if writes:
+        # I punteggi dell'intero corpus sono cambiati: statistiche e z_score vanno ricalcolati da zero
+        rebuild_sector_stats(get_firestore_client(), APP_ID)
+    failed = sum(1 for status in job.state["merged"].values() if status == "failed")
+    print(f"INFO: Merge completato: {writes} documenti aggiornati, {failed} risposte non valide.")
+    return writes, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-scoring offline del corpus tramite Batch API.")
+    parser.add_argument("command", choices=["run", "poll"], help="run: build+submit+poll+merge; poll: riprende un job inviato.")
+    parser.add_argument("--texts", help="JSONL con user_id, document_id, text, has_business_plan.")
+    parser.add_argument("--from-text-store", action="store_true", help="Legge i testi dal text store invece che da --texts.")
+    parser.add_argument("--state", default="rescoring_job.json", help="File di stato del job.")
+    parser.add_argument("--backend", choices=sorted(BATCH_BACKENDS), default="openai")
+    parser.add_argument("--poll-interval", type=float, default=60)
+    args = parser.parse_args()
+
+    if args.backend == "fake":
+        backend = LocalFakeBatchBackend(path=f"{os.path.splitext(args.state)[0]}.fake_batches.json")
+    else:
+        backend = BATCH_BACKENDS[args.backend]()
+    job = RescoringJob(args.state)
+    if args.command == "run":
+        if args.from_text_store:
+            text_store = create_text_store()
+            if text_store is None:
+                parser.error("--from-text-store richiede TEXT_STORE_BACKEND diverso da none")
+            documents = load_texts_from_store(get_firestore_client(), APP_ID, text_store)
+        elif args.texts:
+            documents = load_texts_jsonl(args.texts)
+        else:
+            parser.error("--texts o --from-text-store è obbligatorio per il comando run")
+        submit_job(job, backend, documents)
+    poll_job(job, backend, interval_s=args.poll_interval)
+    merge_results(job, backend)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Benchmark end-to-end della pipeline di analisi, senza rete né Firebase.
+
+Uso:
+    python benchmark_pipeline.py --output bench.json
+    python benchmark_pipeline.py --pages 5,20,60,120 --docs-per-size 3 --repeat 2 --output bench.json
+    python benchmark_pipeline.py --output bench_new.json --baseline bench.json   # confronto con un'esecuzione precedente
+
+Il corpus è composto da PDF generati (testo sintetico con intestazioni, piè di pagina e sezioni
+sulle 7 variabili) con il numero di pagine richiesto. Fasi misurate, nell'ordine della pipeline:
+    extract       estrazione del testo per pagina dal PDF locale (come get_text_from_storage, senza download)
+    prompt        condensazione entro il budget di token e costruzione della richiesta di analisi
+    llm           riassunto + analisi in parallelo con il backend LLM fake, e validazione dell'output
+    calculations  perform_additional_calculations
+    transform     trasformazione del documento salvato nel formato di fetchPitchData
+Per ogni fase: throughput, latenza p50/p95/media, durata della prima chiamata (percorso a freddo)
+e picco di RSS del processo (e dei processi figli, per l'estrazione parallela).
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from analysis_schema import extract_json_object, validate_analysis
+from llm_backends import FakeLLMBackend
+from parallel_stages import make_stage, run_parallel_stages
+from pdf_extraction import extract_pdf_pages
+from pitch_data_transform import transform_document
+from prompt_templates import SUMMARY_SYSTEM_PROMPT, build_analysis_request_body
+from rubrics import RUBRICS
+from scoring import perform_additional_calculations
+from text_condensation import condense_for_llm, ANALYSIS_INPUT_TOKEN_BUDGET, SUMMARY_INPUT_TOKEN_BUDGET
+
+STAGES = ("extract", "prompt", "llm", "calculations", "transform")
+DEFAULT_PAGE_COUNTS = (5, 15, 40, 100)
+BENCHMARK_MODEL = "benchmark"
+
+_WORDS = (
+    "mercato clienti ricavi crescita margine prodotto piattaforma utenti abbonamento vendite team "
+    "fondatori investimento round valutazione competitor soluzione problema target pilota brevetto "
+    "canale distribuzione costi acquisizione retention partnership scalabilità tecnologia dati"
+).split()
+
+
+# --- Generazione del corpus ---
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(pages):
+    """PDF minimale (font Helvetica, una pagina per elemento) dal testo di ogni pagina (lista di righe)."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        content = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(content.encode('latin-1'))} >>\nstream\n{content}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref_offset = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1"))
+    return output.getvalue()
+
+
+def generate_deck_pages(page_count, seed):
+    """Testo sintetico di un deck: intestazione e piè di pagina ripetuti, una sezione per pagina."""
+    rng = random.Random(seed)
+    variables = list(RUBRICS)
+    pages = []
+    for index in range(page_count):
+        variable = variables[index % len(variables)]
+        lines = [f"Startup {seed} - Documento riservato", f"{index + 1}. {variable.upper()}"]
+        for _ in range(rng.randint(25, 45)):
+            lines.append(" ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 14))) + f" {rng.randint(1, 999)}%")
+        lines.append(f"Pagina {index + 1} di {page_count}")
+        pages.append(lines)
+    return pages
+
+
+def generate_corpus(directory, page_counts, docs_per_size):
+    """Scrive i PDF del corpus in `directory`; restituisce la lista di {"path", "pages", "bytes"}."""
+    corpus = []
+    for page_count in page_counts:
+        for copy_index in range(docs_per_size):
+            seed = page_count * 1000 + copy_index
+            pdf_bytes = build_pdf(generate_deck_pages(page_count, seed))
+            path = os.path.join(directory, f"deck_{page_count}p_{copy_index}.pdf")
+            with open(path, "wb") as f:
+                f.write(pdf_bytes)
+            corpus.append({"path": path, "pages": page_count, "bytes": len(pdf_bytes)})
+    return corpus
+
+
+# --- Misure ---
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    # Su Linux ru_maxrss è in KB, su macOS in byte
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize_durations(durations, units=None):
+    """Statistiche di una fase: throughput (elementi/s), p50/p95/media e durata della prima chiamata."""
+    ordered = sorted(durations)
+    total = sum(durations)
+    summary = {
+        "count": len(durations),
+        "total_s": round(total, 4),
+        "throughput_per_s": round(len(durations) / total, 2) if total else None,
+        "p50_s": round(_percentile(ordered, 0.50), 6),
+        "p95_s": round(_percentile(ordered, 0.95), 6),
+        "mean_s": round(total / len(durations), 6),
+        "cold_s": round(durations[0], 6),
+    }
+    if units:
+        summary["units_per_s"] = round(sum(units) / total, 2) if total else None
+    return summary
+
+
+# --- Fasi ---
+
+def stage_extract(item):
+    report = extract_pdf_pages(item["path"])
+    return [page["text"] for page in report["pages"]]
+
+
+def stage_prompt(deck_pages):
+    analysis_text, _ = condense_for_llm(deck_pages, None, ANALYSIS_INPUT_TOKEN_BUDGET)
+    summary_text, _ = condense_for_llm(deck_pages, None, SUMMARY_INPUT_TOKEN_BUDGET)
+    return {
+        "analysis": build_analysis_request_body(analysis_text, False, BENCHMARK_MODEL),
+        "summary": {
+            "model": BENCHMARK_MODEL,
+            "messages": [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Basandoti su questo testo, crea il riassunto bilingue in formato JSON:\n\n{summary_text}"}
+            ],
+            "temperature": 0.1,
+            "max_tokens": 400,
+            "response_format": {"type": "json_object"}
+        },
+    }
+
+
+def stage_llm(backend, requests):
+    stages = {
+        "summary": make_stage(lambda: backend.complete(requests["summary"]).content, required=False),
+        "analysis": make_stage(lambda: backend.complete(requests["analysis"]).content, required=True),
+    }
+    results, _ = run_parallel_stages(stages)
+    analysis, missing_variables, missing_pairs = validate_analysis(extract_json_object(results["analysis"]))
+    if missing_variables or missing_pairs:
+        raise ValueError("Output del backend fake non valido.")
+    analysis["executive_summary"] = results["summary"]
+    return analysis
+
+
+def run_benchmark(corpus, repeat=1, llm_latency_s=0.0, llm_jitter_s=0.0, quiet=True):
+    """Esegue le fasi in sequenza (una fase alla volta su tutto il corpus) e restituisce le statistiche."""
+    backend = FakeLLMBackend(latency_s=llm_latency_s, jitter_s=llm_jitter_s)
+    durations = {stage: [] for stage in STAGES}
+    units = {stage: [] for stage in STAGES}
+    peaks = {}
+    sink = io.StringIO() if quiet else None
+
+    def timed(stage, fn, *args, unit=1):
+        start = time.perf_counter()
+        if sink is not None:
+            with contextlib.redirect_stdout(sink):
+                result = fn(*args)
+            sink.seek(0)
+            sink.truncate()
+        else:
+            result = fn(*args)
+        durations[stage].append(time.perf_counter() - start)
+        units[stage].append(unit)
+        return result
+
+    for _ in range(repeat):
+        extracted = [timed("extract", stage_extract, item, unit=item["pages"]) for item in corpus]
+        peaks["extract"] = (_peak_rss_mb(), _peak_rss_mb(resource.RUSAGE_CHILDREN))
+        requests = [timed("prompt", stage_prompt, pages) for pages in extracted]
+        peaks["prompt"] = (_peak_rss_mb(), _peak_rss_mb(resource.RUSAGE_CHILDREN))
+        analyses = [timed("llm", stage_llm, backend, request) for request in requests]
+        peaks["llm"] = (_peak_rss_mb(), _peak_rss_mb(resource.RUSAGE_CHILDREN))
+        results = [timed("calculations", perform_additional_calculations, analysis) for analysis in analyses]
+        peaks["calculations"] = (_peak_rss_mb(), _peak_rss_mb(resource.RUSAGE_CHILDREN))
+        for index, (item, result) in enumerate(zip(corpus, results)):
+            result["document_name"] = os.path.basename(item["path"])
+            timed("transform", transform_document, f"doc_{index}", result, "benchmark-user")
+        peaks["transform"] = (_peak_rss_mb(), _peak_rss_mb(resource.RUSAGE_CHILDREN))
+
+    stats = {}
+    for stage in STAGES:
+        stats[stage] = summarize_durations(durations[stage], units[stage] if stage == "extract" else None)
+        stats[stage]["peak_rss_mb"], stats[stage]["children_peak_rss_mb"] = peaks[stage]
+    stats["extract"]["unit"] = "pages"
+    stats["llm"]["backend_calls"] = backend.calls
+    return stats
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare_results(current, baseline):
+    """Righe di confronto p50/p95 per fase rispetto a un'esecuzione precedente (variazione percentuale)."""
+    lines = []
+    for stage in STAGES:
+        now, before = current["stages"].get(stage), baseline.get("stages", {}).get(stage)
+        if not now or not before:
+            continue
+        deltas = []
+        for metric in ("p50_s", "p95_s", "cold_s"):
+            if before.get(metric):
+                deltas.append(f"{metric} {(now[metric] - before[metric]) / before[metric] * 100:+.1f}%")
+        lines.append(f"{stage:>12}: " + ", ".join(deltas))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end della pipeline di analisi (senza rete).")
+    parser.add_argument("--pages", default=",".join(str(n) for n in DEFAULT_PAGE_COUNTS), help="Numeri di pagine dei PDF generati.")
+    parser.add_argument("--docs-per-size", type=int, default=3, help="PDF generati per ogni numero di pagine.")
+    parser.add_argument("--repeat", type=int, default=1, help="Ripetizioni dell'intero corpus.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Latenza simulata di ogni chiamata LLM (s).")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Variazione massima della latenza simulata (s).")
+    parser.add_argument("--output", default="benchmark_results.json", help="File JSON dei risultati.")
+    parser.add_argument("--baseline", help="Risultati di un'esecuzione precedente da confrontare.")
+    parser.add_argument("--verbose", action="store_true", help="Mostra i log della pipeline durante le misure.")
+    args = parser.parse_args()
+
+    page_counts = [int(value) for value in args.pages.split(",") if value.strip()]
+    with tempfile.TemporaryDirectory(prefix="validatr_bench_") as directory:
+        corpus = generate_corpus(directory, page_counts, args.docs_per_size)
+        stages = run_benchmark(
+            corpus, repeat=args.repeat, llm_latency_s=args.llm_latency, llm_jitter_s=args.llm_jitter,
+            quiet=not args.verbose
+        )
+
+    results = {
+        "created_at": time.time(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "pages": page_counts, "docs_per_size": args.docs_per_size, "repeat": args.repeat,
+            "llm_latency_s": args.llm_latency, "llm_jitter_s": args.llm_jitter,
+        },
+        "corpus": [{"pages": item["pages"], "bytes": item["bytes"]} for item in corpus],
+        "stages": stages,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for stage in STAGES:
+        s = stages[stage]
+        print(
+            f"{stage:>12}: {s['throughput_per_s']}/s  p50 {s['p50_s'] * 1000:.1f}ms  p95 {s['p95_s'] * 1000:.1f}ms  "
+            f"cold {s['cold_s'] * 1000:.1f}ms  peak RSS {s['peak_rss_mb']}MB"
+        )
+    print(f"Risultati salvati in {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Confronto con {args.baseline} (commit {baseline.get('git_commit')}):")
+        for line in compare_results(results, baseline):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from analysis_cache import hash_content, normalize_text
+from rubrics import RUBRICS
+from text_condensation import count_tokens, dedupe_pages, split_sections
+
+# --- Analisi map-reduce dei business plan molto lunghi ---
+# Oltre MAP_REDUCE_THRESHOLD_TOKENS il business plan non viene più ridotto alle sole sezioni
+# che entrano nel budget: viene diviso in frammenti, da ognuno si estraggono in parallelo le
+# evidenze per ogni variabile di RUBRICS (map) e il digest delle evidenze sostituisce il testo
+# del business plan nella chiamata di analisi finale (reduce), che produce lo stesso JSON di sempre.
+
+MAP_REDUCE_THRESHOLD_TOKENS = int(os.environ.get("MAP_REDUCE_THRESHOLD_TOKENS", "16000"))
+MAP_REDUCE_CONCURRENCY = int(os.environ.get("MAP_REDUCE_CONCURRENCY", "4"))
+CHUNK_MIN_TOKENS = 1500
+CHUNK_MAX_TOKENS = 4000
+# Un frammento si chiude su una sezione il cui hash è multiplo di questo valore (dopo CHUNK_MIN_TOKENS):
+# i confini dipendono dal contenuto, quindi una modifica locale cambia solo i frammenti vicini.
+CHUNK_BOUNDARY_MODULUS = 3
+MAX_EVIDENCE_PER_VARIABLE = 12
+
+EVIDENCE_DIGEST_HEADER = "\n\n--- EVIDENZE ESTRATTE DAL BUSINESS PLAN (per variabile) ---\n\n"
+
+
+def business_plan_tokens(business_plan_pages):
+    return sum(count_tokens(page) for page in business_plan_pages or [])
+
+
+def should_use_map_reduce(business_plan_pages, threshold_tokens=MAP_REDUCE_THRESHOLD_TOKENS):
+    """True se il business plan è troppo lungo per essere inviato (anche condensato) in un'unica chiamata."""
+    return business_plan_pages is not None and business_plan_tokens(business_plan_pages) > threshold_tokens
+
+
+def chunk_business_plan(business_plan_pages):
+    """
+    Divide il business plan ripulito in frammenti di CHUNK_MIN_TOKENS-CHUNK_MAX_TOKENS token,
+    composti da sezioni intere e con confini definiti dal contenuto.
+    """
+    cleaned_pages, _ = dedupe_pages(business_plan_pages)
+    sections = split_sections("\n".join(cleaned_pages), max_section_tokens=CHUNK_MAX_TOKENS)
+    chunks = []
+    current = []
+    current_tokens = 0
+    for section in sections:
+        section_tokens = count_tokens(section)
+        if current and current_tokens + section_tokens > CHUNK_MAX_TOKENS:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(section)
+        current_tokens += section_tokens
+        boundary = int(hash_content(normalize_text(section))[:8], 16) % CHUNK_BOUNDARY_MODULUS == 0
+        if current_tokens >= CHUNK_MIN_TOKENS and boundary:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def chunk_cache_key(chunk, model, map_prompt_version):
+    return hash_content({
+        "kind": "business_plan_chunk",
+        "text": hash_content(normalize_text(chunk)),
+        "model": model,
+        "prompt": map_prompt_version,
+    })
+
+
+def parse_evidence_response(content):
+    """Interpreta la risposta della fase map; restituisce {variabile: [evidenze]} con le sole variabili note."""
+    try:
+        evidence = json.loads(content).get("evidenze") or {}
+    except (json.JSONDecodeError, AttributeError) as e:
+        print(f"ATTENZIONE: risposta della fase map non valida: {e}")
+        return None
+    return {
+        variable: [str(item).strip() for item in evidence.get(variable) or [] if str(item).strip()]
+        for variable in RUBRICS
+    }
+
+
+def map_chunks(chunks, extract_fn, cache=None, cache_key_fn=None, concurrency=MAP_REDUCE_CONCURRENCY):
+    """
+    Fase map: esegue extract_fn(chunk) -> {variabile: [evidenze]} su ogni frammento con al massimo
+    `concurrency` chiamate contemporanee. I risultati già in cache (chiave cache_key_fn(chunk))
+    non vengono ricalcolati. Restituisce (risultati nell'ordine dei frammenti, report).
+    """
+    report = {"chunks": len(chunks), "cache_hits": 0, "failed": 0}
+    results = [None] * len(chunks)
+    todo = []
+    for index, chunk in enumerate(chunks):
+        cached = None
+        if cache is not None:
+            try:
+                cached = cache.get(cache_key_fn(chunk))
+            except Exception as e:
+                print(f"ATTENZIONE: lettura dalla cache dei frammenti fallita: {e}")
+        if cached:
+            results[index] = cached["evidenze"]
+            report["cache_hits"] += 1
+        else:
+            todo.append(index)
+
+    def run(index):
+        evidence = extract_fn(chunks[index])
+        if evidence is not None and cache is not None:
+            try:
+                cache.put(cache_key_fn(chunks[index]), {"evidenze": evidence})
+            except Exception as e:
+                print(f"ATTENZIONE: scrittura nella cache dei frammenti fallita: {e}")
+        return evidence
+
+    start = time.monotonic()
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(todo))), thread_name_prefix="bp-map") as executor:
+            futures = {index: executor.submit(contextvars.copy_context().run, run, index) for index in todo}
+            for index, future in futures.items():
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    print(f"ERRORE nella fase map per il frammento {index + 1}/{len(chunks)}: {e}")
+                if results[index] is None:
+                    report["failed"] += 1
+    report["duration_s"] = round(time.monotonic() - start, 3)
+    return results, report
+
+
+def build_evidence_digest(chunk_results, max_per_variable=MAX_EVIDENCE_PER_VARIABLE):
+    """Fase reduce (input): unisce le evidenze dei frammenti per variabile, senza duplicati."""
+    lines = []
+    for variable in RUBRICS:
+        seen = set()
+        items = []
+        for evidence in chunk_results:
+            for item in (evidence or {}).get(variable, []):
+                key = normalize_text(item).lower()
+                if key not in seen:
+                    seen.add(key)
+                    items.append(item)
+        lines.append(f"## {variable}")
+        lines.extend(f"- {item}" for item in items[:max_per_variable])
+        if not items:
+            lines.append("- Nessuna evidenza nel business plan.")
+        lines.append("")
+    return "\n".join(lines).strip()
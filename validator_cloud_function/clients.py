@@ -0,0 +1,47 @@
+import functools
+import os
+
+# --- Client Google Cloud e Firebase condivisi, creati alla prima richiesta ---
+# Le funzioni non inizializzano più Firebase, Firestore o Storage durante l'import del modulo:
+# ogni client viene costruito (e i relativi moduli importati) solo quando serve, una volta per
+# processo, e poi riutilizzato dalle richieste successive. Così il cold start di una funzione
+# paga solo i client che usa davvero (es. fetchPitchData: Firestore e Auth, nessun client Storage).
+
+APP_ID = os.environ.get('CANVAS_APP_ID', 'validatr-mvp')
+
+
+@functools.lru_cache(maxsize=None)
+def get_firebase_app():
+    """Inizializza (una sola volta) l'SDK Firebase Admin con le credenziali di default dell'ambiente."""
+    import firebase_admin
+    from firebase_admin import credentials
+    if not firebase_admin._apps:
+        try:
+            firebase_admin.initialize_app(credentials.ApplicationDefault())
+            print("Firebase Admin SDK inizializzato con successo.")
+        except Exception as e:
+            print(f"Errore nell'inizializzazione di Firebase Admin SDK: {e}")
+            raise
+    return firebase_admin.get_app()
+
+
+@functools.lru_cache(maxsize=None)
+def get_firestore_client():
+    """Client Firestore del processo."""
+    get_firebase_app()
+    from firebase_admin import firestore
+    return firestore.client()
+
+
+@functools.lru_cache(maxsize=None)
+def get_storage_client():
+    """Client Cloud Storage del processo."""
+    from google.cloud import storage
+    return storage.Client()
+
+
+def get_auth():
+    """Modulo firebase_admin.auth, con l'app Firebase già inizializzata."""
+    get_firebase_app()
+    from firebase_admin import auth
+    return auth
@@ -0,0 +1,131 @@
+"""
+Ricalcolo in blocco di core_metrics per l'intero corpus con una configurazione di scoring
+(scoring_configs.json), senza chiamate all'LLM: i punteggi di variabili_valutate e coerenza_coppie
+già salvati vengono caricati in array NumPy e final_score, indice_coerenza, final_adjusted_score e
+classe_pitch di tutti i documenti vengono calcolati in un solo passaggio vettoriale.
+
+Uso:
+    python core_metrics_rescoring.py --scoring-version v2 --dry-run   # quanti documenti cambierebbero
+    python core_metrics_rescoring.py --scoring-version v2
+
+Vengono riscritti (in batch) solo i documenti le cui metriche o versione di scoring cambiano,
+insieme ai leaderboard e alla versione delle analisi dei rispettivi utenti; al termine le
+statistiche di settore e gli z_score vengono ricalcolati da zero.
+Per un re-scoring che cambia i punteggi delle variabili (nuovo prompt o RUBRICS) vedi batch_rescoring.py.
+"""
+import argparse
+import time
+
+from analysis_sync import add_version_bump
+from leaderboard import add_leaderboard_writes
+from scoring import get_scoring_config, compute_core_metrics_arrays, build_core_metrics
+from sector_stats import rebuild_sector_stats
+
+FIRESTORE_WRITE_BATCH_SIZE = 400
+SCORE_FIELDS = ['settore', 'variabili_valutate', 'coerenza_coppie', 'core_metrics', 'calcoli_aggiuntivi']
+
+
+def load_corpus(db, app_id):
+    """Riferimenti e punteggi di tutte le analisi dell'app (solo i campi necessari al calcolo)."""
+    refs, documents = [], []
+    for doc in db.collection_group('pitch_deck_analyses').select(SCORE_FIELDS).stream():
+        path = doc.reference.path.split('/')
+        if path[0] != 'artifacts' or path[1] != app_id:
+            continue
+        data = doc.to_dict()
+        if not data.get('variabili_valutate'):
+            continue
+        refs.append(doc.reference)
+        documents.append(data)
+    return refs, documents
+
+
+def changed_core_metrics(documents, config):
+    """
+    Calcolo vettoriale e confronto con le metriche salvate.
+    Restituisce [(indice del documento, nuovo core_metrics)] per i soli documenti cambiati.
+    """
+    arrays = compute_core_metrics_arrays(documents, config)
+    changes = []
+    for index, data in enumerate(documents):
+        current = data.get('core_metrics') or {}
+        # float(): l'arrotondamento deve essere quello di Python, come in perform_additional_calculations
+        metrics = build_core_metrics(
+            float(arrays['final_score'][index]), float(arrays['indice_coerenza'][index]),
+            float(arrays['final_adjusted_score'][index]), config, z_score=current.get('z_score')
+        )
+        if any(current.get(key) != value for key, value in metrics.items()):
+            # Eventuali altri campi già presenti (es. userId dei documenti legacy) vengono mantenuti
+            changes.append((index, {**current, **metrics}))
+    return changes
+
+
+def write_changes(db, app_id, refs, documents, changes):
+    """Scrive i core_metrics cambiati in batch, con leaderboard e versione delle analisi per utente."""
+    batch = db.batch()
+    pending = 0
+    # {user_id: {document_id: dati}} per le scritture dei leaderboard del batch corrente
+    pending_users = {}
+    now = time.time()
+
+    def commit():
+        nonlocal batch, pending, pending_users
+        for user_id, analyses in pending_users.items():
+            add_leaderboard_writes(batch, db, app_id, user_id, analyses)
+            if user_id:
+                add_version_bump(batch, db, app_id, user_id, now)
+        batch.commit()
+        batch, pending, pending_users = db.batch(), 0, {}
+
+    for index, metrics in changes:
+        doc_ref = refs[index]
+        path = doc_ref.path.split('/')
+        user_id = path[3] if path[2] == 'users' else None
+        batch.update(doc_ref, {'core_metrics': metrics, 'updated_at': now})
+        pending_users.setdefault(user_id, {})[doc_ref.id] = {'settore': documents[index].get('settore'), 'core_metrics': metrics}
+        pending += 1
+        # Per documento al massimo uno shard globale del leaderboard; per utente leaderboard e versione
+        if 2 * pending + 2 * len(pending_users) >= FIRESTORE_WRITE_BATCH_SIZE:
+            commit()
+    if pending:
+        commit()
+
+
+def rescore_corpus(db, app_id, version=None, dry_run=False):
+    """Ricalcola core_metrics di tutto il corpus con la configurazione `version`; restituisce il report."""
+    config = get_scoring_config(version)
+    start = time.monotonic()
+    refs, documents = load_corpus(db, app_id)
+    loaded = time.monotonic()
+    compute_start = time.process_time()
+    changes = changed_core_metrics(documents, config)
+    compute_cpu_s = time.process_time() - compute_start
+    report = {
+        "scoring_version": config["version"],
+        "documents": len(documents),
+        "changed": len(changes),
+        "load_s": round(loaded - start, 3),
+        "compute_cpu_s": round(compute_cpu_s, 3),
+        "dry_run": dry_run,
+    }
+    if changes and not dry_run:
+        write_start = time.monotonic()
+        write_changes(db, app_id, refs, documents, changes)
+        report["write_s"] = round(time.monotonic() - write_start, 3)
+        # I final_adjusted_score sono cambiati: statistiche di settore e z_score vanno ricalcolati
+        rebuild_sector_stats(db, app_id)
+    report["total_s"] = round(time.monotonic() - start, 3)
+    print(
+        f"INFO: Re-scoring {config['version']}: {len(changes)} documenti cambiati su {len(documents)} "
+        f"(calcolo {report['compute_cpu_s']}s CPU{', dry run' if dry_run else ''})."
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ricalcolo in blocco di core_metrics con una configurazione di scoring.")
+    parser.add_argument("--scoring-version", help="Versione in scoring_configs.json (default: SCORING_VERSION).")
+    parser.add_argument("--dry-run", action="store_true", help="Calcola e conta i documenti cambiati senza scrivere.")
+    args = parser.parse_args()
+    from clients import APP_ID, get_firestore_client
+    rescore_corpus(get_firestore_client(), APP_ID, args.scoring_version, dry_run=args.dry_run)
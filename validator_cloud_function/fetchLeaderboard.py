@@ -0,0 +1,65 @@
+import functions_framework
+import json
+from clients import APP_ID, get_firestore_client
+from auth_cache import verify_id_token
+from leaderboard import user_leaderboard_ref, global_leaderboard_refs, merge_shards, sorted_entries
+
+# Firebase Admin SDK e Firestore vengono inizializzati alla prima richiesta (vedi clients)
+
+@functions_framework.http
+def fetchLeaderboard(request):
+    """
+    Restituisce il ranking compatto dei pitch deck leggendo il documento di leaderboard dell'utente
+    o, per lo scope globale, tutti gli shard globali in un solo get_all.
+    Parametri: scope=user (default) | global, sector=<settore> (opzionale).
+    Lo scope globale contiene le analisi di tutti gli utenti ed è riservato agli account con claim 'admin'.
+    """
+    print(f"Richiesta ricevuta: {request.url}, Metodo: {request.method}")
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': 'https://validatr-mvp.web.app',
+        'Access-Control-Allow-Methods': 'GET, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+        'Access-Control-Max-Age': '3600'
+    }
+
+    if request.method == 'OPTIONS':
+        return ('', 204, headers)
+
+    auth_header = request.headers.get('Authorization')
+    id_token = None
+    if auth_header and auth_header.startswith('Bearer '):
+        id_token = auth_header.split(' ')[1]
+
+    if not id_token:
+        print("Errore: Token di autenticazione mancante nell'header 'Authorization'.")
+        return json.dumps({"error": "Unauthorized: No authentication token provided."}), 401, headers
+
+    try:
+        decoded_token = verify_id_token(id_token)
+        uid = decoded_token['uid']
+    except Exception as e:
+        print(f"Errore nella verifica del token Firebase: {e}")
+        return json.dumps({"error": f"Unauthorized: Invalid token. {e}"}), 401, headers
+
+    scope = request.args.get('scope', 'user')
+    if scope not in ('user', 'global'):
+        return json.dumps({"error": "Bad request: scope deve essere 'user' o 'global'."}), 400, headers
+    if scope == 'global' and not decoded_token.get('admin'):
+        return json.dumps({"error": "Forbidden: il leaderboard globale è riservato agli amministratori."}), 403, headers
+
+    try:
+        db = get_firestore_client()
+        if scope == 'user':
+            snapshot = user_leaderboard_ref(db, APP_ID, uid).get()
+            leaderboard_data = snapshot.to_dict() if snapshot.exists else None
+        else:
+            leaderboard_data = merge_shards(db.get_all(global_leaderboard_refs(db, APP_ID)))
+        entries = sorted_entries(leaderboard_data, sector=request.args.get('sector'))
+        print(f"Leaderboard '{scope}': {len(entries)} voci.")
+    except Exception as e:
+        print(f"Errore nel recupero del leaderboard da Firestore: {e}")
+        return json.dumps({"error": "Internal server error: Could not retrieve leaderboard."}), 500, headers
+
+    return json.dumps({"scope": scope, "entries": entries}), 200, headers
@@ -1,30 +1,38 @@
 import functions_framework
 import json
-import os
-from firebase_admin import credentials, firestore, auth, initialize_app
-import firebase_admin
+import time
+from clients import APP_ID, get_firestore_client
+from auth_cache import verify_id_token
+from analysis_sync import read_sync_meta, tombstones_collection, compute_etag, content_etag, etag_matches, parse_since
+from analysis_storage import read_analysis
+from pitch_data_transform import parse_parts, firestore_field_paths, transform_document
+from telemetry import start_trace, current_trace, span, count, payload_size
 
-# --- Inizializzazione Firebase Admin SDK ---
-if not firebase_admin._apps:
-    try:
-        cred = credentials.ApplicationDefault()
-        initialize_app(cred)
-        print("Firebase Admin SDK inizializzato con successo per fetchPitchData.")
-    except Exception as e:
-        print(f"Errore nell'inizializzazione di Firebase Admin SDK per fetchPitchData: {e}")
+# Firebase Admin SDK e Firestore vengono inizializzati alla prima richiesta (vedi clients)
 
-db = firestore.client()
-APP_ID = os.environ.get('CANVAS_APP_ID', 'validatr-mvp')
+MAX_PAGE_SIZE = 200
+# Ordinamenti supportati dal parametro `sort` -> campo Firestore
+SORT_FIELDS = {'final_adjusted_score': 'core_metrics.final_adjusted_score'}
 
 @functions_framework.http
 def fetchPitchData(request):
+    """Restituisce le analisi dell'utente autenticato; ogni richiesta emette una traccia "fetchPitchData" (vedi telemetry)."""
+    with start_trace("fetchPitchData", method=request.method) as trace:
+        response = handle_fetch_pitch_data(request)
+        trace.set(status_code=response[1])
+        if isinstance(response[0], str):
+            count("payload_bytes_out", payload_size(response[0]))
+        return response
+
+def handle_fetch_pitch_data(request):
     print(f"Richiesta ricevuta: {request.url}, Metodo: {request.method}")
 
     headers = {
         'Content-Type': 'application/json',
         'Access-Control-Allow-Origin': 'https://validatr-mvp.web.app', # Controlla questa origine!
         'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match',
+        'Access-Control-Expose-Headers': 'ETag, X-Sync-Token',
         'Access-Control-Max-Age': '3600'
     }
 
@@ -43,109 +51,150 @@ def fetchPitchData(request):
 
     uid = None
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        with span("auth"):
+            decoded_token = verify_id_token(id_token)
         uid = decoded_token['uid']
         print(f"Utente autenticato: UID={uid}, Email={decoded_token.get('email', 'N/A')}")
+        current_trace().set(user_id=uid)
     except Exception as e:
         print(f"Errore nella verifica del token Firebase: {e}")
         return json.dumps({"error": f"Unauthorized: Invalid token. {e}"}), 401, headers
 
+    # --- Parametri di query: paginazione, proiezione dei campi, filtri e ordinamento ---
+    # Senza parametri la risposta resta la mappa completa {doc_id: dati} usata finora dalla dashboard.
+    # `since` (il sync_token di una risposta precedente) restituisce solo le modifiche successive:
+    # {"documents": {...}, "deleted": [...], "sync_token": ..., "full": false}.
+    # Le liste leggono solo i documenti hot (punteggi senza motivazioni, vedi analysis_storage);
+    # `detail={document_id}` restituisce un'analisi completa di motivazioni: {document_id: dati}.
+    args = request.args
+    try:
+        parts = parse_parts(args.get('fields'))
+        page_size = int(args['page_size']) if args.get('page_size') else None
+        if page_size is not None and not 1 <= page_size <= MAX_PAGE_SIZE:
+            raise ValueError(f"page_size deve essere compreso tra 1 e {MAX_PAGE_SIZE}.")
+        sort = args.get('sort')
+        if sort and sort not in SORT_FIELDS:
+            raise ValueError(f"Ordinamento non supportato: {sort}. Valori ammessi: {', '.join(SORT_FIELDS)}.")
+        since = args.get('since')
+        if since and any(args.get(name) for name in ('page_size', 'cursor', 'sector', 'classe', 'sort')):
+            raise ValueError("since è combinabile solo con fields.")
+        since_lower_bound = parse_since(since) if since else None
+        detail = args.get('detail')
+        if detail and len(args) > 1:
+            raise ValueError("detail non è combinabile con altri parametri.")
+    except ValueError as e:
+        return json.dumps({"error": f"Bad request: {e}"}), 400, headers
+
+    cursor = args.get('cursor')
+    sector = args.get('sector')
+    pitch_class = args.get('classe')
+    paginated = any(args.get(name) for name in ('page_size', 'cursor', 'fields', 'sector', 'classe', 'sort'))
+
     data = {}
+    deleted = []
     try:
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        from google.cloud.firestore_v1.field_path import FieldPath
+        db = get_firestore_client()
         collection_ref = db.collection('artifacts').document(APP_ID).collection('users').document(uid).collection('pitch_deck_analyses')
         print(f"Recupero pitch dalla collezione dell'utente: {collection_ref.id}")
-        
-        docs = collection_ref.stream()
-        for doc in docs:
-            doc_data = doc.to_dict()
-            
-            transformed_doc_data = {}
-            
-            
-            original_doc_name = doc_data.get('document_name', doc.id)
-            
-            # Controlla se il nome finisce con '.pdf' (ignorando maiuscole/minuscole) e lo rimuove.
-            if original_doc_name.lower().endswith('.pdf'):
-                cleaned_doc_name = original_doc_name[:-4]
-            else:
-                cleaned_doc_name = original_doc_name
-            
-            transformed_doc_data['document_name'] = cleaned_doc_name
-
-            summary = doc_data.get('executive_summary')
-
-            if summary and isinstance(summary, str):
-                try:
-                    # Tenta di convertirla in un dizionario Python
-                    summary = json.loads(summary)
-                    print(f"INFO: Sommario per {doc.id} convertito da stringa a oggetto.")
-                except json.JSONDecodeError:
-                    print(f"WARNING: executive_summary per {doc.id} non è un JSON valido.")
-                    summary = None # Scarta il sommario se non è un JSON valido
-
-            if summary:
-                transformed_doc_data['executive_summary'] = summary
-
-            transformed_doc_data['document_name'] = doc_data.get('document_name', doc.id)
-            if 'core_metrics' in doc_data and doc_data['core_metrics']:
-                transformed_doc_data['core_metrics'] = {
-                    'indice_coerenza': doc_data['core_metrics'].get('indice_coerenza'),
-                    'classe_pitch': doc_data['core_metrics'].get('classe_pitch'), # UTILE PER NUOVI DOCUMENTI
-                    'z_score': doc_data['core_metrics'].get('z_score'),
-                    'final_adjusted_score': doc_data['core_metrics'].get('final_adjusted_score'),
-                    'final_score': doc_data['core_metrics'].get('final_score'),
-                    'userId': doc_data['core_metrics'].get('userId', uid)
-                }
-            elif 'calcoli_aggiuntivi' in doc_data and doc_data['calcoli_aggiuntivi']: # Fallback per vecchi documenti
-                print(f"DEBUG: Documento '{doc.id}' usa il vecchio formato 'calcoli_aggiuntivi'.")
-                transformed_doc_data['core_metrics'] = {
-                    'indice_coerenza': doc_data['calcoli_aggiuntivi'].get('indice_coerenza'),
-                    'classe_pitch': doc_data['calcoli_aggiuntivi'].get('classe'), # Vecchia chiave 'classe'
-                    'z_score': doc_data['calcoli_aggiuntivi'].get('z_score'),
-                    'final_adjusted_score': doc_data['calcoli_aggiuntivi'].get('final_adjusted_score'),
-                    'final_score': doc_data['calcoli_aggiuntivi'].get('final_score'),
-                    'userId': doc_data['calcoli_aggiuntivi'].get('userId', uid)
-                }
-            else:
-                print(f"DEBUG: Documento '{doc.id}' non ha 'core_metrics' né 'calcoli_aggiuntivi'.")
-                transformed_doc_data['core_metrics'] = {
-                    'indice_coerenza': None, 'classe_pitch': None, 'z_score': None,
-                    'final_adjusted_score': None, 'final_score': None, 'userId': uid
-                }
-
-            # --- Gestione di 'variabili_valutate' ---
-            transformed_doc_data['variables'] = []
-            transformed_doc_data['settore'] = doc_data.get('settore')
-            print(f"DEBUG: Documento '{doc.id}', Settore: {transformed_doc_data['settore']}")
-            # --- FINE AGGIUNTA CAMPO 'settore' ---
-            if 'variabili_valutate' in doc_data and doc_data['variabili_valutate']:
-                for var in doc_data['variabili_valutate']:
-                    motivation = var.get('motivazione')
-                    # 'motivation' sarà già un dict se dal nuovo formato, o stringa se dal vecchio.
-                    # Non fare json.loads() qui, il dato è già come ci serve per Python
-                    transformed_doc_data['variables'].append({
-                        'nome_variabile': var.get('nome'),
-                        'punteggio_variabile': var.get('punteggio'),
-                        'motivazione_variabile': motivation # Passa direttamente l'oggetto/stringa
-                    })
-
-            # --- Gestione di 'coerenza_coppie' ---
-            transformed_doc_data['coherence_pairs'] = []
-            if 'coerenza_coppie' in doc_data and doc_data['coerenza_coppie']:
-                for cp in doc_data['coerenza_coppie']:
-                    motivation = cp.get('motivazione')
-                    # 'motivation' sarà già un dict se dal nuovo formato, o stringa se dal vecchio.
-                    transformed_doc_data['coherence_pairs'].append({
-                        'nome_coppia': cp.get('coppia'),
-                        'punteggio_coppia': cp.get('punteggio'),
-                        'motivazione_coppia': motivation # Passa direttamente l'oggetto/stringa
-                    })
-            
-            data[doc.id] = transformed_doc_data
+
+        # --- Versione delle analisi: ETag e sync_token (letti prima dei documenti, vedi analysis_sync) ---
+        meta = read_sync_meta(db, APP_ID, uid)
+        count("firestore_reads")
+        sync_token = meta['updated_at'] if meta and meta.get('updated_at') else time.time()
+        etag = compute_etag(uid, meta, sorted(args.items(multi=True)))
+        headers['Cache-Control'] = 'private, no-cache'
+        headers['X-Sync-Token'] = str(sync_token)
+        if etag:
+            headers['ETag'] = etag
+            if etag_matches(request.headers.get('If-None-Match'), etag):
+                print("Analisi invariate rispetto alla versione del client: 304.")
+                return '', 304, headers
+
+        if detail:
+            with span("detail"):
+                analysis = read_analysis(collection_ref.document(detail))
+            count("firestore_reads", 2)
+            if analysis is None:
+                return json.dumps({"error": "Analisi non trovata."}), 404, headers
+            return with_content_etag(request, json.dumps({detail: transform_document(detail, analysis, uid)}), headers, etag)
+
+        query = collection_ref
+        # I filtri vengono eseguiti da Firestore. Nota: settore/classe combinati con l'ordinamento
+        # per punteggio richiedono un indice composito; i documenti legacy senza core_metrics
+        # vengono esclusi dai filtri/ordinamenti su core_metrics.
+        if sector:
+            query = query.where(filter=FieldFilter('settore', '==', sector))
+        if pitch_class:
+            query = query.where(filter=FieldFilter('core_metrics.classe_pitch', '==', pitch_class))
+        if since_lower_bound is not None:
+            # Solo i documenti modificati dopo `since` (i documenti legacy senza updated_at non cambiano)
+            query = query.where(filter=FieldFilter('updated_at', '>', since_lower_bound))
+        if sort:
+            query = query.order_by(SORT_FIELDS[sort], direction='DESCENDING')
+        if since_lower_bound is None:
+            # Con `since` non c'è paginazione: niente ordinamento, che richiederebbe un indice su updated_at
+            query = query.order_by(FieldPath.document_id())
+        if parts:
+            query = query.select(firestore_field_paths(parts) + ([SORT_FIELDS[sort]] if sort else []))
+        if cursor:
+            cursor_snapshot = collection_ref.document(cursor).get()
+            count("firestore_reads")
+            if not cursor_snapshot.exists:
+                return json.dumps({"error": "Bad request: cursor non valido."}), 400, headers
+            query = query.start_after(cursor_snapshot)
+        if page_size:
+            # Un documento in più per sapere se esiste una pagina successiva
+            query = query.limit(page_size + 1)
+
+        with span("query") as query_span:
+            docs = list(query.stream())
+            query_span["documents"] = len(docs)
+        count("firestore_reads", len(docs))
+        has_more = bool(page_size) and len(docs) > page_size
+        if has_more:
+            docs = docs[:page_size]
+        with span("transform"):
+            for doc in docs:
+                data[doc.id] = transform_document(doc.id, doc.to_dict(), uid, parts)
+        if since_lower_bound is not None:
+            with span("tombstones"):
+                tombstones = list(
+                    tombstones_collection(db, APP_ID, uid)
+                    .where(filter=FieldFilter('deleted_at', '>', since_lower_bound)).select(['deleted_at']).stream()
+                )
+            count("firestore_reads", len(tombstones))
+            # Un documento ricreato dopo l'eliminazione compare tra i documenti, non tra gli eliminati
+            deleted = sorted(doc.id for doc in tombstones if doc.id not in data)
         print(f"Retrieved {len(data)} documents.")
 
     except Exception as e:
         print(f"Error retrieving data from Firestore: {e}")
+        current_trace().fail(e)
         return json.dumps({"error": "Internal server error: Could not retrieve data from Firestore."}), 500, headers
-    
-    return json.dumps(data), 200, headers
\ No newline at end of file
+
+    if since:
+        # full=True: `since` più vecchio della conservazione delle tombstone, il client sostituisce tutti i dati
+        body = json.dumps({
+            "documents": data,
+            "deleted": deleted,
+            "sync_token": sync_token,
+            "full": since_lower_bound is None
+        })
+    elif paginated:
+        body = json.dumps({
+            "documents": data,
+            "next_cursor": docs[-1].id if has_more else None
+        })
+    else:
+        body = json.dumps(data)
+    return with_content_etag(request, body, headers, etag)
+
+def with_content_etag(request, body, headers, etag):
+    """Risposta 200; per gli utenti senza documento di versione (dati legacy) l'ETag è calcolato sul contenuto."""
+    if not etag:
+        headers['ETag'] = content_etag(body)
+        if etag_matches(request.headers.get('If-None-Match'), headers['ETag']):
+            return '', 304, headers
+    return body, 200, headers
\ No newline at end of file
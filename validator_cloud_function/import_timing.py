@@ -0,0 +1,113 @@
+"""
+Misura il costo di import (cold start) dei moduli delle cloud function.
+
+Uso:
+    python import_timing.py                                  # moduli delle funzioni
+    python import_timing.py main fetchPitchData --top 15     # moduli scelti, 15 dipendenze più costose
+    python import_timing.py --repeat 5 --output import_times.json
+
+Ogni modulo viene importato in un processo Python nuovo con `-X importtime`, come avviene al
+cold start di un'istanza. Per ogni modulo vengono riportati il tempo totale di import (mediana
+delle ripetizioni) e le dipendenze di primo livello più costose (tempo cumulativo, incluse le
+loro dipendenze). L'import non inizializza più Firebase né altri client (vedi clients), quindi
+lo script non richiede credenziali; un modulo che non si importa viene riportato con l'errore.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTION_MODULES = ["main", "fetchPitchData", "fetchLeaderboard", "replicate_documents_pitch"]
+
+
+def parse_importtime(stderr):
+    """Interpreta l'output di -X importtime: lista di (modulo, self_us, cumulative_us, profondità)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        # Il modulo importato direttamente ha un solo spazio di rientro, ogni livello ne aggiunge due
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure_module(module, directory):
+    """Importa `module` in un processo nuovo; restituisce (righe di importtime, errore o None)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=directory, capture_output=True, text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    error = None
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["errore sconosciuto"])[-1]
+    return parse_importtime(result.stderr), error
+
+
+def summarize_module(module, runs, top):
+    """Mediana del tempo totale e delle dipendenze di primo livello su più ripetizioni."""
+    totals = []
+    dependencies = {}
+    error = None
+    for rows, run_error in runs:
+        error = error or run_error
+        module_row = next((row for row in rows if row[0] == module), None)
+        if module_row:
+            totals.append(module_row[2])
+        # -X importtime stampa le dipendenze prima del modulo che le importa: i figli diretti del
+        # modulo misurato sono le righe di profondità 1 che precedono la sua riga di profondità 0
+        children = []
+        for name, _, cumulative_us, depth in rows:
+            if depth == 1:
+                children.append((name, cumulative_us))
+            elif depth == 0:
+                if name == module:
+                    for child, child_us in children:
+                        dependencies.setdefault(child, []).append(child_us)
+                children = []
+    ranked = sorted(
+        ((name, statistics.median(values)) for name, values in dependencies.items()),
+        key=lambda item: item[1], reverse=True
+    )
+    return {
+        "module": module,
+        "total_ms": round(statistics.median(totals) / 1000, 1) if totals else None,
+        "error": error,
+        "top_dependencies": [{"module": name, "cumulative_ms": round(us / 1000, 1)} for name, us in ranked[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Costo di import (cold start) dei moduli delle cloud function.")
+    parser.add_argument("modules", nargs="*", default=FUNCTION_MODULES, help="Moduli da misurare.")
+    parser.add_argument("--repeat", type=int, default=3, help="Processi per modulo (si riporta la mediana).")
+    parser.add_argument("--top", type=int, default=10, help="Dipendenze più costose da mostrare per modulo.")
+    parser.add_argument("--output", help="File JSON dei risultati.")
+    args = parser.parse_args()
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in args.modules:
+        runs = [measure_module(module, directory) for _ in range(max(1, args.repeat))]
+        summary = summarize_module(module, runs, args.top)
+        results.append(summary)
+        total = f"{summary['total_ms']}ms" if summary["total_ms"] is not None else "n/d"
+        print(f"{module}: {total}" + (f"  (ERRORE: {summary['error']})" if summary["error"] else ""))
+        for dependency in summary["top_dependencies"]:
+            print(f"    {dependency['cumulative_ms']:>8.1f}ms  {dependency['module']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "modules": results}, f, indent=2)
+        print(f"Risultati salvati in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import os
+import zlib
+
+# --- Indice compatto per il ranking dei pitch deck ---
+# Per ogni utente un documento artifacts/{APP_ID}/users/{uid}/leaderboards/ranking, e per l'intera app
+# i documenti globali artifacts/{APP_ID}/public/data/leaderboards/global_{NN}, contengono solo i campi
+# necessari alle viste di ranking (una voce per analisi nella mappa `entries`). L'indice viene aggiornato
+# in modo incrementale a ogni salvataggio: le dashboard leggono pochi documenti piccoli invece di N
+# analisi complete.
+#
+# --- Shard del leaderboard globale ---
+# Un unico documento globale crescerebbe senza limite (Firestore accetta al massimo 1 MiB per documento)
+# e riceverebbe la scrittura di ogni salvataggio di ogni utente (circa 1 scrittura/s sostenuta per
+# documento). Le voci globali sono quindi distribuite in GLOBAL_LEADERBOARD_SHARDS documenti secondo
+# il CRC32 della chiave: ogni salvataggio scrive solo gli shard delle proprie voci e fetchLeaderboard
+# legge e unisce tutti gli shard con un solo get_all.
+# Limite: una voce occupa circa 250 byte, quindi uno shard contiene circa 4.000 voci e i 16 shard
+# predefiniti circa 64.000 analisi. Oltre GLOBAL_SHARD_WARN_ENTRIES voci per shard `rebuild` stampa un
+# avviso: va aumentato GLOBAL_LEADERBOARD_SHARDS e rilanciato `python leaderboard.py rebuild`, che
+# ridistribuisce le voci ed elimina gli shard non più usati.
+
+USER_LEADERBOARD_DOC = 'ranking'
+GLOBAL_LEADERBOARD_PREFIX = 'global'
+GLOBAL_LEADERBOARD_SHARDS = int(os.environ.get("GLOBAL_LEADERBOARD_SHARDS", "16"))
+GLOBAL_SHARD_WARN_ENTRIES = 3000
+# Separatore tra UID e ID del documento nelle chiavi del leaderboard globale
+GLOBAL_KEY_SEPARATOR = '__'
+
+
+def user_leaderboard_ref(db, app_id, user_id):
+    return db.collection('artifacts', app_id, 'users', user_id, 'leaderboards').document(USER_LEADERBOARD_DOC)
+
+
+def _leaderboards_collection(db, app_id):
+    return db.collection('artifacts', app_id, 'public', 'data', 'leaderboards')
+
+
+def global_leaderboard_ref(db, app_id, shard):
+    return _leaderboards_collection(db, app_id).document(f"{GLOBAL_LEADERBOARD_PREFIX}_{shard:02d}")
+
+
+def global_leaderboard_refs(db, app_id):
+    """Riferimenti di tutti gli shard del leaderboard globale."""
+    return [global_leaderboard_ref(db, app_id, shard) for shard in range(GLOBAL_LEADERBOARD_SHARDS)]
+
+
+def global_entry_key(user_id, document_id):
+    return f"{user_id or 'public'}{GLOBAL_KEY_SEPARATOR}{document_id}"
+
+
+def global_shard(entry_key):
+    """Shard del leaderboard globale di una voce: stabile tra processi (CRC32, non hash())."""
+    return zlib.crc32(entry_key.encode("utf-8")) % GLOBAL_LEADERBOARD_SHARDS
+
+
+def leaderboard_write_ops(user_id, document_count):
+    """Numero massimo di scritture di add_leaderboard_writes/add_leaderboard_removals per `document_count` analisi."""
+    return (1 if user_id else 0) + min(document_count, GLOBAL_LEADERBOARD_SHARDS)
+
+
+def _add_global_writes(writer, db, app_id, global_entries):
+    """Una scrittura in merge per ogni shard toccato da `global_entries`; ritorna le scritture."""
+    per_shard = {}
+    for key, value in global_entries.items():
+        per_shard.setdefault(global_shard(key), {})[key] = value
+    for shard, entries in per_shard.items():
+        writer.set(global_leaderboard_ref(db, app_id, shard), {'entries': entries}, merge=True)
+    return len(per_shard)
+
+
+def leaderboard_entry(document_id, data):
+    """
+    Voce compatta del leaderboard a partire dai dati di un'analisi (formato core_metrics o legacy).
+    'name' è presente solo se i dati contengono document_name: un aggiornamento parziale in merge
+    (es. re-scoring) non sovrascrive il nome già indicizzato.
+    """
+    metrics = data.get('core_metrics') or data.get('calcoli_aggiuntivi') or {}
+    entry = {
+        'document_id': document_id,
+        'sector': data.get('settore'),
+        'classe_pitch': metrics.get('classe_pitch', metrics.get('classe')),
+        'final_adjusted_score': metrics.get('final_adjusted_score'),
+        'indice_coerenza': metrics.get('indice_coerenza'),
+    }
+    name = data.get('document_name')
+    if name:
+        entry['name'] = name[:-4] if name.lower().endswith('.pdf') else name
+    return entry
+
+
+def add_leaderboard_writes(writer, db, app_id, user_id, analyses):
+    """
+    Aggiunge a `writer` (batch o transazione Firestore) l'aggiornamento incrementale dei leaderboard
+    per le analisi indicate ({document_id: dati}): una sola scrittura in merge per documento di leaderboard
+    (quello dell'utente e gli shard globali toccati). Ritorna il numero di scritture.
+    """
+    if not analyses:
+        return 0
+    user_entries = {document_id: leaderboard_entry(document_id, data) for document_id, data in analyses.items()}
+    global_entries = {
+        global_entry_key(user_id, document_id): {**entry, 'user_id': user_id}
+        for document_id, entry in user_entries.items()
+    }
+    if user_id:
+        writer.set(user_leaderboard_ref(db, app_id, user_id), {'entries': user_entries}, merge=True)
+    return (1 if user_id else 0) + _add_global_writes(writer, db, app_id, global_entries)
+
+
+def add_leaderboard_removals(writer, db, app_id, user_id, document_ids):
+    """
+    Aggiunge a `writer` la rimozione delle voci dei documenti indicati dai leaderboard (utente e shard
+    globali). Ritorna il numero di scritture.
+    """
+    if not document_ids:
+        return 0
+    from firebase_admin import firestore
+    if user_id:
+        writer.set(user_leaderboard_ref(db, app_id, user_id), {
+            'entries': {document_id: firestore.DELETE_FIELD for document_id in document_ids}
+        }, merge=True)
+    return (1 if user_id else 0) + _add_global_writes(writer, db, app_id, {
+        global_entry_key(user_id, document_id): firestore.DELETE_FIELD for document_id in document_ids
+    })
+
+
+def merge_shards(snapshots):
+    """Unisce gli snapshot degli shard globali in un unico dato di leaderboard ({'entries': ...})."""
+    entries = {}
+    for snapshot in snapshots:
+        if snapshot.exists:
+            entries.update((snapshot.to_dict() or {}).get('entries', {}))
+    return {'entries': entries}
+
+
+def sorted_entries(leaderboard_data, sector=None):
+    """Voci del leaderboard ordinate per final_adjusted_score decrescente (senza punteggio in fondo)."""
+    entries = list((leaderboard_data or {}).get('entries', {}).values())
+    if sector:
+        entries = [entry for entry in entries if entry.get('sector') == sector]
+    return sorted(
+        entries,
+        key=lambda entry: (entry.get('final_adjusted_score') is None, -(entry.get('final_adjusted_score') or 0))
+    )
+
+
+def rebuild_leaderboards(db, app_id):
+    """
+    Ricostruisce da zero tutti i leaderboard leggendo le analisi esistenti (backfill o riallineamento).
+    Restituisce il numero di analisi indicizzate.
+    """
+    fields = ['document_name', 'settore', 'core_metrics', 'calcoli_aggiuntivi']
+    per_user = {}
+    global_entries = {}
+    for doc in db.collection_group('pitch_deck_analyses').select(fields).stream():
+        # Percorso: artifacts/{app_id}/users/{uid}/pitch_deck_analyses/{doc} oppure .../public/data/...
+        path = doc.reference.path.split('/')
+        if path[0] != 'artifacts' or path[1] != app_id:
+            continue
+        user_id = path[3] if path[2] == 'users' else None
+        entry = leaderboard_entry(doc.id, doc.to_dict())
+        entry.setdefault('name', doc.id)
+        if user_id:
+            per_user.setdefault(user_id, {})[doc.id] = entry
+        global_entries[global_entry_key(user_id, doc.id)] = {**entry, 'user_id': user_id}
+
+    for user_id, entries in per_user.items():
+        user_leaderboard_ref(db, app_id, user_id).set({'entries': entries})
+    shards = {shard: {} for shard in range(GLOBAL_LEADERBOARD_SHARDS)}
+    for key, entry in global_entries.items():
+        shards[global_shard(key)][key] = entry
+    for shard, entries in shards.items():
+        global_leaderboard_ref(db, app_id, shard).set({'entries': entries})
+        if len(entries) > GLOBAL_SHARD_WARN_ENTRIES:
+            print(
+                f"ATTENZIONE: lo shard globale {shard} contiene {len(entries)} voci (limite di 1 MiB vicino): "
+                f"aumentare GLOBAL_LEADERBOARD_SHARDS e rilanciare rebuild."
+            )
+    # Shard di una configurazione precedente (o il vecchio documento 'global' unico)
+    current = {ref.id for ref in global_leaderboard_refs(db, app_id)}
+    for ref in _leaderboards_collection(db, app_id).list_documents():
+        if ref.id.startswith(GLOBAL_LEADERBOARD_PREFIX) and ref.id not in current:
+            ref.delete()
+    print(f"INFO: Leaderboard ricostruiti: {len(per_user)} utenti, {len(global_entries)} analisi.")
+    return len(global_entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gestione dei leaderboard dei pitch deck.")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: ricostruisce tutti i leaderboard dalle analisi.")
+    args = parser.parse_args()
+    from clients import APP_ID, get_firestore_client
+    rebuild_leaderboards(get_firestore_client(), APP_ID)
@@ -0,0 +1,192 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+from prompt_templates import SUMMARY_SYSTEM_PROMPT, BUSINESS_PLAN_MAP_SYSTEM_PROMPT
+from rubrics import PREDEFINED_SECTORS, RUBRICS, COHERENCE_PAIRS
+
+# --- Backend LLM intercambiabili ---
+# Le chiamate di riassunto, analisi e map del business plan passano da un backend con un'unica
+# interfaccia: complete(request_body, timeout) -> LLMResponse, dove request_body è il corpo di una
+# chat completion in formato OpenAI. OpenAI e Vertex AI (tramite il suo endpoint compatibile OpenAI)
+# condividono un solo client HTTP con pool di connessioni per processo; il backend "fake" risponde
+# in locale, in modo deterministico e con latenza configurabile (test, benchmark, CI senza rete).
+
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai")  # openai | vertex | fake
+LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_KEEPALIVE_S = float(os.environ.get("LLM_HTTP_KEEPALIVE_S", "60"))
+VERTEX_PROJECT_ID = os.environ.get("VERTEX_PROJECT_ID", "validatr-mvp")
+VERTEX_LOCATION = os.environ.get("VERTEX_LOCATION", "us-central1")
+VERTEX_MODEL = os.environ.get("VERTEX_MODEL", "google/gemini-2.0-flash-001")
+LLM_FAKE_LATENCY_S = float(os.environ.get("LLM_FAKE_LATENCY_S", "0"))
+
+
+class LLMResponse:
+    """Risposta normalizzata di un backend: testo, motivo di fine generazione e token consumati."""
+
+    def __init__(self, content, finish_reason="stop", usage=None):
+        self.content = content
+        self.finish_reason = finish_reason
+        self.usage = usage or {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_client():
+    """Client HTTP condiviso (keep-alive e pool di connessioni) per tutte le chiamate LLM del processo."""
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_S,
+        ),
+        timeout=httpx.Timeout(300.0, connect=10.0),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_openai_client():
+    """Client OpenAI del processo (usato anche dalla Batch API), costruito sul client HTTP condiviso."""
+    import openai
+    return openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=get_http_client())
+
+
+def _response_from_openai(response):
+    usage = {}
+    if getattr(response, "usage", None) is not None:
+        usage["prompt_tokens"] = getattr(response.usage, "prompt_tokens", None)
+        usage["completion_tokens"] = getattr(response.usage, "completion_tokens", None)
+        details = getattr(response.usage, "prompt_tokens_details", None)
+        if details is not None and getattr(details, "cached_tokens", None) is not None:
+            usage["cached_prompt_tokens"] = details.cached_tokens
+    choice = response.choices[0]
+    return LLMResponse(choice.message.content, choice.finish_reason, usage)
+
+
+class OpenAIBackend:
+    name = "openai"
+    model = None  # usa il modello indicato nella richiesta
+
+    def complete(self, request_body, timeout=None):
+        return _response_from_openai(get_openai_client().chat.completions.create(**request_body, timeout=timeout))
+
+
+class VertexBackend:
+    """
+    Vertex AI tramite l'endpoint compatibile con l'API Chat Completions: stesso formato di richiesta
+    e stesso client HTTP condiviso; il token OAuth viene rinnovato quando scade.
+    """
+    name = "vertex"
+
+    def __init__(self, project_id=VERTEX_PROJECT_ID, location=VERTEX_LOCATION, model=VERTEX_MODEL):
+        self.model = model
+        self.base_url = (
+            f"https://{location}-aiplatform.googleapis.com/v1/projects/{project_id}"
+            f"/locations/{location}/endpoints/openapi"
+        )
+        self._credentials = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        import google.auth
+        import google.auth.transport.requests
+        import openai
+        with self._lock:
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+            if self._client is None or not self._credentials.valid:
+                self._credentials.refresh(google.auth.transport.requests.Request())
+                self._client = openai.OpenAI(
+                    api_key=self._credentials.token, base_url=self.base_url, http_client=get_http_client()
+                )
+            return self._client
+
+    def complete(self, request_body, timeout=None):
+        request_body = dict(request_body, model=self.model)
+        return _response_from_openai(self._get_client().chat.completions.create(**request_body, timeout=timeout))
+
+
+def _seed(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def fake_analysis_content(request_body):
+    """Risposta di analisi deterministica e conforme allo schema, derivata dall'hash del testo della richiesta."""
+    seed = _seed(request_body["messages"][1]["content"] if len(request_body["messages"]) > 1 else "")
+
+    def score(index):
+        return 35 + seed[index % len(seed)] % 60
+
+    motivation = {"it": "Valutazione simulata.", "en": "Simulated evaluation."}
+    return json.dumps({
+        "settore": PREDEFINED_SECTORS[seed[0] % len(PREDEFINED_SECTORS)],
+        "variabili_valutate": [
+            {"nome": name, "punteggio": score(i), "motivazione": motivation} for i, name in enumerate(RUBRICS)
+        ],
+        "coerenza_coppie": [
+            {"coppia": f"{a} - {b}", "punteggio": score(i + 7), "motivazione": motivation}
+            for i, (a, b) in enumerate(COHERENCE_PAIRS)
+        ],
+    })
+
+
+def fake_summary_content(request_body):
+    return json.dumps({"it": "Riassunto simulato del pitch deck.", "en": "Simulated pitch deck summary."})
+
+
+def fake_evidence_content(request_body):
+    seed = _seed(request_body["messages"][-1]["content"])
+    return json.dumps({"evidenze": {
+        name: [f"Evidenza simulata {seed[i] % 100}."] if seed[i] % 2 else [] for i, name in enumerate(RUBRICS)
+    }})
+
+
+class FakeLLMBackend:
+    """
+    Backend locale senza rete: risponde in base al prompt di sistema (riassunto, map del business
+    plan o analisi) con contenuti deterministici e validi. latency_s simula il tempo di risposta;
+    jitter_s aggiunge una variazione deterministica (derivata dal testo) fino a quel valore.
+    """
+    name = "fake"
+    model = "fake-llm"
+
+    def __init__(self, latency_s=LLM_FAKE_LATENCY_S, jitter_s=0.0):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def complete(self, request_body, timeout=None):
+        with self._lock:
+            self.calls += 1
+        system_prompt = request_body["messages"][0]["content"]
+        if system_prompt == SUMMARY_SYSTEM_PROMPT:
+            content = fake_summary_content(request_body)
+        elif system_prompt == BUSINESS_PLAN_MAP_SYSTEM_PROMPT:
+            content = fake_evidence_content(request_body)
+        else:
+            content = fake_analysis_content(request_body)
+        delay = self.latency_s
+        if self.jitter_s:
+            delay += self.jitter_s * _seed(request_body["messages"][-1]["content"])[0] / 255
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Richiesta simulata oltre il timeout di {timeout}s.")
+        if delay:
+            time.sleep(delay)
+        prompt_chars = sum(len(message["content"]) for message in request_body["messages"])
+        return LLMResponse(content, "stop", {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4})
+
+
+LLM_BACKENDS = {"openai": OpenAIBackend, "vertex": VertexBackend, "fake": FakeLLMBackend}
+
+
+def create_llm_backend(name=LLM_BACKEND):
+    """Crea il backend configurato (variabile LLM_BACKEND)."""
+    if name not in LLM_BACKENDS:
+        raise ValueError(f"Backend LLM non supportato: {name}. Valori ammessi: {', '.join(LLM_BACKENDS)}.")
+    return LLM_BACKENDS[name]()
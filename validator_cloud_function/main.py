@@ -1,131 +1,126 @@
 import functions_framework
+import copy
+import functools
 import json
-import io
-import PyPDF2
-import openai
 import os
-from google.cloud import storage
-from google.api_core.exceptions import NotFound
-from google.cloud import bigquery
-import vertexai
-from vertexai.generative_models import GenerativeModel
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
-
-# --- Inizializzazione dei Servizi Google Cloud e Firebase ---
-PROJECT_ID = "validatr-mvp"
-LOCATION = "us-central1"
-vertexai.init(project=PROJECT_ID, location=LOCATION)
-
-if not firebase_admin._apps:
-    try:
-        # Inizializza l'SDK di Firebase utilizzando le credenziali di default dell'ambiente
-        cred = credentials.ApplicationDefault()
-        firebase_admin.initialize_app(cred)
-        print("Firebase Admin SDK inizializzato con successo.")
-    except Exception as e:
-        print(f"Errore nell'inizializzazione di Firebase Admin SDK: {e}")
-
-db = firestore.client()
-bq_client = bigquery.Client()
-APP_ID = os.environ.get('CANVAS_APP_ID', 'validatr-mvp')
+import time
+from clients import APP_ID, get_firestore_client, get_storage_client
+from auth_cache import verify_id_token
+from analysis_schema import extract_json_object, validate_analysis, build_reask_messages, estimate_reask_max_tokens
+from scoring import perform_additional_calculations
+from parallel_stages import make_stage, run_parallel_stages
+from analysis_cache import build_analysis_cache_key, create_analysis_cache
+from near_duplicates import DeckSignatureStore, compute_signature, same_business_plan, NEAR_DUPLICATE_MODE
+from text_store import create_text_store
+from rubrics import PREDEFINED_SECTORS, RUBRICS, COHERENCE_PAIRS, COHERENCE_GUIDELINES
+from rate_limiting import create_openai_rate_limiter
+from llm_backends import create_llm_backend
+from leaderboard import add_leaderboard_writes, add_leaderboard_removals
+from analysis_sync import add_version_bump, add_tombstone_writes
+from analysis_storage import add_analysis_writes, details_ref, read_analysis
+from analysis_jobs import (
+    AnalysisJobStore, check_queue_config, create_job_queue, decode_pubsub_job, new_job_id,
+    JOB_QUEUED, JOB_EXTRACTING, JOB_SCORING, JOB_SAVED, JOB_FAILED, TERMINAL_JOB_STATUSES
+)
+from sector_stats import read_sector_stats, empty_stats as empty_sector_stats, add_score, remove_score, apply_z_score, add_stats_increment, STATS_SHARDS
+from pdf_extraction import download_blob_to_tempfile, extract_pdf_pages, join_pages, format_page_report
+from telemetry import start_trace, current_trace, span, count, traced, record_llm_usage, payload_size, debug_log
+from text_condensation import condense_for_llm, count_tokens, ANALYSIS_INPUT_TOKEN_BUDGET, SUMMARY_INPUT_TOKEN_BUDGET
+from prompt_templates import (
+    SUMMARY_SYSTEM_PROMPT, PROMPT_VERSION, BUSINESS_PLAN_MAP_SYSTEM_PROMPT, BUSINESS_PLAN_MAP_PROMPT_VERSION,
+    get_analysis_prompt_version, build_analysis_request_body
+)
+from business_plan_mapreduce import (
+    should_use_map_reduce, chunk_business_plan, chunk_cache_key, map_chunks, parse_evidence_response,
+    build_evidence_digest, EVIDENCE_DIGEST_HEADER
+)
+
+# --- Servizi Google Cloud e Firebase ---
+# Firebase, Firestore e Storage vengono inizializzati alla prima richiesta che li usa (vedi clients),
+# non durante l'import del modulo: il cold start non paga client che la richiesta non usa.
 UID_excluded = os.environ.get("UID_excluded")
-openai.api_key = os.environ.get("OPENAI_API_KEY")
-
-storage_client = storage.Client()
-
 
 FIREBASE_STORAGE_BUCKET_NAME = "validatr-mvp.firebasestorage.app" 
 
-PREDEFINED_SECTORS = [
-    "Pubblica Amministrazione",
-    "Automotive",
-    "Retail",
-    "Finanza e Assicurazioni",
-    "Salute e Benessere",
-    "Educazione",
-    "Tecnologia e Software",
-    "Industria Manifatturiera",
-    "Altro" # Aggiungi "Altro" come fallback se nessuno degli altri si adatta perfettamente
-]
-
-# --- Definizione delle Rubriche di Valutazione ---
-# Contengono i criteri dettagliati per l'analisi di ogni variabile del pitch deck.
-RUBRICS = {
-    "Problema": {
-        "criteri": "Misura quanto il problema che la startup intende risolvere sia reale, urgente e rilevante per gli stakeholder. Variabili valutate: concretezza, urgenza percepita, intensità del bisogno nel mercato, verifica empirica attraverso feedback degli utenti target."
-    },
-    "Target": {
-        "criteri": "Determina il grado di definizione, raggiungibilità e predisposizione alla spesa degli utenti destinatari della soluzione. Variabili valutate: precisione segmentale, capacità economica, willingness-to-pay, facilità di essere identificato e raggiunto, maturità tecnologica o predisposizione all'adottare nuove soluzioni, dimensione quantitativa e qualitativa del pubblico target."
-    },
-    "Soluzione": {
-        "criteri": "Analizza l'efficacia pratica della soluzione proposta dalla startup e la sua capacità di essere percepita come valida e superiore rispetto alle alternative esistenti. Variabili valutate: livello di innovazione, fattibilità tecnica, immediatezza di valore percepito, facilità d'uso, posizionamento rispetto ai competitor, rilevanza rispetto al problema, difficoltà a essere replicata da terzi."
-    },
-    "Mercato": {
-        "criteri": "Quantifica in modo preciso la dimensione (TAM/SAM/SOM), il potenziale di crescita, il timing, l'attrattività economica del mercato di riferimento, la saturazione/competitività, la facilità ad aggredirlo. Variabili valutate: dimensione economica, trend di crescita, competitività (forza dei competitor, saturazione competitiva, capacità/attitudine dei competitor a innovare; considera anche competitor indiretti), facilità di ingresso (valutare eventuali barriere all'entrata e la capacità della startup di superarle), apertura del mercato a nuovi player, presenza di minacce esterne o rischi critici (come forti correlazioni del mercato di riferimento a altri fattori quali altri mercati, normative, politica, e analizza in modo critico possibili rischi derivanti da questa correlazione), presenza di opportunità e sinergie."
-    },
-    "MVP": {
-        "criteri": "Valuta se l'MVP esistente dimostra chiaramente e concretamente il valore della soluzione proposta ed è sufficientemente maturo per essere testato dagli utenti reali. In alcuni casi il servizio/prodotto/piattaforma potrebbe essere già sviluppato e in tal caso verranno riportati dati sull'utilizzo/acquisizione e traction del prodotto/servizio. Variabili valutate: completezza, usabilità effettiva, scalabilità tecnica iniziale, robustezza dimostrativa rispetto al valore promesso."
-    },
-    "Team": {
-        "criteri": "Determina se il team attuale possiede le competenze, l'esperienza, e la complementarietà necessarie per portare con successo il prodotto sul mercato e per gestire crescita e rischi operativi. Verifica che le competenze del team siano coerenti con le esigenze specifiche della startup. Variabili valutate: skill tecniche ed esecutive, presenza di figure chiave (CTO, CEO, CMO), esperienza precedente, capacità di attrarre ulteriori talenti."
-    },
-    "Ritorno Atteso": {
-        "criteri": "Stima numericamente l'attrattività finanziaria della startup dal punto di vista degli investitori professionali, utilizzando modelli predittivi rigorosi come IRR (Internal Rate of Return), moltiplicatori attesi e diluizione equity. Variabili valutate: IRR stimato, multipli di investimento, equity post-diluizione, comparabilità con benchmark di mercato, giustificazione oggettiva della valuation richiesta, capacità del business model di generare revenue e profitti scalabili e sostenibili nel tempo, solidità e affidabilità delle proiezioni finanziarie stimate, prova di avere già generato entrate e avere utenti paganti/clienti."
-    }
-}
-
-# Definisce le 21 coppie di variabili da analizzare per la coerenza.
-COHERENCE_PAIRS = [
-    ("Problema", "Target"), ("Problema", "Soluzione"), ("Problema", "Mercato"),
-    ("Problema", "MVP"), ("Problema", "Team"), ("Problema", "Ritorno Atteso"),
-    ("Target", "Soluzione"), ("Target", "Mercato"), ("Target", "MVP"),
-    ("Target", "Team"), ("Target", "Ritorno Atteso"),
-    ("Soluzione", "Mercato"), ("Soluzione", "MVP"), ("Soluzione", "Team"),
-    ("Soluzione", "Ritorno Atteso"),
-    ("Mercato", "MVP"), ("Mercato", "Team"), ("Mercato", "Ritorno Atteso"),
-    ("MVP", "Team"), ("MVP", "Ritorno Atteso"),
-    ("Team", "Ritorno Atteso")
-]
-
-# Fornisce linee guida specifiche per la valutazione di ogni coppia di coerenza.
-COHERENCE_GUIDELINES = {
-    ("Problema", "Target"): "Elementi utili da considerare: se il target scelto è il principale percettore del problema; se il problema è rilevante e urgente per quel target; se il target è colui che può prendere/influenzare decisioni di acquisto per risolvere quel problema.",
-    ("Problema", "Soluzione"): "Elementi utili da considerare: se la soluzione risolve il problema in modo efficace, scalabile, ripetibile, agevole e fruibile.",
-    ("Problema", "Mercato"): "Elementi utili da considerare: se il mercato è già in cerca/attivo per risolvere il problema (indicazione di problema realmente percepito); se la concorrenza ha soluzioni per risolvere il problema (valutare se vi sono per dimostrare quanto è pronto il mercato); quanto sono efficaci le attuali soluzioni sul mercato nel risolvere il problema (se sono molto efficaci vi è un impatto negativo sullo score).",
-    ("Problema", "MVP"): "Elementi utili da considerare: se l'mvp è capace di risolvere la componente principale del problema; se la fruibilità dell'MVP è conforme con le modalità di risoluzione del problema.",
-    ("Problema", "Team"): "Elementi utili da considerare: se il team ha esperienza diretta del problema; se ha le competenze per valutare e comprendere correttamente il problema.",
-    ("Problema", "Ritorno Atteso"): "Elementi utili da considerare: se il problema è temporaneo o rimane nel tempo (nel primo caso impatto negativo); se il problema è così impattante da assicurare una willingness to pay per risolverlo stabile o in crescita nei prossimi anni; se il problema può venire meno facilmente per esternalità probabili (politiche, socio-economiche, normative, tecnologiche).",
-    ("Target", "Soluzione"): "Elementi utili da considerare: se comportamenti, attitudini, abitudini e maturità digitale del target sono coerenti con la soluzione proposta.",
-    ("Target", "Mercato"): "Elementi utili da considerare: se il target scelto è una componente importante del mercato, ben definita, identificabile e raggiungibile; se il target è una componente del mercato propensa ad adottare nuove soluzioni; se il target scelto è già fidalizzato a altre aziende/soluzioni/metodologie (impatto negativo).",
-    ("Target", "MVP"): "Elementi utili da considerare: se l'MVP è facilmente fruibile dal target, compatibile con le sue abitudini, comportamenti, bisogni e maturità digitale.",
-    ("Target", "Team"): "Elementi utili da considerare: se il team ha le competenze, esperienze e abilità per comprendere il target, raggiungerlo e convincerlo.",
-    ("Target", "Ritorno Atteso"): "Elementi utili da considerare: quanto il target è di un numero sufficiente (ora e nei prossimi anni) e ha le disponibilità economiche per generare ritorni; se il target è caratterizzato per possibilità di fidelizzazione e facilità di conversione per genererare ritorni positivi e in crescita; se le abitudini del target lo rendono idonei a generare ricavi crescenti, scalabili e sostenibili nel breve, medio e lungo termine.",
-    ("Soluzione", "Mercato"): "Elementi utili da considerare: se la soluzione si differenzia sufficientemente da competitor diretti e indiretti, se i benefici della soluzione possono essere facilmente compresi dal mercato.",
-    ("Soluzione", "MVP"): "Elementi utili da considerare: se l'mvp permette di comprendere la soluzione e ne riassume efficacemente i vantaggi chiave; se l'mvp è una soluzione efficace; se l'mvp può essere facilmente scalato in una soluzione più completa e differenziata.",
-    ("Soluzione", "Team"): "Elementi utili da considerare: se il team ha le abilità, esperienze e network per sviluppare, presentare e vendere efficacemente la soluzione.",
-    ("Soluzione", "Ritorno Atteso"): "Elementi utili da considerare: se la soluzione è scalabile e rimane valida e rilevante nel tempo; se la soluzione è difficilmente replicabile da terzi; se la soluzione è compatibile con il business model previsto per generare alte marginalità; se la soluzione agevola la fidelizzazione con abbonamenti/acquisti ripetuti.",
-    ("Mercato", "MVP"): "Elementi utili da considerare: se l'mvp è compatibile con le esigenze del mercato; se è rilevante, differenziato, chiaro e fruibile dato il contesto di mercato in cui è calato.",
-    ("Mercato", "Team"): "Elementi utili da considerare: il team ha le abilità, esperienze o connessioni per comprendere il mercato, penetrarlo e superare eventuali barriere all'entrata.",
-    ("Mercato", "Ritorno Atteso"): "Elementi utili da considerare: se il mercato (grandezza, crescita, grado di competitività, apertura) è coerente con gli obiettivi di ritorno atteso indicati.",
-    ("MVP", "Team"): "Elementi utili da considerare: se il team ha capacità e esperienze coerenti per sviluppare l'mvp indicato.",
-    ("MVP", "Ritorno Atteso"): "Elementi utili da considerare: se i dati sullo stato dell'mvp, le sue caratteristiche e la traction generata (utenti, tester, revenue iniziali) sono coerenti con gli obiettivi di ritorno atteso.",
-    ("Team", "Ritorno Atteso"): "Elementi utili da considerare: se il team ha le abilità, esperienze e connessioni utili a raggiungere i risultati indicati."
-}
+# Timeout (in secondi) delle fasi LLM eseguite in parallelo da start_analysis
+SUMMARY_STAGE_TIMEOUT_S = float(os.environ.get("SUMMARY_STAGE_TIMEOUT_S", "60"))
+ANALYSIS_STAGE_TIMEOUT_S = float(os.environ.get("ANALYSIS_STAGE_TIMEOUT_S", "240"))
+SUMMARY_FALLBACK_TEXT = "Riassunto non disponibile a causa di un errore."
+
+# Documenti per richiesta di delete_analysis: ogni eliminazione scrive documento hot, dettagli,
+# tombstone, firma e fino a LSH_BANDS contatori di banda nella stessa transazione (max 500 operazioni)
+MAX_DELETE_DOCUMENTS = 20
+
+OPENAI_MODEL = "gpt-4.1-nano"
+
+# Backend LLM (variabile LLM_BACKEND: openai | vertex | fake) e modello effettivo, usato anche nelle chiavi di cache
+llm_backend = create_llm_backend()
+LLM_MODEL = llm_backend.model or OPENAI_MODEL
+
+# La configurazione della coda viene verificata all'avvio dell'istanza di start_analysis, l'unica funzione
+# che accoda job (FUNCTION_TARGET è impostato dal runtime e da functions-framework): il worker
+# process_analysis_job e gli script batch che importano questo modulo non pubblicano e non ne hanno bisogno
+if os.environ.get("FUNCTION_TARGET") == "start_analysis":
+    check_queue_config()
+
+@functools.lru_cache(maxsize=None)
+def get_analysis_cache():
+    """Cache delle analisi del processo, creata al primo utilizzo (None se disattivata)."""
+    return create_analysis_cache(get_firestore_client(), APP_ID)
+
+@functools.lru_cache(maxsize=None)
+def get_text_store():
+    """Archivio del testo estratto (vedi text_store), creato al primo utilizzo (None se disattivato)."""
+    return create_text_store()
+
+@functools.lru_cache(maxsize=None)
+def get_deck_signature_store():
+    """Firme MinHash dei deck analizzati e relativo indice LSH in memoria (vedi near_duplicates)."""
+    return DeckSignatureStore(get_firestore_client(), APP_ID)
+
+# Limite opzionale di richieste al minuto verso OpenAI (impostato anche dalle esecuzioni batch)
+openai_rate_limiter = create_openai_rate_limiter()
+
+def wait_for_openai_slot():
+    """Attende il proprio turno se è attivo un limite di frequenza sulle chiamate OpenAI."""
+    if openai_rate_limiter:
+        openai_rate_limiter.acquire()
+
+def complete_chat(request_body, timeout=None, usage_report=None):
+    """Esegue una chat completion con il backend LLM configurato, rispettando il limite di frequenza."""
+    wait_for_openai_slot()
+    response = llm_backend.complete(request_body, timeout=timeout)
+    record_llm_usage(response.usage)
+    record_token_usage(response, usage_report)
+    return response
 
 # --- Funzione di supporto per scaricare e leggere un PDF (spostata fuori da start_analysis) ---
-def get_text_from_storage(file_path_within_bucket):
+def get_text_from_storage(file_path_within_bucket, extraction_reports=None):
     """
-    Scarica un PDF da Google Cloud Storage (gestito da Firebase) e ne estrae il testo.
+    Scarica un PDF da Google Cloud Storage e ne restituisce il testo completo.
+    Vedi get_pages_from_storage per i parametri.
+    """
+    return join_pages([{"text": text} for text in get_pages_from_storage(file_path_within_bucket, extraction_reports)])
+
+def get_pages_from_storage(file_path_within_bucket, extraction_reports=None, text_keys=None):
+    """
+    Scarica un PDF da Google Cloud Storage (gestito da Firebase) e ne estrae il testo,
+    restituendo la lista dei testi delle singole pagine.
     Il file_path_within_bucket deve essere il percorso relativo all'interno del bucket,
     senza il nome del bucket stesso.
     Esempio: "validatr-pitch-decks-input-folder/user_uploads/L8u3dXQezmfvO6Qewla7u1pcbQ63/1753220266831_Sunspeker_Pitch-Deck-2025.pdf"
+    Se extraction_reports è una lista, vi aggiunge il report dell'estrazione
+    (pagine, caratteri e tempi per pagina, senza il testo).
+    Se text_keys è un dict, le pagine vengono salvate nel text store prima di eliminare il blob
+    e text_keys[file_path_within_bucket] riceve la chiave del testo. Se il salvataggio fallisce il
+    blob non viene eliminato, così un nuovo tentativo del job può scaricarlo di nuovo.
     """
     if not file_path_within_bucket:
-        return ""
+        return []
+    from google.api_core.exceptions import NotFound
     try:
-        # Usa il bucket client globale e il nome del bucket definito globalmente
-        bucket = storage_client.bucket(FIREBASE_STORAGE_BUCKET_NAME)
+        # Usa il client Storage condiviso e il nome del bucket definito globalmente
+        bucket = get_storage_client().bucket(FIREBASE_STORAGE_BUCKET_NAME)
         blob = bucket.blob(file_path_within_bucket) 
 
         # Verifica se il blob esiste prima di tentare il download
@@ -133,273 +128,600 @@ def get_text_from_storage(file_path_within_bucket):
             print(f"Errore: Il blob '{file_path_within_bucket}' non esiste nel bucket '{FIREBASE_STORAGE_BUCKET_NAME}'.")
             raise NotFound(f"Blob not found: {file_path_within_bucket}")
 
-        pdf_content = io.BytesIO(blob.download_as_bytes())
-        reader = PyPDF2.PdfReader(pdf_content)
-        text = "".join(page.extract_text() for page in reader.pages if page.extract_text())
+        # Download in streaming su file temporaneo + estrazione pagina per pagina (vedi pdf_extraction)
+        with span("download", path=file_path_within_bucket) as download_span:
+            path = download_blob_to_tempfile(blob)
+            download_span["bytes"] = os.path.getsize(path)
+        count("download_bytes", download_span["bytes"])
+        try:
+            with span("extract", path=file_path_within_bucket) as extract_span:
+                report = extract_pdf_pages(path)
+                extract_span.update(pages=report["page_count"], chars=report["chars"])
+        finally:
+            os.remove(path)
+        print(f"INFO: Estrazione di {file_path_within_bucket}: {format_page_report(report)}")
+        if extraction_reports is not None:
+            extraction_reports.append({
+                "path": file_path_within_bucket,
+                "pages": [{k: v for k, v in page.items() if k != "text"} for page in report["pages"]],
+                **{k: v for k, v in report.items() if k != "pages"}
+            })
+
+        pages = [page["text"] for page in report["pages"]]
+        if text_keys is not None:
+            store_pages(file_path_within_bucket, pages, text_keys)
+            if get_text_store() and any(pages) and file_path_within_bucket not in text_keys:
+                # Senza copia del testo il PDF è l'unica fonte per un nuovo tentativo: non va eliminato
+                print(f"ATTENZIONE: testo di {file_path_within_bucket} non salvato, il file resta nel bucket.")
+                return pages
 
         # Elimina il file dopo averlo letto
         blob.delete()
         print(f"File elaborato ed eliminato: gs://{FIREBASE_STORAGE_BUCKET_NAME}/{file_path_within_bucket}")
-        return text.replace('\n\n', '\n').strip()
+        return pages
     except NotFound as e: # Cattura specificamente l'errore 404 per il file
         print(f"Errore (NotFound): {e}")
-        return ""
+        return []
     except Exception as e:
         print(f"Attenzione: impossibile leggere il file. Errore generico: {e}")
-        return ""
+        return []
+
+def store_pages(file_path_within_bucket, pages, text_keys):
+    """Salva le pagine estratte nel text store e ne registra la chiave in text_keys (errori solo segnalati)."""
+    text_store = get_text_store()
+    if not text_store or not any(pages):
+        return
+    try:
+        with span("text_store_write", path=file_path_within_bucket):
+            text_keys[file_path_within_bucket] = text_store.put(pages)
+    except Exception as e:
+        print(f"ATTENZIONE: salvataggio del testo estratto di {file_path_within_bucket} fallito: {e}")
 
-def analyze_pitch_deck_with_gpt(pitch_text,has_business_plan=False):
+def load_pages(file_path_within_bucket, extraction_reports, text_keys):
     """
-    Costruisce il prompt per l'IA e chiama l'API di OpenAI per l'analisi del pitch.
-    Include istruzioni per convalidare le variabili con il business plan, se presente,
+    Pagine del documento: dal text store se il testo è già stato estratto (nuovo tentativo di
+    un job, messaggio Pub/Sub riconsegnato), altrimenti download ed estrazione del PDF.
+    """
+    key = text_keys.get(file_path_within_bucket)
+    text_store = get_text_store()
+    if key and text_store:
+        try:
+            with span("text_store_read", path=file_path_within_bucket):
+                pages = text_store.get(key)
+            if pages is not None:
+                print(f"INFO: Testo di {file_path_within_bucket} letto dal text store (chiave {key[:12]}...), download saltato.")
+                count("text_store_hits")
+                return pages
+        except Exception as e:
+            print(f"ATTENZIONE: lettura del testo {key[:12]}... dal text store fallita: {e}")
+    return get_pages_from_storage(file_path_within_bucket, extraction_reports, text_keys)
+
+def record_token_usage(response, usage_report):
+    """Copia in usage_report (se fornito) i token di input/output riportati dalla risposta del backend LLM."""
+    if usage_report is None or not response.usage:
+        return
+    usage_report.update(response.usage)
+
+@traced("analyze")
+def analyze_pitch_deck_with_gpt(pitch_text,has_business_plan=False, timeout=None, usage_report=None):
+    """
+    Chiama l'API di OpenAI per l'analisi del pitch usando il prompt compilato (prompt_templates).
+    Il prompt include istruzioni per convalidare le variabili con il business plan, se presente,
     e per identificare il settore.
+    La risposta viene validata elemento per elemento (analysis_schema): un JSON troncato viene
+    riparato e le sole variabili/coppie mancanti o non valide vengono richieste di nuovo con una
+    chiamata di follow-up. Restituisce None solo se l'analisi resta incompleta.
+    Il parametro timeout (secondi) viene passato alla chiamata OpenAI; se usage_report
+    è un dict, vi vengono registrati i token consumati.
     """
-    system_prompt_content = """Sei un analista esperto nell'analisi e valutazione di pitch deck per startup con background nei principali fondi di investimento per startup come Sequoia Capital, Andreessen Horowitz, P101, 360 capital, Google Ventures, LVenture Group, Y Combinator e CDP Venture Capital SGR di cui utilizzi best practice e approccio.
-
-Il tuo compito è valutare l'opportunità di investimento in startup per determinare quanto è consigliato l'investimento nella startup in esame partendo dal pitch deck fornito. Identifichi 7 variabili chiave, assegnando un punteggio da 0 a 100 a ciascuna variabile basandoti sulle rubriche fornite, fornendo una motivazione dettagliata per ogni punteggio, e valutando la coerenza interna tra specifiche coppie di variabili. Restituisci tutte le informazioni in un formato JSON valido.
-
-Ricorda che dovrai valutare le informazioni ottenute in maniera analitica e critica nella prospettiva di un analista che deve discernere le migliori opportunità di investiemento. Se necessario, includi nel tuo processo di valutazione fonti esterne affidabili per verificare i claim dei pitch deck e fornire una valutazione aggiornata.
-"""
-
-    if has_business_plan:
-    # Aggiungi le istruzioni specifiche per l'analisi combinata
-        system_prompt_content += """
-
-### ISTRUZIONI PER ANALISI DI DUE DILIGENCE (PITCH DECK + BUSINESS PLAN)
-
-**Principio Guida Fondamentale:**
-Il Business Plan è la **fonte primaria di verità**. Il Pitch Deck fornisce la visione, ma il Business Plan fornisce le prove. Le tue valutazioni e i tuoi punteggi devono basarsi sulle evidenze concrete e sui dati dettagliati del Business Plan.
-
-**Processo di Valutazione Obbligatorio:**
-
-1.  **Lettura Critica:** Analizza il Pitch Deck per capire le affermazioni principali. Successivamente, esamina il Business Plan con scetticismo professionale per trovare i dati che **supportino o smentiscano** tali affermazioni.
-
-2.  **Priorità Assoluta alle Prove:** Per ogni variabile, la tua motivazione e il tuo punteggio devono partire dai dati del Business Plan. Se un'informazione del Pitch Deck non è supportata da evidenze nel Business Plan, considerala **"non verificata"** e assegna un punteggio inferiore.
-
-3.  **Come Gestire le Discrepanze (Regola di Scrittura):**
-    Quando noti una discrepanza tra i due documenti, **evidenziala esplicitamente nella motivazione**. Utilizza una struttura simile a questa:
-    * *Esempio*: "La proiezione finanziaria nel Business Plan indica un fatturato di €1M al terzo anno. Questo **ridimensiona in modo significativo** l'ottimistica stima di €5M presentata nel Pitch Deck."
-    * *Esempio*: "Il Business Plan identifica tre competitor principali. Questo **fornisce un contesto più realistico** rispetto al Pitch Deck, che descriveva il mercato come 'poco affollato'."
-"""
-
-
-    system_prompt_content += """
-### Rubrica per i punteggi (0-100):
-* **0-40**: Mancante o completamente irrilevante.
-* **40-55**: Presente ma estremamente debole, vago o incoerente.
-* **55-77**: Buono, chiaro e convincente, con piccoli margini di miglioramento.
-* **77-100**: Eccellente, altamente credibile, ben articolato e supportato da dettagli solidi.
-
----
-
-### Criteri di Valutazione Dettagliati
-Per ogni variabile, valuta il punteggio (0-100) e la motivazione basandoti su questi criteri:
-"""
-
-    for var, details in RUBRICS.items():
-        system_prompt_content += f"\n* **{var}**: {details['criteri']}"
-
-    # --- NUOVA ISTRUZIONE PER L'IA: Identificazione del Settore ---
-    system_prompt_content += f"""
-
----
-
-### Identificazione del Settore
-Basandoti sul contenuto del pitch deck (e del business plan, se presente), identifica il settore di appartenenza della startup. Devi scegliere **UNO SOLO** tra i seguenti settori predefiniti. Se la startup non rientra chiaramente in nessuno di questi, scegli "Altro".
-Settori disponibili: {', '.join(PREDEFINED_SECTORS)}
-
----
-
-### Criteri di Valutazione della Coerenza (0-100)
-Valuta la coerenza (0-100) delle seguenti coppie di variabili. Un punteggio di 100 indica perfetta coerenza.
-"""
-
-    for i, (var1, var2) in enumerate(COHERENCE_PAIRS):
-        pair_tuple = (var1, var2)
-        guideline = COHERENCE_GUIDELINES.get(pair_tuple, "Nessuna linea guida specifica.")
-        system_prompt_content += f"\n{i+1}. **{var1} - {var2}**: {guideline}"
-
-    # --- AGGIORNAMENTO DEL FORMATO DI OUTPUT JSON ---
-    system_prompt_content += """
----
-
-### Formato di Output (JSON)
-Il formato JSON di output deve essere ESATTAMENTE come segue. Non includere alcun testo aggiuntivo prima o dopo il blocco JSON.
-```json
-{
-  "settore": "string",  // Nuovo campo per il settore
-  "variabili_valutate": [
-    {
-      "nome": "Problema",
-      "punteggio": 0,
-      "motivazione": { "it": "string", "en": "string" }
-    },
-    {
-      "nome": "Target",
-      "punteggio": 0,
-      "motivazione": { "it": "string", "en": "string" }
-    },
-    {
-      "nome": "Soluzione",
-      "punteggio": 0,
-      "motivazione": { "it": "string", "en": "string" }
-    },
-    {
-      "nome": "Mercato",
-      "punteggio": 0,
-      "motivazione": { "it": "string", "en": "string" }
-    },
-    {
-      "nome": "MVP",
-      "punteggio": 0,
-      "motivazione": { "it": "string", "en": "string" }
-    },
-    {
-      "nome": "Team",
-      "punteggio": 0,
-      "motivazione": { "it": "string", "en": "string" }
-    },
-    {
-      "nome": "Ritorno Atteso",
-      "punteggio": 0,
-      "motivazione": { "it": "string", "en": "string" }
-    }
-  ],
-  "coerenza_coppie": [
-"""
-    for i, (var1, var2) in enumerate(COHERENCE_PAIRS):
-        system_prompt_content += f"""    {{
-      "coppia": "{var1} - {var2}",
-      "punteggio": 0,
-      "motivazione": {{ "it": "string", "en": "string" }}
-    }}{',' if i < len(COHERENCE_PAIRS) - 1 else ''}
-"""
-
-    system_prompt_content += """  ]
-}
-
-Testo del pitch deck da analizzare:
-"""
-    print(system_prompt_content)
-    messages = [
-        {"role": "system", "content": system_prompt_content},
-        {"role": "user", "content": pitch_text}
-    ]
-
-    response = openai.chat.completions.create(
-        model="gpt-4.1-nano", 
-        messages=messages,
-        temperature=0.1,
-        max_tokens=3800,
-        response_format={"type": "json_object"}
+    request_body = build_analysis_request(pitch_text, has_business_plan)
+    print(f"INFO: Prompt di analisi versione {get_analysis_prompt_version(has_business_plan)} ({len(request_body['messages'][0]['content'])} caratteri, business plan: {has_business_plan}).")
+
+    response = complete_chat(request_body, timeout=timeout, usage_report=usage_report)
+    gpt_response_content = response.content
+    if response.finish_reason == "length":
+        print(f"ATTENZIONE: risposta di analisi troncata al limite di {request_body['max_tokens']} token.")
+    debug_log(f"Risposta JSON grezza da OpenAI:\n{gpt_response_content[:1000]}...")
+
+    analysis, missing_variables, missing_pairs = validate_analysis(extract_json_object(gpt_response_content))
+    if missing_variables or missing_pairs:
+        analysis, missing_variables, missing_pairs = reask_missing_items(
+            request_body, analysis, missing_variables, missing_pairs, timeout,
+            usage_report.setdefault('reask', {}) if usage_report is not None else None
+        )
+    if missing_variables or missing_pairs:
+        print(f"ERRORE: analisi incompleta. Variabili mancanti: {missing_variables}; coppie mancanti: {missing_pairs}.")
+        return None
+    return analysis
+
+def reask_missing_items(request_body, analysis, missing_variables, missing_pairs, timeout=None, usage_report=None):
+    """
+    Follow-up mirato: ripete la conversazione originale (stesso prefisso, quindi sfrutta il prompt
+    caching) aggiungendo la risposta precedente e la richiesta dei soli elementi mancanti, e unisce
+    il risultato all'analisi.
+    Restituisce (analisi, variabili ancora mancanti, coppie ancora mancanti).
+    """
+    print(f"INFO: Richiesta di follow-up per {len(missing_variables)} variabili e {len(missing_pairs)} coppie mancanti.")
+    followup_body = dict(
+        request_body,
+        messages=request_body["messages"] + build_reask_messages(analysis, missing_variables, missing_pairs),
+        max_tokens=estimate_reask_max_tokens(missing_variables, missing_pairs)
     )
+    try:
+        response = complete_chat(followup_body, timeout=timeout, usage_report=usage_report)
+    except Exception as e:
+        print(f"ERRORE nella richiesta di follow-up a OpenAI: {e}")
+        return analysis, missing_variables, missing_pairs
+    return validate_analysis(extract_json_object(response.content), previous=analysis)
 
-    gpt_response_content = response.choices[0].message.content
-    print(f"Risposta JSON grezza da OpenAI:\n{gpt_response_content[:1000]}...")
+def build_analysis_request(pitch_text, has_business_plan=False):
+    """
+    Corpo della richiesta chat completion per l'analisi del pitch (modello, messaggi e parametri).
+    Usato sia dalla chiamata sincrona sia dai job batch, così il prompt resta identico.
+    """
+    return build_analysis_request_body(pitch_text, has_business_plan, OPENAI_MODEL)
 
-    try:
-        parsed_response = json.loads(gpt_response_content)
-        # Validazione del settore: assicurati che sia uno dei predefiniti
-        if parsed_response.get("settore") not in PREDEFINED_SECTORS:
-            print(f"ATTENZIONE: Settore '{parsed_response.get('settore')}' non riconosciuto. Assegnando 'Altro'.")
-            parsed_response["settore"] = "Altro"
-        return parsed_response
-    except json.JSONDecodeError as e:
-        print(f"Errore nel parsing JSON della risposta GPT: {e}")
-        print(f"Risposta completa di GPT che ha causato l'errore:\n{gpt_response_content}")
+def parse_analysis_response(gpt_response_content):
+    """
+    Interpreta la risposta JSON dell'analisi (riparandola se troncata) e normalizza il settore;
+    restituisce None se non valida o incompleta. Usata dove non è possibile un follow-up (job batch).
+    """
+    analysis, missing_variables, missing_pairs = validate_analysis(extract_json_object(gpt_response_content))
+    if missing_variables or missing_pairs:
+        print(f"Risposta GPT incompleta: variabili mancanti {missing_variables}, coppie mancanti {missing_pairs}.")
         return None
+    return analysis
+
+def get_analyses_collection(user_id=None):
+    """Collezione delle analisi dell'utente indicato, o quella pubblica se user_id è assente."""
+    db = get_firestore_client()
+    if user_id:
+        return db.collection('artifacts', APP_ID, 'users', user_id, 'pitch_deck_analyses')
+    return db.collection('artifacts', APP_ID, 'public', 'data', 'pitch_deck_analyses')
 
-def perform_additional_calculations(gpt_analysis_data):
+def write_analyses(analyses, user_id=None):
     """
-    Calcola lo score finale, l'indice di coerenza e la classe della startup
-    basandosi sui dati analizzati dall'IA.
+    Scrive le analisi ({document_id: dati}) in un'unica transazione Firestore insieme ai
+    leaderboard e all'incremento delle statistiche di settore (vedi sector_stats). Lo z_score di ogni
+    analisi viene calcolato qui, sulle statistiche lette prima della transazione e aggiornate con le
+    analisi salvate (rimuovendo il punteggio precedente se il documento esiste già).
+    Ogni analisi riceve `updated_at` e la versione delle analisi dell'utente viene incrementata
+    (vedi analysis_sync), così fetchPitchData può rispondere 304 o solo con le modifiche.
+    Ogni analisi è scritta in un documento hot e uno di dettagli (vedi analysis_storage).
     """
-    variabili_valutate_dict = {v['nome']: v['punteggio'] for v in gpt_analysis_data.get('variabili_valutate', [])}
-    coerenza_coppie = gpt_analysis_data.get('coerenza_coppie', [])
-
-    total_coherence_score = sum(item['punteggio'] for item in coerenza_coppie)
-    num_coherence_pairs = len(coerenza_coppie) if coerenza_coppie else 0
-    ic = (total_coherence_score / num_coherence_pairs) if num_coherence_pairs > 0 else 0
+    from firebase_admin import firestore
+    db = get_firestore_client()
+    collection_ref = get_analyses_collection(user_id)
+    doc_refs = {document_id: collection_ref.document(document_id) for document_id in analyses}
+    # Gli shard delle statistiche sono letti fuori dalla transazione: leggerli dentro bloccherebbe
+    # tutti i salvataggi concorrenti, che scrivono solo incrementi
+    base_stats = read_sector_stats(db, APP_ID)
+
+    @firestore.transactional
+    def _write(transaction):
+        snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all(list(doc_refs.values()), transaction=transaction)}
+        stats = copy.deepcopy(base_stats)
+        delta = empty_sector_stats()
+        for document_id, data in analyses.items():
+            previous = snapshots.get(doc_refs[document_id].path)
+            if previous and previous.exists:
+                remove_score(stats, previous.to_dict())
+                remove_score(delta, previous.to_dict())
+            add_score(stats, data)
+            add_score(delta, data)
+        now = time.time()
+        for document_id, data in analyses.items():
+            apply_z_score(stats, data)
+            data['updated_at'] = now
+            add_analysis_writes(transaction, doc_refs[document_id], data)
+        leaderboard_writes = add_leaderboard_writes(transaction, db, APP_ID, user_id, analyses)
+        if user_id:
+            add_version_bump(transaction, db, APP_ID, user_id, now)
+        stats_writes = add_stats_increment(transaction, db, APP_ID, delta)
+        return leaderboard_writes + stats_writes
 
-    weights = {
-        "Problema": 0.20, "Target": 0.17, "Soluzione": 0.17,
-        "Mercato": 0.16, "MVP": 0.08, "Team": 0.08, "Ritorno Atteso": 0.14
-    }
+    extra_writes = _write(db.transaction())
+    count("firestore_reads", len(doc_refs) + STATS_SHARDS)
+    count("firestore_writes", 2 * len(analyses) + extra_writes + (1 if user_id else 0))
 
-    final_score = sum(variabili_valutate_dict.get(var, 0) * weights.get(var, 0) for var in weights)
-    
-    peso_final_score = 0.7
-    peso_indice_coerenza = 0.3
-    final_adjusted_score = (final_score * peso_final_score) + (ic * peso_indice_coerenza)
-
-    startup_class = "PASS"
-    if final_adjusted_score >= 77:
-        startup_class = "INVESTIRE"
-    elif final_adjusted_score >= 63:
-        startup_class = "MONITORARE"
-    elif final_adjusted_score >= 40:
-        startup_class = "VERIFICARE"
-
-    gpt_analysis_data["core_metrics"] = {
-        "indice_coerenza": round(ic, 2),
-        "final_score": round(final_score, 2),
-        "final_adjusted_score": round(final_adjusted_score, 2),
-        "z_score": None,
-        "classe_pitch": startup_class
-    }
-    
-    return gpt_analysis_data
+def delete_analyses(document_ids, user_id):
+    """
+    Elimina le analisi indicate dell'utente in un'unica transazione: toglie i punteggi dalle
+    statistiche di settore e le voci dai leaderboard, e lascia una tombstone per la
+    sincronizzazione incrementale della dashboard. Restituisce gli ID effettivamente eliminati.
+    """
+    from firebase_admin import firestore
+    db = get_firestore_client()
+    collection_ref = get_analyses_collection(user_id)
+    doc_refs = {document_id: collection_ref.document(document_id) for document_id in document_ids}
+
+    @firestore.transactional
+    def _delete(transaction):
+        snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all(list(doc_refs.values()), transaction=transaction)}
+        delta = empty_sector_stats()
+        deleted = []
+        for document_id, doc_ref in doc_refs.items():
+            snapshot = snapshots.get(doc_ref.path)
+            if not snapshot or not snapshot.exists:
+                continue
+            remove_score(delta, snapshot.to_dict())
+            transaction.delete(doc_ref)
+            transaction.delete(details_ref(doc_ref))
+            deleted.append(document_id)
+        if not deleted:
+            return deleted, 0
+        now = time.time()
+        add_tombstone_writes(transaction, db, APP_ID, user_id, deleted, now)
+        leaderboard_writes = add_leaderboard_removals(transaction, db, APP_ID, user_id, deleted)
+        add_version_bump(transaction, db, APP_ID, user_id, now)
+        signature_writes = get_deck_signature_store().add_removals(transaction, user_id, deleted)
+        stats_writes = add_stats_increment(transaction, db, APP_ID, delta)
+        return deleted, leaderboard_writes + signature_writes + stats_writes
+
+    deleted, extra_writes = _delete(db.transaction())
+    get_deck_signature_store().discard(user_id, deleted)
+    count("firestore_reads", len(doc_refs))
+    count("firestore_writes", 3 * len(deleted) + extra_writes + 1 if deleted else 0)
+    return deleted
 
 def save_to_firestore(document_id, data, user_id=None):
     """
     Salva i dati dell'analisi su Firestore nel percorso corretto (utente o pubblico).
     """
     try:
-        if user_id:
-            collection_ref = db.collection('artifacts', APP_ID, 'users', user_id, 'pitch_deck_analyses')
-        else:
-            collection_ref = db.collection('artifacts', APP_ID, 'public', 'data', 'pitch_deck_analyses')
-        
-        collection_ref.document(document_id).set(data)
-        print(f"Dati salvati con successo su Firestore: {collection_ref.document(document_id).path}")
+        write_analyses({document_id: data}, user_id)
+        print(f"Dati salvati con successo su Firestore: {get_analyses_collection(user_id).document(document_id).path}")
         return True
     except Exception as e:
         print(f"ERRORE nel salvataggio su Firestore per il documento {document_id} (user_id: {user_id or 'N/A'}): {e}")
         return False
     
-def generate_summary_with_openai(pitch_text):
+@traced("summarize")
+def generate_summary_with_openai(pitch_text, timeout=None, usage_report=None):
     """
     Usa OpenAI per generare un riassunto conciso del pitch deck in italiano e inglese,
     restituendo un oggetto JSON.    
+    Il parametro timeout (secondi) viene passato alla chiamata OpenAI; se usage_report
+    è un dict, vi vengono registrati i token consumati.
     """
     try:
         print("INFO: Inizio generazione riassunto con OpenAI.")
         
-        system_prompt = """Sei un analista finanziario esperto. Il tuo compito è analizzare il testo di un pitch deck e creare un riassunto conciso.
-Restituisci il riassunto come un oggetto JSON con due chiavi: "it" per la versione italiana e "en" per la versione inglese.
-Ogni riassunto deve essere di massimo 3 righe e catturare l'essenza del prodotto, il problema che risolve e il suo target principale."""
-        
         messages = [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
             {"role": "user", "content": f"Basandoti su questo testo, crea il riassunto bilingue in formato JSON:\n\n{pitch_text}"}
         ]
 
-        response = openai.chat.completions.create(
-            model="gpt-4.1-nano",
-            messages=messages,
-            temperature=0.1,
-            max_tokens=400, 
-            response_format={"type": "json_object"} 
-        )
-
-        summary = response.choices[0].message.content
-        print("--- RIASSUNTO GENERATO DA OPENAI ---")
-        print(summary)
+        response = complete_chat({
+            "model": OPENAI_MODEL,
+            "messages": messages,
+            "temperature": 0.1,
+            "max_tokens": 400,
+            "response_format": {"type": "json_object"}
+        }, timeout=timeout, usage_report=usage_report)
+        summary = response.content
+        debug_log(f"--- RIASSUNTO GENERATO DA OPENAI ---\n{summary}")
         return summary.strip()
         
     except Exception as e:
         print(f"ERRORE durante la generazione del riassunto con OpenAI: {e}")
-        return "Riassunto non disponibile a causa di un errore."
+        return SUMMARY_FALLBACK_TEXT
+
+def run_analysis_pipeline(all_text, has_business_plan_flag, stage_timings, summary_text=None, token_usage=None):
+    """
+    Esegue riassunto, analisi principale e calcoli aggiuntivi sul testo (già condensato).
+    Se la cache contiene già un'analisi per lo stesso testo, flag business plan, modello
+    e versione del prompt, la restituisce senza chiamare l'LLM.
+    summary_text è il testo (di solito con un budget più piccolo) per il riassunto; se assente
+    si usa all_text. I tempi di ogni fase vengono aggiunti a stage_timings e i token
+    consumati da ogni chiamata LLM a token_usage.
+    """
+    if token_usage is None:
+        token_usage = {}
+    cache_key = None
+    analysis_cache = get_analysis_cache()
+    if analysis_cache and all_text.strip():
+        cache_key = build_analysis_cache_key(all_text, has_business_plan_flag, LLM_MODEL, PROMPT_VERSION)
+        lookup_start = time.monotonic()
+        try:
+            with span("cache_lookup") as cache_span:
+                cached_analysis = analysis_cache.get(cache_key)
+                cache_span["hit"] = bool(cached_analysis)
+        except Exception as e:
+            print(f"ATTENZIONE: lettura dalla cache delle analisi fallita: {e}")
+            cached_analysis = None
+        stage_timings['cache_lookup'] = {
+            "status": "hit" if cached_analysis else "miss",
+            "duration_s": round(time.monotonic() - lookup_start, 3)
+        }
+        if cached_analysis:
+            print(f"INFO: Analisi trovata in cache (chiave {cache_key[:12]}...), chiamate LLM saltate.")
+            cached_analysis['cache'] = {"key": cache_key, "hit": True}
+            return cached_analysis
+
+    # 1-2. Riassunto e analisi principale sono indipendenti: vengono eseguiti in parallelo.
+    # L'analisi è obbligatoria; il riassunto, se fallisce o scade, usa il testo di fallback.
+    stages = {
+        'summary': make_stage(
+            generate_summary_with_openai, args=(summary_text or all_text,),
+            kwargs={'timeout': SUMMARY_STAGE_TIMEOUT_S, 'usage_report': token_usage.setdefault('summary', {})},
+            timeout=SUMMARY_STAGE_TIMEOUT_S, required=False, fallback=SUMMARY_FALLBACK_TEXT
+        ),
+        'analysis': make_stage(
+            analyze_pitch_deck_with_gpt, args=(all_text, has_business_plan_flag),
+            kwargs={'timeout': ANALYSIS_STAGE_TIMEOUT_S, 'usage_report': token_usage.setdefault('analysis', {})},
+            timeout=ANALYSIS_STAGE_TIMEOUT_S, required=True
+        ),
+    }
+    llm_results, llm_timings = run_parallel_stages(stages)
+    stage_timings['llm_wall_clock_s'] = llm_timings.pop('_wall_clock_s', None)
+    stage_timings.update(llm_timings)
+
+    executive_summary = llm_results['summary']
+    analysis_result = llm_results['analysis']
+    if not analysis_result:
+        raise Exception("L'analisi GPT principale non ha prodotto risultati validi.")
+    
+    analysis_result['executive_summary'] = executive_summary
+
+    # 3. Esegui i calcoli aggiuntivi
+    calculations_start = time.monotonic()
+    with span("compute"):
+        final_analysis = perform_additional_calculations(analysis_result)
+    stage_timings['calculations'] = {"status": "ok", "duration_s": round(time.monotonic() - calculations_start, 3)}
+
+    # Un riassunto di fallback non va memorizzato: al prossimo caricamento verrà rigenerato
+    if cache_key and executive_summary != SUMMARY_FALLBACK_TEXT:
+        try:
+            analysis_cache.put(cache_key, final_analysis)
+            final_analysis['cache'] = {"key": cache_key, "hit": False}
+        except Exception as e:
+            print(f"ATTENZIONE: scrittura nella cache delle analisi fallita: {e}")
+    return final_analysis
+
+def extract_business_plan_evidence_with_gpt(chunk_text, usage_report=None):
+    """Fase map: chiede all'LLM le evidenze per ogni variabile contenute in un frammento del business plan."""
+    response = complete_chat({
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": BUSINESS_PLAN_MAP_SYSTEM_PROMPT},
+            {"role": "user", "content": chunk_text}
+        ],
+        "temperature": 0,
+        "max_tokens": 1200,
+        "response_format": {"type": "json_object"}
+    }, timeout=ANALYSIS_STAGE_TIMEOUT_S, usage_report=usage_report)
+    return parse_evidence_response(response.content)
+
+def build_business_plan_digest(business_plan_pages, stage_timings, token_usage):
+    """
+    Map-reduce del business plan: frammenti, evidenze per variabile (in parallelo e con cache
+    per frammento, così un piano modificato rielabora solo i frammenti cambiati) e digest finale.
+    """
+    chunks = chunk_business_plan(business_plan_pages)
+    chunk_usage = []
+
+    def extract(chunk):
+        usage = {}
+        chunk_usage.append(usage)
+        return extract_business_plan_evidence_with_gpt(chunk, usage)
+
+    chunk_results, map_report = map_chunks(
+        chunks, extract, cache=get_analysis_cache(),
+        cache_key_fn=lambda chunk: chunk_cache_key(chunk, LLM_MODEL, BUSINESS_PLAN_MAP_PROMPT_VERSION)
+    )
+    if chunks and map_report["failed"] == len(chunks):
+        raise Exception("Fase map del business plan fallita per tutti i frammenti.")
+    stage_timings['business_plan_map'] = {"status": "ok", **map_report}
+    token_usage['business_plan_map'] = {
+        key: sum(usage.get(key) or 0 for usage in chunk_usage) for key in ("prompt_tokens", "completion_tokens")
+    }
+    print(f"INFO: Business plan diviso in {len(chunks)} frammenti ({map_report['cache_hits']} dalla cache, {map_report['failed']} falliti).")
+    return build_evidence_digest(chunk_results)
+
+def analyze_extracted_pages(deck_pages, business_plan_pages, stage_timings, token_usage):
+    """
+    Porta il testo estratto (liste di pagine) entro il budget di token ed esegue
+    run_analysis_pipeline. business_plan_pages è None se il business plan non è presente.
+    I business plan oltre MAP_REDUCE_THRESHOLD_TOKENS vengono riassunti per variabile con
+    la modalità map-reduce invece di essere ridotti alle sole sezioni che entrano nel budget.
+    Restituisce l'analisi completa dei calcoli aggiuntivi.
+    """
+    has_business_plan_flag = business_plan_pages is not None
+
+    # Condensazione entro il budget di token (deduplica, sezioni rilevanti del business plan)
+    condense_start = time.monotonic()
+    if should_use_map_reduce(business_plan_pages):
+        digest = build_business_plan_digest(business_plan_pages, stage_timings, token_usage)
+        condense_start = time.monotonic()
+        digest_budget = ANALYSIS_INPUT_TOKEN_BUDGET - count_tokens(digest) - count_tokens(EVIDENCE_DIGEST_HEADER)
+        deck_text, condensation_report = condense_for_llm(deck_pages, None, max(digest_budget, SUMMARY_INPUT_TOKEN_BUDGET))
+        all_text = deck_text + EVIDENCE_DIGEST_HEADER + digest
+        condensation_report['map_reduce'] = True
+        condensation_report['tokens_out'] = count_tokens(all_text)
+    else:
+        all_text, condensation_report = condense_for_llm(deck_pages, business_plan_pages, ANALYSIS_INPUT_TOKEN_BUDGET)
+    summary_text, summary_condensation_report = condense_for_llm(deck_pages, business_plan_pages, SUMMARY_INPUT_TOKEN_BUDGET)
+    stage_timings['condense'] = {"status": "ok", "duration_s": round(time.monotonic() - condense_start, 3)}
+    token_usage['condense_analysis'] = condensation_report
+    token_usage['condense_summary'] = summary_condensation_report
+    print(f"INFO: Testo condensato da {condensation_report['tokens_in']} a {condensation_report['tokens_out']} token (budget {ANALYSIS_INPUT_TOKEN_BUDGET}).")
+
+    debug_log(f"Testo combinato estratto (primi 500 caratteri): {all_text[:500]}...")
+
+    # 1-3. Riassunto, analisi e calcoli (oppure risultato dalla cache)
+    return run_analysis_pipeline(all_text, has_business_plan_flag, stage_timings, summary_text, token_usage)
+
+def check_near_duplicate(user_id, document_id, deck_pages, stage_timings, has_business_plan=False, business_plan_key=None):
+    """
+    Cerca tra le analisi dell'utente un pitch deck quasi identico (vedi near_duplicates), prima di
+    qualsiasi chiamata LLM. Restituisce (firma, near_duplicate, analisi precedente):
+    near_duplicate è {document_id, similarity} o None; l'analisi precedente è restituita solo con
+    NEAR_DUPLICATE_MODE=reuse e solo se è stata prodotta con lo stesso business plan (chiave nel
+    text store, o nessun business plan), per essere salvata al posto di una nuova analisi;
+    altrimenti il quasi duplicato viene soltanto segnalato.
+    Un errore non blocca il job: il controllo viene semplicemente saltato.
+    """
+    if NEAR_DUPLICATE_MODE == "off":
+        return None, None, None
+    lookup_start = time.monotonic()
+    status = "ok"
+    try:
+        with span("near_duplicate") as lookup_span:
+            signature = compute_signature("\n".join(deck_pages))
+            if signature is None:
+                return None, None, None
+            matches, other_users = get_deck_signature_store().find(user_id, signature)
+            count("near_duplicates_other_users", other_users)
+            for previous_id, similarity in matches:
+                # Lo stesso nome file viene comunque rianalizzato e sovrascritto
+                if previous_id == document_id:
+                    continue
+                # Le firme dei documenti eliminati da altre istanze possono essere ancora in memoria
+                previous_ref = get_analyses_collection(user_id).document(previous_id)
+                if NEAR_DUPLICATE_MODE == "reuse":
+                    # Analisi completa (documento hot e dettagli con le motivazioni)
+                    previous_analysis = read_analysis(previous_ref)
+                    count("firestore_reads", 2)
+                    exists = previous_analysis is not None
+                else:
+                    previous_analysis = None
+                    exists = previous_ref.get().exists
+                    count("firestore_reads")
+                if not exists:
+                    continue
+                if previous_analysis is not None and not same_business_plan(
+                        previous_analysis.get('source_text'), business_plan_key, has_business_plan):
+                    print(f"INFO: Quasi duplicato di '{previous_id}' con business plan diverso: segnalato, non riutilizzato.")
+                    previous_analysis = None
+                near_duplicate = {"document_id": previous_id, "similarity": round(similarity, 3)}
+                lookup_span.update(near_duplicate)
+                return signature, near_duplicate, previous_analysis
+            return signature, None, None
+    except Exception as e:
+        print(f"ATTENZIONE: controllo dei quasi duplicati fallito: {e}")
+        status = "error"
+        return None, None, None
+    finally:
+        stage_timings['near_duplicate'] = {"status": status, "duration_s": round(time.monotonic() - lookup_start, 3)}
+
+def reuse_previous_analysis(previous_analysis, near_duplicate):
+    """Analisi precedente riutilizzata per un quasi duplicato, senza i campi della vecchia richiesta."""
+    for field in ("stage_timings", "token_usage", "cache", "near_duplicate", "updated_at"):
+        previous_analysis.pop(field, None)
+    print(f"INFO: Quasi duplicato di '{near_duplicate['document_id']}' (similarità {near_duplicate['similarity']}), analisi riutilizzata.")
+    return previous_analysis
+
+def run_analysis_job(job):
+    """
+    Esegue un job di analisi: estrazione del testo, analisi e salvataggio su Firestore,
+    aggiornando lo stato del job (extracting -> scoring -> saved, oppure failed).
+    Un job già concluso viene ignorato (Pub/Sub può consegnare lo stesso messaggio più volte).
+    Ogni esecuzione emette una traccia "analysis_job" con gli span delle fasi (vedi telemetry).
+    """
+    with start_trace("analysis_job", job_id=job["job_id"], user_id=job["user_id"], document_id=job["document_id"]):
+        _run_analysis_job(job)
+
+def _run_analysis_job(job):
+    user_id = job["user_id"]
+    job_id = job["job_id"]
+    analysis_job_store = get_analysis_job_store()
+    current = analysis_job_store.get(user_id, job_id)
+    if current and current.get("status") in TERMINAL_JOB_STATUSES:
+        print(f"INFO: Job {job_id} già concluso ({current['status']}), messaggio ignorato.")
+        return
+
+    stage_timings = {}
+    text_keys = {}
+    try:
+        token_usage = {}
+        extraction_reports = []
+        pipeline_start = time.monotonic()
+        analysis_job_store.update(user_id, job_id, JOB_EXTRACTING)
+
+        # Chiavi del testo già estratto: dal job (nuovo tentativo) o da un'esecuzione precedente dello stesso job
+        text_keys = {**((current or {}).get("text_keys") or {}), **(job.get("text_keys") or {})}
+
+        business_plan_pages = None
+        extraction_start = time.monotonic()
+        print(f"Tentativo di leggere Pitch Deck da path GCS: {job['pitch_deck_path']} nel bucket {FIREBASE_STORAGE_BUCKET_NAME}")
+        deck_pages = load_pages(job["pitch_deck_path"], extraction_reports, text_keys)
+
+        # Leggi il Business Plan (opzionale)
+        if job.get("business_plan_path"):
+            print(f"Tentativo di leggere Business Plan da path GCS: {job['business_plan_path']} nel bucket {FIREBASE_STORAGE_BUCKET_NAME}")
+            business_plan_pages = load_pages(job["business_plan_path"], extraction_reports, text_keys)
+        stage_timings['extract'] = {
+            "status": "ok",
+            "duration_s": round(time.monotonic() - extraction_start, 3),
+            "pages": sum(report["page_count"] for report in extraction_reports),
+            "chars": sum(report["chars"] for report in extraction_reports),
+            "parallel": any(report["parallel"] for report in extraction_reports),
+            "from_text_store": not extraction_reports
+        }
+
+        # Quasi duplicati di un deck già analizzato dall'utente (segnalati prima della spesa LLM)
+        has_business_plan = business_plan_pages is not None
+        business_plan_key = text_keys.get(job["business_plan_path"]) if has_business_plan else None
+        signature, near_duplicate, previous_analysis = check_near_duplicate(
+            user_id, job["document_id"], deck_pages, stage_timings, has_business_plan, business_plan_key
+        )
+        duplicate_fields = {"near_duplicate": near_duplicate} if near_duplicate else {}
+        analysis_job_store.update(user_id, job_id, JOB_SCORING, stage_timings=stage_timings, text_keys=text_keys, **duplicate_fields)
+
+        if previous_analysis is not None:
+            final_analysis = reuse_previous_analysis(previous_analysis, near_duplicate)
+        else:
+            # Condensazione del testo, riassunto, analisi e calcoli (oppure risultato dalla cache)
+            final_analysis = analyze_extracted_pages(deck_pages, business_plan_pages, stage_timings, token_usage)
+        stage_timings['total_s'] = round(time.monotonic() - pipeline_start, 3)
+        final_analysis['stage_timings'] = stage_timings
+        final_analysis['token_usage'] = token_usage
+        final_analysis['document_name'] = job["original_file_name"]
+        # Chiavi del testo nel text store, per il re-scoring senza nuovo download (vedi batch_rescoring)
+        final_analysis['source_text'] = {
+            "pitch_deck": text_keys.get(job["pitch_deck_path"]),
+            "business_plan": text_keys.get(job["business_plan_path"]) if job.get("business_plan_path") else None,
+            "has_business_plan": business_plan_pages is not None,
+        }
+        if near_duplicate:
+            final_analysis['near_duplicate'] = {**near_duplicate, "reused": previous_analysis is not None}
+
+        # Salva su Firestore usando l'UID del token e l'ID del documento
+        with span("save") as save_span:
+            save_span["bytes"] = payload_size(final_analysis)
+            saved = save_to_firestore(job["document_id"], final_analysis, user_id=user_id)
+        count("payload_bytes_saved", save_span["bytes"])
+        if not saved:
+            raise Exception("Salvataggio su Firestore fallito.")
+        if signature:
+            try:
+                get_deck_signature_store().add(user_id, job["document_id"], signature)
+            except Exception as e:
+                print(f"ATTENZIONE: registrazione della firma del deck fallita: {e}")
+        if near_duplicate:
+            duplicate_fields = {"near_duplicate": final_analysis['near_duplicate']}
+        analysis_job_store.update(user_id, job_id, JOB_SAVED, stage_timings=stage_timings, **duplicate_fields)
+        print(f"INFO: Job {job_id} completato in {stage_timings['total_s']}s.")
+
+    except Exception as e:
+        print(f"ERRORE nel job di analisi {job_id}: {e}")
+        current_trace().fail(e)
+        # Con il testo del pitch deck nel text store il job può essere ritentato senza un nuovo caricamento
+        retryable = bool(text_keys.get(job["pitch_deck_path"]))
+        analysis_job_store.update(
+            user_id, job_id, JOB_FAILED, stage_timings=stage_timings, error=str(e), text_keys=text_keys, retryable=retryable
+        )
+
+@functools.lru_cache(maxsize=None)
+def get_analysis_job_store():
+    return AnalysisJobStore(get_firestore_client(), APP_ID)
+
+@functools.lru_cache(maxsize=None)
+def get_analysis_job_queue():
+    """Coda dei job (Pub/Sub o locale), creata alla prima richiesta di analisi."""
+    check_queue_config()
+    return create_job_queue(run_analysis_job)
 
 @functions_framework.http
 def start_analysis(request):
@@ -407,7 +729,15 @@ def start_analysis(request):
     Funzione triggerata via HTTP che riceve i percorsi dei file,
     unisce il loro testo e avvia l'analisi completa.
     Utilizza l'UID dal token per identificare l'utente.
+    Ogni richiesta emette una traccia "start_analysis" (vedi telemetry).
     """
+    with start_trace("start_analysis", method=request.method) as trace:
+        count("payload_bytes_in", request.content_length or 0)
+        response = handle_start_analysis(request)
+        trace.set(status_code=response[1] if isinstance(response, tuple) else 200)
+        return response
+
+def handle_start_analysis(request):
     # Gestione CORS
     headers = {
         'Access-Control-Allow-Origin': 'https://validatr-mvp.web.app',
@@ -422,7 +752,8 @@ def start_analysis(request):
     try:
         auth_header = request.headers.get('Authorization')
         id_token = auth_header.split('Bearer ')[1]
-        decoded_token = auth.verify_id_token(id_token, check_revoked=True)
+        with span("auth"):
+            decoded_token = verify_id_token(id_token, check_revoked=True)
         # Otteniamo l'UID direttamente dal token, è il modo più sicuro
         user_id_for_firestore = decoded_token['uid'] 
         print(f"Analisi richiesta dall'utente autenticato: UID={user_id_for_firestore}")
@@ -430,26 +761,19 @@ def start_analysis(request):
         print(f"ERRORE di autenticazione: {e}")
         return json.dumps({"error": f"Unauthorized: {e}"}), 401, headers
 
-     # --- Logga tutti i parametri ricevuti nella richiesta ---
-    print("--- Inizio Log Parametri Richiesta HTTP per start_analysis ---")
-    print(f"Metodo HTTP: {request.method}")
-    print(f"Headers della Richiesta: {request.headers}")
+    # --- Logga tutti i parametri ricevuti nella richiesta (solo con LOG_LEVEL=DEBUG: contengono il token) ---
+    debug_log(f"Metodo HTTP: {request.method}")
+    debug_log(f"Headers della Richiesta: {request.headers}")
+    debug_log(f"Corpo della Richiesta: {request.get_data(as_text=True)}")
 
+    # --- Logica Principale ---
     try:
         request_json = request.get_json(silent=True)
-        if request_json:
-            print(f"Corpo JSON della Richiesta: {json.dumps(request_json, indent=2)}")
-        else:
-            print("Nessun corpo JSON nella richiesta.")
-    except Exception as e:
-        print(f"Errore durante il parsing del corpo JSON: {e}")
-        print(f"Corpo raw della richiesta: {request.get_data(as_text=True)}") # Logga il corpo raw per debug
 
-    print("--- Fine Log Parametri Richiesta HTTP per start_analysis ---")
+        # Nuovo tentativo di un job fallito: il testo viene riletto dal text store, senza nuovo caricamento
+        if request_json.get('retryJobId'):
+            return retry_analysis_job(user_id_for_firestore, request_json['retryJobId'], headers)
 
-    # --- Logica Principale ---
-    try:
-        request_json = request.get_json(silent=True)
         pitch_deck_path = request_json.get('pitchDeckPath')
         business_plan_path = request_json.get('businessPlanPath')
         original_file_name = request_json.get('originalFileName')
@@ -464,47 +788,108 @@ def start_analysis(request):
             # (omesso per semplicità, ma da considerare in produzione)
             return {"status": "excluded", "message": "User is on the exclusion list."}
 
-        storage_client = storage.Client()
-        all_text = ""
-
-        has_business_plan_flag = False
-
-       
-        print(f"Tentativo di leggere Pitch Deck da path GCS: {pitch_deck_path} nel bucket {FIREBASE_STORAGE_BUCKET_NAME}")
-        all_text += get_text_from_storage(pitch_deck_path)
-        
-        # Leggi il Business Plan (opzionale)
-        if business_plan_path:
-            has_business_plan_flag = True # Setta il flag se il business plan è presente
-            print(f"Tentativo di leggere Business Plan da path GCS: {business_plan_path} nel bucket {FIREBASE_STORAGE_BUCKET_NAME}")
-            all_text += "\n\n--- CONTENUTO DEL BUSINESS PLAN ---\n\n"
-            all_text += get_text_from_storage(business_plan_path)
+        job = {
+            "job_id": new_job_id(),
+            "user_id": user_id_for_firestore,
+            "pitch_deck_path": pitch_deck_path,
+            "business_plan_path": business_plan_path,
+            "original_file_name": original_file_name,
+            # Usa la stessa metodologia per creare l'ID del documento e il nome
+            "document_id": os.path.splitext(original_file_name)[0],
+        }
+        current_trace().set(user_id=user_id_for_firestore, job_id=job["job_id"], document_id=job["document_id"])
+        get_analysis_job_store().create(job)
+        with span("enqueue"):
+            get_analysis_job_queue().enqueue(job)
+        print(f"INFO: Job di analisi {job['job_id']} accodato per il documento '{job['document_id']}'.")
+
+        return json.dumps({"status": JOB_QUEUED, "job_id": job["job_id"], "document_id": job["document_id"]}), 202, headers
 
-        print(f"Testo combinato estratto (primi 500 caratteri): {all_text[:500]}...")
-
-        # 1. Genera il riassunto
-        executive_summary = generate_summary_with_openai(all_text)
+    except Exception as e:
+        print(f"ERRORE GENERALE in start_analysis: {e}")
+        current_trace().fail(e)
+        return json.dumps({"error": f"Internal server error: {str(e)}"}), 500, headers
+
+def retry_analysis_job(user_id, failed_job_id, headers):
+    """Accoda un nuovo job con i dati e le chiavi del testo di un job fallito dello stesso utente."""
+    failed_job = get_analysis_job_store().get(user_id, failed_job_id)
+    if not failed_job:
+        return json.dumps({"error": "Job non trovato."}), 404, headers
+    if failed_job.get("status") != JOB_FAILED or not failed_job.get("retryable"):
+        return json.dumps({"error": "Il job non può essere ritentato: caricare di nuovo il file."}), 409, headers
+
+    job = {
+        "job_id": new_job_id(),
+        "user_id": user_id,
+        "pitch_deck_path": failed_job["pitch_deck_path"],
+        "business_plan_path": failed_job.get("business_plan_path"),
+        "original_file_name": failed_job["document_name"],
+        "document_id": failed_job["document_id"],
+        "text_keys": failed_job.get("text_keys") or {},
+        "retry_of": failed_job_id,
+    }
+    current_trace().set(user_id=user_id, job_id=job["job_id"], document_id=job["document_id"], retry_of=failed_job_id)
+    get_analysis_job_store().create(job)
+    with span("enqueue"):
+        get_analysis_job_queue().enqueue(job)
+    print(f"INFO: Job {failed_job_id} ritentato come job {job['job_id']} per il documento '{job['document_id']}'.")
+    return json.dumps({"status": JOB_QUEUED, "job_id": job["job_id"], "document_id": job["document_id"]}), 202, headers
 
-        # 2. Esegui l'analisi principale
-        analysis_result = analyze_pitch_deck_with_gpt(all_text)
-        if not analysis_result:
-            raise Exception("L'analisi GPT principale non ha prodotto risultati validi.")
-        
-        analysis_result['executive_summary'] = executive_summary
+@functions_framework.http
+def delete_analysis(request):
+    """
+    Funzione triggerata via HTTP che elimina analisi dell'utente autenticato (vedi delete_analyses):
+    corpo {"documentIds": [...]}, al massimo MAX_DELETE_DOCUMENTS per richiesta. Le dashboard ricevono
+    le eliminazioni nel campo `deleted` di fetchPitchData?since=.
+    Ogni richiesta emette una traccia "delete_analysis" (vedi telemetry).
+    """
+    with start_trace("delete_analysis", method=request.method) as trace:
+        response = handle_delete_analysis(request)
+        trace.set(status_code=response[1] if isinstance(response, tuple) else 200)
+        return response
 
-        # 3. Esegui i calcoli aggiuntivi
-        final_analysis = perform_additional_calculations(analysis_result)
-        
-        # 4. Usa la stessa metodologia per creare l'ID del documento e il nome
-        document_id = os.path.splitext(original_file_name)[0]
-        final_analysis['document_name'] = original_file_name
+def handle_delete_analysis(request):
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': 'https://validatr-mvp.web.app',
+        'Access-Control-Allow-Methods': 'POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+        'Access-Control-Max-Age': '3600'
+    }
+    if request.method == 'OPTIONS':
+        return ('', 204, headers)
 
-        # 5. Salva su Firestore usando l'UID del token e l'ID del documento
-        if not save_to_firestore(document_id, final_analysis, user_id=user_id_for_firestore):
-            raise Exception("Salvataggio su Firestore fallito.")
+    try:
+        auth_header = request.headers.get('Authorization')
+        id_token = auth_header.split('Bearer ')[1]
+        with span("auth"):
+            decoded_token = verify_id_token(id_token, check_revoked=True)
+        user_id = decoded_token['uid']
+    except Exception as e:
+        print(f"ERRORE di autenticazione: {e}")
+        return json.dumps({"error": f"Unauthorized: {e}"}), 401, headers
 
-        return json.dumps({"status": "success", "message": "Analysis completed and saved."}), 200, headers
+    request_json = request.get_json(silent=True) or {}
+    document_ids = request_json.get('documentIds')
+    if (not isinstance(document_ids, list) or not document_ids
+            or not all(isinstance(document_id, str) and document_id for document_id in document_ids)):
+        return json.dumps({"error": "Bad request: documentIds deve essere una lista di ID non vuoti."}), 400, headers
+    document_ids = list(dict.fromkeys(document_ids))
+    if len(document_ids) > MAX_DELETE_DOCUMENTS:
+        return json.dumps({"error": f"Bad request: al massimo {MAX_DELETE_DOCUMENTS} documenti per richiesta."}), 400, headers
 
+    current_trace().set(user_id=user_id, documents=len(document_ids))
+    try:
+        with span("delete", documents=len(document_ids)):
+            deleted = delete_analyses(document_ids, user_id)
     except Exception as e:
-        print(f"ERRORE GENERALE in start_analysis: {e}")
-        return json.dumps({"error": f"Internal server error: {str(e)}"}), 500, headers
\ No newline at end of file
+        print(f"ERRORE nell'eliminazione delle analisi: {e}")
+        current_trace().fail(e)
+        return json.dumps({"error": "Internal server error: Could not delete analyses."}), 500, headers
+    print(f"INFO: {len(deleted)} analisi eliminate per l'utente {user_id}.")
+    return json.dumps({"deleted": deleted}), 200, headers
+
+@functions_framework.cloud_event
+def process_analysis_job(cloud_event):
+    """Worker attivato dal topic Pub/Sub dei job di analisi."""
+    run_analysis_job(decode_pubsub_job(cloud_event))
@@ -0,0 +1,320 @@
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+
+from analysis_cache import normalize_text
+from analysis_sync import SYNC_OVERLAP_S
+
+# --- Rilevamento dei pitch deck quasi duplicati (MinHash + LSH) ---
+# Un founder che ricarica lo stesso deck con piccole modifiche e un nuovo nome file produce un nuovo
+# document_id e un testo diverso (quindi anche una nuova chiave di analysis_cache): senza questo
+# controllo ogni revisione paga un'analisi LLM completa.
+# Dal testo estratto del deck si calcola una firma MinHash sugli shingle di parole; le firme sono
+# divise in bande (LSH) e indicizzate in memoria, così la ricerca dei candidati costa pochi lookup
+# in dizionari indipendentemente dalla dimensione del corpus. I candidati vengono poi verificati con
+# la similarità di Jaccard stimata dalle firme complete.
+# Le firme sono persistite in artifacts/{APP_ID}/deck_signatures. Ogni istanza tiene un indice per
+# ciascun utente già consultato: alla prima ricerca dell'utente carica solo le sue firme (filtro su
+# user_id), poi solo quelle aggiunte da altre istanze (created_at; indice composito user_id + created_at).
+# Le analisi degli altri utenti non vengono mai lette: per la telemetria basta un contatore aggregato
+# per chiave di banda in artifacts/{APP_ID}/deck_signature_bands/{chiave} ({count}), aggiornato insieme
+# alle firme. Per inizializzare i contatori sulle firme esistenti:
+#     python near_duplicates.py rebuild-bands
+
+NEAR_DUPLICATE_MODE = os.environ.get("NEAR_DUPLICATE_MODE", "flag")  # flag | reuse | off
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+SHINGLE_SIZE = 5
+# 128 permutazioni in 16 bande da 8 righe: soglia LSH ~ (1/16)^(1/8) ≈ 0.71, sotto NEAR_DUPLICATE_THRESHOLD
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 16
+# Sotto questo numero di parole la firma non è significativa (deck senza testo estraibile)
+MIN_WORDS = 50
+BANDS_COLLECTION = 'deck_signature_bands'
+FIRESTORE_WRITE_BATCH_SIZE = 400
+
+_MERSENNE_PRIME = (1 << 31) - 1
+# Coefficienti fissi: firme calcolate da processi diversi devono essere confrontabili
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)
+]
+
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """Hash a 32 bit degli shingle di `size` parole del testo normalizzato (minuscolo, spazi compattati)."""
+    words = normalize_text(text).lower().split(" ")
+    if len(words) < MIN_WORDS:
+        return set()
+    return {
+        zlib.crc32(" ".join(words[index:index + size]).encode("utf-8"))
+        for index in range(len(words) - size + 1)
+    }
+
+
+def compute_signature(text):
+    """
+    Firma MinHash del testo (lista di NUM_PERMUTATIONS interi), oppure None se il testo è troppo corto.
+    Ogni permutazione è h(x) = (a*x + b) mod p; il calcolo è vettoriale su tutti gli shingle.
+    """
+    hashes = shingle_hashes(text)
+    if not hashes:
+        return None
+    import numpy as np
+
+    values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    coefficients = np.array(_PERMUTATIONS, dtype=np.uint64)
+    # a < 2^31 e x < 2^32: il prodotto resta entro 2^63, nessun overflow su uint64
+    permuted = (np.outer(coefficients[:, 0], values) + coefficients[:, 1:2]) % _MERSENNE_PRIME
+    return [int(value) for value in permuted.min(axis=1)]
+
+
+def band_keys(signature, bands=LSH_BANDS):
+    """Chiavi LSH della firma: una per banda, digest delle righe della banda prefissato dall'indice."""
+    rows = len(signature) // bands
+    return [
+        f"{band}:" + hashlib.blake2b(
+            ",".join(str(value) for value in signature[band * rows:(band + 1) * rows]).encode("ascii"), digest_size=8
+        ).hexdigest()
+        for band in range(bands)
+    ]
+
+
+def estimate_similarity(signature_a, signature_b):
+    """Similarità di Jaccard stimata: frazione delle permutazioni con lo stesso minimo."""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+
+def same_business_plan(source_text, business_plan_key, has_business_plan):
+    """
+    True se un'analisi precedente (campo source_text) è stata prodotta con lo stesso business plan
+    della richiesta corrente: stessa chiave nel text store, oppure nessun business plan in entrambe.
+    La firma riguarda solo il deck: se l'input precedente non è noto l'analisi non va riutilizzata.
+    """
+    if not source_text or not source_text.get('pitch_deck'):
+        return False
+    previous_has_business_plan = source_text.get('has_business_plan', bool(source_text.get('business_plan')))
+    if not has_business_plan:
+        return not previous_has_business_plan
+    return business_plan_key is not None and source_text.get('business_plan') == business_plan_key
+
+
+class MinHashLSHIndex:
+    """
+    Indice LSH in memoria: bucket {chiave di banda: chiavi dei documenti} e firme complete.
+    Inserimenti incrementali; una ricerca costa LSH_BANDS lookup più la verifica dei candidati.
+    """
+
+    def __init__(self, bands=LSH_BANDS):
+        self.bands = bands
+        self._buckets = {}
+        self._signatures = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def add(self, key, signature):
+        with self._lock:
+            if key in self._signatures:
+                self._remove(key)
+            self._signatures[key] = signature
+            for band_key in band_keys(signature, self.bands):
+                self._buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def signature(self, key):
+        return self._signatures.get(key)
+
+    def bucket_sizes(self, keys):
+        """Numero di documenti indicizzati per ciascuna delle chiavi di banda indicate."""
+        with self._lock:
+            return {band_key: len(self._buckets.get(band_key, ())) for band_key in keys}
+
+    def _remove(self, key):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band_key in band_keys(signature, self.bands):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def query(self, signature, threshold=NEAR_DUPLICATE_THRESHOLD):
+        """Documenti con similarità stimata >= threshold, come [(chiave, similarità)] in ordine decrescente."""
+        with self._lock:
+            candidates = set()
+            for band_key in band_keys(signature, self.bands):
+                candidates.update(self._buckets.get(band_key, ()))
+            matches = [(key, estimate_similarity(signature, self._signatures[key])) for key in candidates]
+        return sorted(
+            ((key, similarity) for key, similarity in matches if similarity >= threshold),
+            key=lambda match: match[1], reverse=True,
+        )
+
+
+class DeckSignatureStore:
+    """
+    Firme persistite su Firestore ({user_id, document_id, signature, created_at}) più un indice in
+    memoria per ogni utente consultato dal processo, con chiave document_id. Delle firme degli altri
+    utenti si conoscono solo i contatori aggregati per chiave di banda.
+    """
+
+    def __init__(self, db, app_id):
+        self.db = db
+        self.collection_ref = db.collection('artifacts', app_id, 'deck_signatures')
+        self.bands_ref = db.collection('artifacts', app_id, BANDS_COLLECTION)
+        self._indexes = {}
+        self._loaded_until = {}
+        self._refresh_lock = threading.Lock()
+
+    @staticmethod
+    def _doc_id(user_id, document_id):
+        return hashlib.sha256(f"{user_id}/{document_id}".encode("utf-8")).hexdigest()
+
+    def _index(self, user_id):
+        return self._indexes.setdefault(user_id, MinHashLSHIndex())
+
+    def refresh(self, user_id):
+        """Carica le firme dell'utente aggiunte dopo l'ultima lettura (tutte, alla prima chiamata per l'utente)."""
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        with self._refresh_lock:
+            query = self.collection_ref.where(filter=FieldFilter('user_id', '==', user_id))
+            loaded_until = self._loaded_until.get(user_id)
+            if loaded_until is not None:
+                # Stesso margine della sincronizzazione delle analisi: le istanze hanno orologi diversi
+                # e una firma già caricata viene semplicemente reinserita
+                query = query.where(filter=FieldFilter('created_at', '>', loaded_until - SYNC_OVERLAP_S))
+            index = self._index(user_id)
+            loaded = 0
+            for doc in query.stream():
+                entry = doc.to_dict()
+                index.add(entry['document_id'], entry['signature'])
+                loaded_until = max(loaded_until or 0, entry.get('created_at') or 0)
+                loaded += 1
+            self._loaded_until[user_id] = loaded_until or 0
+        return loaded
+
+    def _other_users_candidates(self, user_id, keys):
+        """
+        Stima dei deck di altri utenti candidati quasi duplicati: per ogni banda il contatore globale
+        meno i deck dell'utente nella stessa banda, e il massimo tra le bande (limite inferiore dei
+        candidati LSH, senza verifica della similarità).
+        """
+        totals = {
+            snapshot.id: (snapshot.to_dict() or {}).get('count', 0)
+            for snapshot in self.db.get_all([self.bands_ref.document(key) for key in keys]) if snapshot.exists
+        }
+        own = self._index(user_id).bucket_sizes(keys)
+        return max(0, max(totals.get(key, 0) - own[key] for key in keys))
+
+    def find(self, user_id, signature, threshold=NEAR_DUPLICATE_THRESHOLD):
+        """
+        Quasi duplicati della firma tra le analisi dello stesso utente: [(document_id, similarità)].
+        Le analisi di altri utenti non vengono mai lette, solo stimate dai contatori di banda (per la telemetria).
+        """
+        self.refresh(user_id)
+        own = self._index(user_id).query(signature, threshold)
+        return own, self._other_users_candidates(user_id, band_keys(signature))
+
+    def _add_band_deltas(self, writer, deltas):
+        """Aggiorna in merge i contatori di banda con gli incrementi non nulli; ritorna le scritture."""
+        from firebase_admin import firestore
+        writes = 0
+        for key, delta in deltas.items():
+            if delta:
+                writer.set(self.bands_ref.document(key), {'count': firestore.Increment(delta)}, merge=True)
+                writes += 1
+        return writes
+
+    def add(self, user_id, document_id, signature):
+        """
+        Salva la firma e aggiorna i contatori di banda in un solo batch; l'eventuale firma precedente
+        dello stesso documento viene sostituita (e tolta dai contatori).
+        """
+        deltas = Counter(band_keys(signature))
+        previous = self._index(user_id).signature(document_id)
+        if previous is not None:
+            deltas.subtract(band_keys(previous))
+        batch = self.db.batch()
+        batch.set(self.collection_ref.document(self._doc_id(user_id, document_id)), {
+            'user_id': user_id,
+            'document_id': document_id,
+            'signature': signature,
+            'created_at': time.time(),
+        })
+        self._add_band_deltas(batch, deltas)
+        batch.commit()
+        self._index(user_id).add(document_id, signature)
+
+    def add_removals(self, writer, user_id, document_ids):
+        """
+        Aggiunge a `writer` (batch o transazione) l'eliminazione delle firme dei documenti indicati e
+        il decremento dei relativi contatori di banda; ritorna le scritture.
+        Dopo il commit va chiamato discard(): le altre istanze scoprono l'eliminazione solo quando
+        il documento corrispondente non esiste più.
+        """
+        self.refresh(user_id)
+        index = self._index(user_id)
+        deltas = Counter()
+        for document_id in document_ids:
+            writer.delete(self.collection_ref.document(self._doc_id(user_id, document_id)))
+            signature = index.signature(document_id)
+            if signature is not None:
+                deltas.subtract(band_keys(signature))
+        return len(document_ids) + self._add_band_deltas(writer, deltas)
+
+    def discard(self, user_id, document_ids):
+        """Rimuove dall'indice in memoria le firme dei documenti eliminati."""
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        for document_id in document_ids:
+            index.remove(document_id)
+
+    def rebuild_band_counts(self):
+        """
+        Ricalcola da zero i contatori di banda leggendo tutte le firme (backfill o riallineamento);
+        elimina i contatori delle bande non più usate. Restituisce il numero di firme lette.
+        """
+        totals = Counter()
+        signatures = 0
+        for doc in self.collection_ref.select(['signature']).stream():
+            totals.update(band_keys(doc.to_dict()['signature']))
+            signatures += 1
+        batch, pending = self.db.batch(), 0
+        stale = (ref for ref in self.bands_ref.list_documents() if ref.id not in totals)
+        writes = [(ref, None) for ref in stale] + [(self.bands_ref.document(key), value) for key, value in totals.items()]
+        for ref, value in writes:
+            if value is None:
+                batch.delete(ref)
+            else:
+                batch.set(ref, {'count': value})
+            pending += 1
+            if pending >= FIRESTORE_WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+        print(f"INFO: Contatori di banda ricostruiti: {signatures} firme, {len(totals)} bande.")
+        return signatures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gestione delle firme MinHash dei pitch deck.")
+    parser.add_argument(
+        "command", choices=["rebuild-bands"],
+        help="rebuild-bands: ricalcola i contatori aggregati per chiave di banda da tutte le firme."
+    )
+    args = parser.parse_args()
+    from clients import APP_ID, get_firestore_client
+    DeckSignatureStore(get_firestore_client(), APP_ID).rebuild_band_counts()
@@ -0,0 +1,138 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# --- Orchestrazione parallela delle fasi indipendenti della pipeline ---
+# Le chiamate LLM (riassunto, analisi, ...) sono I/O bound: eseguirle in un
+# thread pool permette di pagare la latenza della fase più lenta invece della somma.
+
+
+class StageError(Exception):
+    """Errore sollevato quando una fase obbligatoria fallisce o va in timeout."""
+
+    def __init__(self, stage_name, message, timings=None):
+        super().__init__(f"Fase '{stage_name}': {message}")
+        self.stage_name = stage_name
+        self.timings = timings or {}
+
+
+def make_stage(fn, args=(), kwargs=None, timeout=None, required=True, fallback=None):
+    """
+    Descrive una fase da eseguire con run_parallel_stages: fn(*args, **kwargs).
+    - timeout: secondi massimi di attesa per la fase (None = nessun limite).
+    - required: se True, un errore o un timeout della fase interrompe tutte le altre.
+    - fallback: valore restituito per una fase non obbligatoria fallita o scaduta.
+    """
+    return {
+        "fn": fn,
+        "args": args,
+        "kwargs": kwargs or {},
+        "timeout": timeout,
+        "required": required,
+        "fallback": fallback,
+    }
+
+
+def run_parallel_stages(stages, max_workers=None):
+    """
+    Esegue in parallelo le fasi indipendenti e le ricongiunge rispettando i timeout per fase.
+    stages: dict {nome_fase: make_stage(...)}.
+    Restituisce (results, timings): results contiene il valore di ogni fase (o il fallback),
+    timings contiene per ogni fase lo stato ("ok", "error", "timeout", "cancelled") e la durata.
+    Se una fase obbligatoria fallisce o scade, le fasi non ancora partite vengono cancellate,
+    i risultati di quelle in corso vengono ignorati e viene sollevato StageError.
+    Il timeout di una fase decorre da quando parte davvero (una fase in coda per mancanza di
+    worker viene comunque cancellata se l'attesa supera il suo timeout). Una fase scaduta non viene
+    interrotta: Python non può cancellare un thread in esecuzione, che viene abbandonato e continua
+    fino al termine della chiamata. Le chiamate di rete dentro le fasi dovrebbero quindi avere un
+    proprio timeout (es. il parametro `timeout` del client OpenAI) così che i thread abbandonati
+    terminino da soli.
+    """
+    results = {}
+    timings = {}
+    if not stages:
+        return results, timings
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages), thread_name_prefix="stage")
+    started_at = {}
+    future_to_name = {}
+
+    def _run(name, stage):
+        # Registra l'inizio effettivo: il timeout decorre da quando la fase parte davvero
+        started_at[name] = time.monotonic()
+        return stage["fn"](*stage["args"], **stage["kwargs"])
+
+    def _deadline(name):
+        # Fase non ancora partita: la scadenza decorre dall'invio, così non resta in coda all'infinito
+        # dietro un thread abbandonato
+        timeout = stages[name]["timeout"]
+        return None if timeout is None else started_at.get(name, submit_time) + timeout
+
+    submit_time = time.monotonic()
+    for name, stage in stages.items():
+        # Ogni fase gira in una copia del contesto corrente (es. la traccia di telemetry)
+        future = executor.submit(contextvars.copy_context().run, _run, name, stage)
+        future_to_name[future] = name
+
+    pending = set(future_to_name)
+    failure = None
+
+    try:
+        while pending:
+            now = time.monotonic()
+            pending_deadlines = [deadline for deadline in (_deadline(future_to_name[f]) for f in pending) if deadline is not None]
+            wait_timeout = max(0.0, min(pending_deadlines) - now) if pending_deadlines else None
+            done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = future_to_name[future]
+                stage = stages[name]
+                duration = time.monotonic() - started_at.get(name, submit_time)
+                try:
+                    results[name] = future.result()
+                    timings[name] = {"status": "ok", "duration_s": round(duration, 3)}
+                except Exception as e:
+                    timings[name] = {"status": "error", "duration_s": round(duration, 3), "error": str(e)}
+                    print(f"ERRORE nella fase '{name}': {e}")
+                    if stage["required"]:
+                        failure = StageError(name, str(e))
+                        break
+                    results[name] = stage["fallback"]
+            if failure:
+                break
+
+            # Controlla le fasi che hanno superato la propria scadenza
+            now = time.monotonic()
+            for future in list(pending):
+                name = future_to_name[future]
+                deadline = _deadline(name)
+                if deadline is not None and now >= deadline:
+                    stage = stages[name]
+                    pending.discard(future)
+                    future.cancel()
+                    timings[name] = {
+                        "status": "timeout",
+                        "duration_s": round(now - started_at.get(name, submit_time), 3),
+                    }
+                    print(f"ATTENZIONE: la fase '{name}' ha superato il timeout di {stage['timeout']}s.")
+                    if stage["required"]:
+                        failure = StageError(name, f"timeout dopo {stage['timeout']}s")
+                        break
+                    results[name] = stage["fallback"]
+            if failure:
+                break
+    finally:
+        if failure:
+            for future in pending:
+                name = future_to_name[future]
+                future.cancel()
+                timings.setdefault(name, {"status": "cancelled", "duration_s": None})
+        # Non attendiamo i thread ancora in esecuzione: i loro risultati vengono ignorati
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if failure:
+        failure.timings = timings
+        raise failure
+
+    timings["_wall_clock_s"] = round(time.monotonic() - submit_time, 3)
+    return results, timings
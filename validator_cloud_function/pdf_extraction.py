@@ -0,0 +1,131 @@
+import mmap
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# --- Estrazione del testo dai PDF ---
+# Ogni pagina viene estratta una sola volta. Il PDF viene letto da un file locale
+# mappato in memoria (mmap) invece che da una copia completa in un BytesIO; per i
+# documenti lunghi (business plan da 60-100 pagine) le pagine vengono distribuite
+# su un pool di processi, perché extract_text() è CPU bound.
+
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.environ.get("PDF_PARALLEL_PAGE_THRESHOLD", "40"))
+PDF_EXTRACTION_WORKERS = int(os.environ.get("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Stato del singolo processo worker: ogni processo apre il PDF una volta sola
+_worker_reader = None
+_worker_handles = None
+
+
+def _open_pdf(path):
+    """Apre il PDF mappandolo in memoria; ritorna (reader, handles da chiudere)."""
+    import PyPDF2  # importato al primo PDF, non durante il cold start delle funzioni che non ne leggono
+    file_handle = open(path, "rb")
+    try:
+        mapped = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        # File vuoto o filesystem senza supporto mmap: lettura diretta dal file
+        return PyPDF2.PdfReader(file_handle), (file_handle,)
+    return PyPDF2.PdfReader(mapped), (mapped, file_handle)
+
+
+def _close_handles(handles):
+    for handle in handles:
+        try:
+            handle.close()
+        except Exception:
+            pass
+
+
+def _extract_page(reader, page_index):
+    start = time.perf_counter()
+    text = reader.pages[page_index].extract_text() or ""
+    return {
+        "page": page_index + 1,
+        "text": text,
+        "chars": len(text),
+        "duration_s": round(time.perf_counter() - start, 4),
+    }
+
+
+def _init_worker(path):
+    global _worker_reader, _worker_handles
+    _worker_reader, _worker_handles = _open_pdf(path)
+
+
+def _extract_page_range(page_indexes):
+    return [_extract_page(_worker_reader, index) for index in page_indexes]
+
+
+def extract_pdf_pages(path, parallel_threshold=PDF_PARALLEL_PAGE_THRESHOLD, max_workers=PDF_EXTRACTION_WORKERS):
+    """
+    Estrae il testo di ogni pagina del PDF locale indicato.
+    Restituisce un dict con:
+    - pages: lista di {"page", "text", "chars", "duration_s"} nell'ordine del documento;
+    - page_count, chars, duration_s, parallel (se è stato usato il pool di processi), bytes.
+    """
+    start = time.perf_counter()
+    reader, handles = _open_pdf(path)
+    try:
+        page_count = len(reader.pages)
+        parallel = max_workers > 1 and page_count >= parallel_threshold
+        if not parallel:
+            pages = [_extract_page(reader, index) for index in range(page_count)]
+    finally:
+        _close_handles(handles)
+
+    if parallel:
+        # Blocchi contigui di pagine: ogni worker riapre il PDF una volta sola
+        chunk_size = max(1, -(-page_count // (max_workers * 2)))
+        chunks = [list(range(i, min(i + chunk_size, page_count))) for i in range(0, page_count, chunk_size)]
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(path,)) as executor:
+            pages = [page for chunk in executor.map(_extract_page_range, chunks) for page in chunk]
+
+    return {
+        "pages": pages,
+        "page_count": page_count,
+        "chars": sum(page["chars"] for page in pages),
+        "duration_s": round(time.perf_counter() - start, 4),
+        "parallel": parallel,
+        "bytes": os.path.getsize(path),
+    }
+
+
+def join_pages(pages):
+    """Ricompone il testo del documento nello stesso formato usato finora dalla pipeline."""
+    text = "".join(page["text"] for page in pages if page["text"])
+    return text.replace('\n\n', '\n').strip()
+
+
+def download_blob_to_tempfile(blob):
+    """
+    Scarica un blob GCS in un file temporaneo in streaming (a blocchi) e ne restituisce il percorso.
+    Il chiamante è responsabile della rimozione del file.
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as file_handle:
+            blob.download_to_file(file_handle)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def extract_blob_text(blob):
+    """Scarica il blob in un file temporaneo, ne estrae le pagine e rimuove il file. Ritorna il report di extract_pdf_pages."""
+    path = download_blob_to_tempfile(blob)
+    try:
+        return extract_pdf_pages(path)
+    finally:
+        os.remove(path)
+
+
+def format_page_report(report):
+    """Riepilogo leggibile (una riga) dei tempi e dei caratteri per pagina."""
+    per_page = ", ".join(f"p{page['page']}:{page['chars']}c/{page['duration_s']}s" for page in report["pages"])
+    return (
+        f"{report['page_count']} pagine, {report['chars']} caratteri, {report['bytes']} byte, "
+        f"{report['duration_s']}s{' (parallelo)' if report['parallel'] else ''} [{per_page}]"
+    )
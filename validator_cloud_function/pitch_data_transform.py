@@ -0,0 +1,82 @@
+from analysis_storage import normalize_analysis
+
+# --- Trasformazione dei documenti di analisi nel formato atteso dalle dashboard ---
+# Separata da fetchPitchData.py così che possa essere riusata (e misurata) senza
+# inizializzare Firebase.
+
+# Parti del documento restituibili alla dashboard -> campi Firestore necessari per costruirle
+RESPONSE_PARTS = {
+    # document_name è sempre incluso: schema_version evita di normalizzare i documenti già canonici
+    'document_name': ['document_name', 'schema_version'],
+    'executive_summary': ['executive_summary'],
+    # calcoli_aggiuntivi: solo per i documenti non ancora migrati alla forma canonica
+    'core_metrics': ['core_metrics', 'calcoli_aggiuntivi'],
+    'settore': ['settore'],
+    'variables': ['variabili_valutate'],
+    'coherence_pairs': ['coerenza_coppie'],
+}
+ALL_PARTS = tuple(RESPONSE_PARTS)
+
+
+def parse_parts(fields_param):
+    """Converte il parametro `fields` (lista separata da virgole) nelle parti richieste; None = tutte."""
+    if not fields_param:
+        return None
+    parts = [part.strip() for part in fields_param.split(',') if part.strip()]
+    unknown = [part for part in parts if part not in RESPONSE_PARTS]
+    if unknown:
+        raise ValueError(f"Campi non supportati: {', '.join(unknown)}. Valori ammessi: {', '.join(ALL_PARTS)}.")
+    if 'document_name' not in parts:
+        parts.insert(0, 'document_name')
+    return parts
+
+
+def firestore_field_paths(parts):
+    """Campi Firestore da proiettare (select) per costruire le parti richieste."""
+    return [field for part in parts for field in RESPONSE_PARTS[part]]
+
+
+def transform_document(doc_id, doc_data, uid, parts=None):
+    """
+    Trasforma un documento pitch_deck_analyses nel formato della dashboard, limitandosi alle parti richieste.
+    I documenti sono in forma canonica (vedi analysis_storage): la trasformazione è una semplice
+    proiezione dei campi; i documenti non ancora migrati vengono prima normalizzati.
+    """
+    parts = parts or ALL_PARTS
+    doc_data = normalize_analysis(doc_data)
+    transformed_doc_data = {'document_name': doc_data.get('document_name', doc_id)}
+
+    if 'executive_summary' in parts and doc_data.get('executive_summary'):
+        transformed_doc_data['executive_summary'] = doc_data['executive_summary']
+
+    if 'core_metrics' in parts:
+        core_metrics = doc_data.get('core_metrics') or {}
+        transformed_doc_data['core_metrics'] = {
+            'indice_coerenza': core_metrics.get('indice_coerenza'),
+            'classe_pitch': core_metrics.get('classe_pitch'),
+            'z_score': core_metrics.get('z_score'),
+            'final_adjusted_score': core_metrics.get('final_adjusted_score'),
+            'final_score': core_metrics.get('final_score'),
+            'userId': core_metrics.get('userId', uid)
+        }
+
+    if 'settore' in parts:
+        transformed_doc_data['settore'] = doc_data.get('settore')
+
+    # Le motivazioni sono un oggetto {it, en} (o una stringa nei documenti più vecchi) e vengono
+    # passate così come sono; nei documenti hot sono assenti (vedi analysis_storage)
+    if 'variables' in parts:
+        transformed_doc_data['variables'] = [{
+            'nome_variabile': var.get('nome'),
+            'punteggio_variabile': var.get('punteggio'),
+            'motivazione_variabile': var.get('motivazione')
+        } for var in doc_data['variabili_valutate']]
+
+    if 'coherence_pairs' in parts:
+        transformed_doc_data['coherence_pairs'] = [{
+            'nome_coppia': cp.get('coppia'),
+            'punteggio_coppia': cp.get('punteggio'),
+            'motivazione_coppia': cp.get('motivazione')
+        } for cp in doc_data['coerenza_coppie']]
+
+    return transformed_doc_data
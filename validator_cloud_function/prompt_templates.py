@@ -0,0 +1,201 @@
+import functools
+import hashlib
+
+from rubrics import PREDEFINED_SECTORS, RUBRICS, COHERENCE_PAIRS, COHERENCE_GUIDELINES
+
+# --- Prompt di sistema compilati ---
+# I prompt dipendono solo da costanti del modulo rubrics: vengono renderizzati una volta
+# per processo (per variante) e riutilizzati a ogni richiesta. Tutto ciò che è comune alle
+# due varianti (con e senza business plan) sta all'inizio del prompt, così il prefisso resta
+# identico byte per byte tra le richieste e può sfruttare il prompt caching del provider.
+
+# Istruzioni aggiuntive per l'analisi combinata pitch deck + business plan.
+BUSINESS_PLAN_INSTRUCTIONS = """
+
+### ISTRUZIONI PER ANALISI DI DUE DILIGENCE (PITCH DECK + BUSINESS PLAN)
+
+**Principio Guida Fondamentale:**
+Il Business Plan è la **fonte primaria di verità**. Il Pitch Deck fornisce la visione, ma il Business Plan fornisce le prove. Le tue valutazioni e i tuoi punteggi devono basarsi sulle evidenze concrete e sui dati dettagliati del Business Plan.
+
+**Processo di Valutazione Obbligatorio:**
+
+1.  **Lettura Critica:** Analizza il Pitch Deck per capire le affermazioni principali. Successivamente, esamina il Business Plan con scetticismo professionale per trovare i dati che **supportino o smentiscano** tali affermazioni.
+
+2.  **Priorità Assoluta alle Prove:** Per ogni variabile, la tua motivazione e il tuo punteggio devono partire dai dati del Business Plan. Se un'informazione del Pitch Deck non è supportata da evidenze nel Business Plan, considerala **"non verificata"** e assegna un punteggio inferiore.
+
+3.  **Come Gestire le Discrepanze (Regola di Scrittura):**
+    Quando noti una discrepanza tra i due documenti, **evidenziala esplicitamente nella motivazione**. Utilizza una struttura simile a questa:
+    * *Esempio*: "La proiezione finanziaria nel Business Plan indica un fatturato di €1M al terzo anno. Questo **ridimensiona in modo significativo** l'ottimistica stima di €5M presentata nel Pitch Deck."
+    * *Esempio*: "Il Business Plan identifica tre competitor principali. Questo **fornisce un contesto più realistico** rispetto al Pitch Deck, che descriveva il mercato come 'poco affollato'."
+"""
+
+SUMMARY_SYSTEM_PROMPT = """Sei un analista finanziario esperto. Il tuo compito è analizzare il testo di un pitch deck e creare un riassunto conciso.
+Restituisci il riassunto come un oggetto JSON con due chiavi: "it" per la versione italiana e "en" per la versione inglese.
+Ogni riassunto deve essere di massimo 3 righe e catturare l'essenza del prodotto, il problema che risolve e il suo target principale."""
+
+
+def _render_business_plan_map_prompt():
+    """Prompt della fase map: estrazione delle evidenze per variabile da un frammento del business plan."""
+    criteria = "\n".join(f"- {name}: {details['criteri']}" for name, details in RUBRICS.items())
+    return f"""Sei un analista di due diligence. Ricevi un frammento di un business plan.
+Estrai SOLO le evidenze concrete (dati, cifre, fatti verificabili, discrepanze) utili a valutare ciascuna delle seguenti variabili:
+{criteria}
+
+Restituisci un oggetto JSON con la chiave "evidenze": un oggetto che ha per chiavi i nomi esatti delle variabili
+({", ".join(RUBRICS)}) e per valori liste di frasi brevi in italiano (massimo 5 per variabile, massimo 40 parole ciascuna).
+Se il frammento non contiene evidenze per una variabile restituisci una lista vuota. Non inventare informazioni."""
+
+
+def _render_analysis_system_prompt(has_business_plan):
+    """Renderizza il prompt di sistema per l'analisi (chiamata una sola volta per variante)."""
+    system_prompt_content = """Sei un analista esperto nell'analisi e valutazione di pitch deck per startup con background nei principali fondi di investimento per startup come Sequoia Capital, Andreessen Horowitz, P101, 360 capital, Google Ventures, LVenture Group, Y Combinator e CDP Venture Capital SGR di cui utilizzi best practice e approccio.
+
+Il tuo compito è valutare l'opportunità di investimento in startup per determinare quanto è consigliato l'investimento nella startup in esame partendo dal pitch deck fornito. Identifichi 7 variabili chiave, assegnando un punteggio da 0 a 100 a ciascuna variabile basandoti sulle rubriche fornite, fornendo una motivazione dettagliata per ogni punteggio, e valutando la coerenza interna tra specifiche coppie di variabili. Restituisci tutte le informazioni in un formato JSON valido.
+
+Ricorda che dovrai valutare le informazioni ottenute in maniera analitica e critica nella prospettiva di un analista che deve discernere le migliori opportunità di investiemento. Se necessario, includi nel tuo processo di valutazione fonti esterne affidabili per verificare i claim dei pitch deck e fornire una valutazione aggiornata.
+"""
+
+    system_prompt_content += """
+### Rubrica per i punteggi (0-100):
+* **0-40**: Mancante o completamente irrilevante.
+* **40-55**: Presente ma estremamente debole, vago o incoerente.
+* **55-77**: Buono, chiaro e convincente, con piccoli margini di miglioramento.
+* **77-100**: Eccellente, altamente credibile, ben articolato e supportato da dettagli solidi.
+
+---
+
+### Criteri di Valutazione Dettagliati
+Per ogni variabile, valuta il punteggio (0-100) e la motivazione basandoti su questi criteri:
+"""
+
+    for var, details in RUBRICS.items():
+        system_prompt_content += f"\n* **{var}**: {details['criteri']}"
+
+    # --- NUOVA ISTRUZIONE PER L'IA: Identificazione del Settore ---
+    system_prompt_content += f"""
+
+---
+
+### Identificazione del Settore
+Basandoti sul contenuto del pitch deck (e del business plan, se presente), identifica il settore di appartenenza della startup. Devi scegliere **UNO SOLO** tra i seguenti settori predefiniti. Se la startup non rientra chiaramente in nessuno di questi, scegli "Altro".
+Settori disponibili: {', '.join(PREDEFINED_SECTORS)}
+
+---
+
+### Criteri di Valutazione della Coerenza (0-100)
+Valuta la coerenza (0-100) delle seguenti coppie di variabili. Un punteggio di 100 indica perfetta coerenza.
+"""
+
+    for i, (var1, var2) in enumerate(COHERENCE_PAIRS):
+        pair_tuple = (var1, var2)
+        guideline = COHERENCE_GUIDELINES.get(pair_tuple, "Nessuna linea guida specifica.")
+        system_prompt_content += f"\n{i+1}. **{var1} - {var2}**: {guideline}"
+
+    # --- AGGIORNAMENTO DEL FORMATO DI OUTPUT JSON ---
+    system_prompt_content += """
+---
+
+### Formato di Output (JSON)
+Il formato JSON di output deve essere ESATTAMENTE come segue. Non includere alcun testo aggiuntivo prima o dopo il blocco JSON.
+```json
+{
+  "settore": "string",  // Nuovo campo per il settore
+  "variabili_valutate": [
+    {
+      "nome": "Problema",
+      "punteggio": 0,
+      "motivazione": { "it": "string", "en": "string" }
+    },
+    {
+      "nome": "Target",
+      "punteggio": 0,
+      "motivazione": { "it": "string", "en": "string" }
+    },
+    {
+      "nome": "Soluzione",
+      "punteggio": 0,
+      "motivazione": { "it": "string", "en": "string" }
+    },
+    {
+      "nome": "Mercato",
+      "punteggio": 0,
+      "motivazione": { "it": "string", "en": "string" }
+    },
+    {
+      "nome": "MVP",
+      "punteggio": 0,
+      "motivazione": { "it": "string", "en": "string" }
+    },
+    {
+      "nome": "Team",
+      "punteggio": 0,
+      "motivazione": { "it": "string", "en": "string" }
+    },
+    {
+      "nome": "Ritorno Atteso",
+      "punteggio": 0,
+      "motivazione": { "it": "string", "en": "string" }
+    }
+  ],
+  "coerenza_coppie": [
+"""
+    for i, (var1, var2) in enumerate(COHERENCE_PAIRS):
+        system_prompt_content += f"""    {{
+      "coppia": "{var1} - {var2}",
+      "punteggio": 0,
+      "motivazione": {{ "it": "string", "en": "string" }}
+    }}{',' if i < len(COHERENCE_PAIRS) - 1 else ''}
+"""
+
+    system_prompt_content += """  ]
+}
+"""
+
+    # --- Fine del prefisso statico: da qui in poi il contenuto dipende dalla variante ---
+    if has_business_plan:
+        system_prompt_content += BUSINESS_PLAN_INSTRUCTIONS
+
+    system_prompt_content += """
+Testo del pitch deck da analizzare:
+"""
+    return system_prompt_content
+
+
+@functools.lru_cache(maxsize=None)
+def get_analysis_system_prompt(has_business_plan=False):
+    """Restituisce il prompt di sistema compilato per la variante richiesta."""
+    return _render_analysis_system_prompt(bool(has_business_plan))
+
+
+@functools.lru_cache(maxsize=None)
+def get_analysis_prompt_version(has_business_plan=False):
+    """Versione (hash del contenuto) del prompt di analisi per la variante richiesta."""
+    return _short_hash(get_analysis_system_prompt(has_business_plan))
+
+
+def build_analysis_request_body(pitch_text, has_business_plan, model):
+    """Corpo della richiesta chat completion per l'analisi del pitch (modello, messaggi e parametri)."""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": get_analysis_system_prompt(has_business_plan)},
+            {"role": "user", "content": pitch_text}
+        ],
+        "temperature": 0.1,
+        "max_tokens": 3800,
+        "response_format": {"type": "json_object"}
+    }
+
+
+def _short_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+BUSINESS_PLAN_MAP_SYSTEM_PROMPT = _render_business_plan_map_prompt()
+BUSINESS_PLAN_MAP_PROMPT_VERSION = _short_hash(BUSINESS_PLAN_MAP_SYSTEM_PROMPT)
+
+# Versione complessiva dei prompt (entrambe le varianti + riassunto):
+# cambia ogni volta che cambia una rubrica, una linea guida, un settore o il testo dei prompt.
+PROMPT_VERSION = _short_hash(
+    get_analysis_system_prompt(False) + get_analysis_system_prompt(True) + SUMMARY_SYSTEM_PROMPT
+)
@@ -0,0 +1,43 @@
+import os
+import threading
+import time
+
+# --- Limitazione della frequenza delle chiamate verso l'API OpenAI ---
+# Token bucket thread-safe: ogni chiamata consuma un gettone, i gettoni si ricaricano
+# a velocità costante (richieste al minuto). Usato dalle esecuzioni batch per restare
+# entro i limiti dell'account quando molte analisi girano in parallelo.
+
+OPENAI_REQUESTS_PER_MINUTE = os.environ.get("OPENAI_REQUESTS_PER_MINUTE")
+
+
+class RateLimiter:
+    """Token bucket: al massimo `requests_per_minute` acquisizioni al minuto, con burst fino a `burst`."""
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate_per_s = requests_per_minute / 60.0
+        self.capacity = float(burst or max(1, int(requests_per_minute // 10)))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocca finché non sono disponibili `tokens` gettoni; restituisce i secondi di attesa."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate_per_s)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                sleep_for = (tokens - self._tokens) / self.rate_per_s
+            time.sleep(sleep_for)
+            waited += sleep_for
+
+
+def create_openai_rate_limiter(requests_per_minute=OPENAI_REQUESTS_PER_MINUTE):
+    """Crea il limitatore se è configurato un limite (variabile OPENAI_REQUESTS_PER_MINUTE), altrimenti None."""
+    if not requests_per_minute:
+        return None
+    return RateLimiter(float(requests_per_minute))
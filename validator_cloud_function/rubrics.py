@@ -0,0 +1,79 @@
+# --- Rubriche, coppie di coerenza e settori usati per l'analisi dei pitch deck ---
+# Definiti in un modulo separato così che il prompt possa essere compilato
+# senza importare main.py e i client cloud che inizializza.
+
+PREDEFINED_SECTORS = [
+    "Pubblica Amministrazione",
+    "Automotive",
+    "Retail",
+    "Finanza e Assicurazioni",
+    "Salute e Benessere",
+    "Educazione",
+    "Tecnologia e Software",
+    "Industria Manifatturiera",
+    "Altro" # Aggiungi "Altro" come fallback se nessuno degli altri si adatta perfettamente
+]
+
+# --- Definizione delle Rubriche di Valutazione ---
+# Contengono i criteri dettagliati per l'analisi di ogni variabile del pitch deck.
+RUBRICS = {
+    "Problema": {
+        "criteri": "Misura quanto il problema che la startup intende risolvere sia reale, urgente e rilevante per gli stakeholder. Variabili valutate: concretezza, urgenza percepita, intensità del bisogno nel mercato, verifica empirica attraverso feedback degli utenti target."
+    },
+    "Target": {
+        "criteri": "Determina il grado di definizione, raggiungibilità e predisposizione alla spesa degli utenti destinatari della soluzione. Variabili valutate: precisione segmentale, capacità economica, willingness-to-pay, facilità di essere identificato e raggiunto, maturità tecnologica o predisposizione all'adottare nuove soluzioni, dimensione quantitativa e qualitativa del pubblico target."
+    },
+    "Soluzione": {
+        "criteri": "Analizza l'efficacia pratica della soluzione proposta dalla startup e la sua capacità di essere percepita come valida e superiore rispetto alle alternative esistenti. Variabili valutate: livello di innovazione, fattibilità tecnica, immediatezza di valore percepito, facilità d'uso, posizionamento rispetto ai competitor, rilevanza rispetto al problema, difficoltà a essere replicata da terzi."
+    },
+    "Mercato": {
+        "criteri": "Quantifica in modo preciso la dimensione (TAM/SAM/SOM), il potenziale di crescita, il timing, l'attrattività economica del mercato di riferimento, la saturazione/competitività, la facilità ad aggredirlo. Variabili valutate: dimensione economica, trend di crescita, competitività (forza dei competitor, saturazione competitiva, capacità/attitudine dei competitor a innovare; considera anche competitor indiretti), facilità di ingresso (valutare eventuali barriere all'entrata e la capacità della startup di superarle), apertura del mercato a nuovi player, presenza di minacce esterne o rischi critici (come forti correlazioni del mercato di riferimento a altri fattori quali altri mercati, normative, politica, e analizza in modo critico possibili rischi derivanti da questa correlazione), presenza di opportunità e sinergie."
+    },
+    "MVP": {
+        "criteri": "Valuta se l'MVP esistente dimostra chiaramente e concretamente il valore della soluzione proposta ed è sufficientemente maturo per essere testato dagli utenti reali. In alcuni casi il servizio/prodotto/piattaforma potrebbe essere già sviluppato e in tal caso verranno riportati dati sull'utilizzo/acquisizione e traction del prodotto/servizio. Variabili valutate: completezza, usabilità effettiva, scalabilità tecnica iniziale, robustezza dimostrativa rispetto al valore promesso."
+    },
+    "Team": {
+        "criteri": "Determina se il team attuale possiede le competenze, l'esperienza, e la complementarietà necessarie per portare con successo il prodotto sul mercato e per gestire crescita e rischi operativi. Verifica che le competenze del team siano coerenti con le esigenze specifiche della startup. Variabili valutate: skill tecniche ed esecutive, presenza di figure chiave (CTO, CEO, CMO), esperienza precedente, capacità di attrarre ulteriori talenti."
+    },
+    "Ritorno Atteso": {
+        "criteri": "Stima numericamente l'attrattività finanziaria della startup dal punto di vista degli investitori professionali, utilizzando modelli predittivi rigorosi come IRR (Internal Rate of Return), moltiplicatori attesi e diluizione equity. Variabili valutate: IRR stimato, multipli di investimento, equity post-diluizione, comparabilità con benchmark di mercato, giustificazione oggettiva della valuation richiesta, capacità del business model di generare revenue e profitti scalabili e sostenibili nel tempo, solidità e affidabilità delle proiezioni finanziarie stimate, prova di avere già generato entrate e avere utenti paganti/clienti."
+    }
+}
+
+# Definisce le 21 coppie di variabili da analizzare per la coerenza.
+COHERENCE_PAIRS = [
+    ("Problema", "Target"), ("Problema", "Soluzione"), ("Problema", "Mercato"),
+    ("Problema", "MVP"), ("Problema", "Team"), ("Problema", "Ritorno Atteso"),
+    ("Target", "Soluzione"), ("Target", "Mercato"), ("Target", "MVP"),
+    ("Target", "Team"), ("Target", "Ritorno Atteso"),
+    ("Soluzione", "Mercato"), ("Soluzione", "MVP"), ("Soluzione", "Team"),
+    ("Soluzione", "Ritorno Atteso"),
+    ("Mercato", "MVP"), ("Mercato", "Team"), ("Mercato", "Ritorno Atteso"),
+    ("MVP", "Team"), ("MVP", "Ritorno Atteso"),
+    ("Team", "Ritorno Atteso")
+]
+
+# Fornisce linee guida specifiche per la valutazione di ogni coppia di coerenza.
+COHERENCE_GUIDELINES = {
+    ("Problema", "Target"): "Elementi utili da considerare: se il target scelto è il principale percettore del problema; se il problema è rilevante e urgente per quel target; se il target è colui che può prendere/influenzare decisioni di acquisto per risolvere quel problema.",
+    ("Problema", "Soluzione"): "Elementi utili da considerare: se la soluzione risolve il problema in modo efficace, scalabile, ripetibile, agevole e fruibile.",
+    ("Problema", "Mercato"): "Elementi utili da considerare: se il mercato è già in cerca/attivo per risolvere il problema (indicazione di problema realmente percepito); se la concorrenza ha soluzioni per risolvere il problema (valutare se vi sono per dimostrare quanto è pronto il mercato); quanto sono efficaci le attuali soluzioni sul mercato nel risolvere il problema (se sono molto efficaci vi è un impatto negativo sullo score).",
+    ("Problema", "MVP"): "Elementi utili da considerare: se l'mvp è capace di risolvere la componente principale del problema; se la fruibilità dell'MVP è conforme con le modalità di risoluzione del problema.",
+    ("Problema", "Team"): "Elementi utili da considerare: se il team ha esperienza diretta del problema; se ha le competenze per valutare e comprendere correttamente il problema.",
+    ("Problema", "Ritorno Atteso"): "Elementi utili da considerare: se il problema è temporaneo o rimane nel tempo (nel primo caso impatto negativo); se il problema è così impattante da assicurare una willingness to pay per risolverlo stabile o in crescita nei prossimi anni; se il problema può venire meno facilmente per esternalità probabili (politiche, socio-economiche, normative, tecnologiche).",
+    ("Target", "Soluzione"): "Elementi utili da considerare: se comportamenti, attitudini, abitudini e maturità digitale del target sono coerenti con la soluzione proposta.",
+    ("Target", "Mercato"): "Elementi utili da considerare: se il target scelto è una componente importante del mercato, ben definita, identificabile e raggiungibile; se il target è una componente del mercato propensa ad adottare nuove soluzioni; se il target scelto è già fidalizzato a altre aziende/soluzioni/metodologie (impatto negativo).",
+    ("Target", "MVP"): "Elementi utili da considerare: se l'MVP è facilmente fruibile dal target, compatibile con le sue abitudini, comportamenti, bisogni e maturità digitale.",
+    ("Target", "Team"): "Elementi utili da considerare: se il team ha le competenze, esperienze e abilità per comprendere il target, raggiungerlo e convincerlo.",
+    ("Target", "Ritorno Atteso"): "Elementi utili da considerare: quanto il target è di un numero sufficiente (ora e nei prossimi anni) e ha le disponibilità economiche per generare ritorni; se il target è caratterizzato per possibilità di fidelizzazione e facilità di conversione per genererare ritorni positivi e in crescita; se le abitudini del target lo rendono idonei a generare ricavi crescenti, scalabili e sostenibili nel breve, medio e lungo termine.",
+    ("Soluzione", "Mercato"): "Elementi utili da considerare: se la soluzione si differenzia sufficientemente da competitor diretti e indiretti, se i benefici della soluzione possono essere facilmente compresi dal mercato.",
+    ("Soluzione", "MVP"): "Elementi utili da considerare: se l'mvp permette di comprendere la soluzione e ne riassume efficacemente i vantaggi chiave; se l'mvp è una soluzione efficace; se l'mvp può essere facilmente scalato in una soluzione più completa e differenziata.",
+    ("Soluzione", "Team"): "Elementi utili da considerare: se il team ha le abilità, esperienze e network per sviluppare, presentare e vendere efficacemente la soluzione.",
+    ("Soluzione", "Ritorno Atteso"): "Elementi utili da considerare: se la soluzione è scalabile e rimane valida e rilevante nel tempo; se la soluzione è difficilmente replicabile da terzi; se la soluzione è compatibile con il business model previsto per generare alte marginalità; se la soluzione agevola la fidelizzazione con abbonamenti/acquisti ripetuti.",
+    ("Mercato", "MVP"): "Elementi utili da considerare: se l'mvp è compatibile con le esigenze del mercato; se è rilevante, differenziato, chiaro e fruibile dato il contesto di mercato in cui è calato.",
+    ("Mercato", "Team"): "Elementi utili da considerare: il team ha le abilità, esperienze o connessioni per comprendere il mercato, penetrarlo e superare eventuali barriere all'entrata.",
+    ("Mercato", "Ritorno Atteso"): "Elementi utili da considerare: se il mercato (grandezza, crescita, grado di competitività, apertura) è coerente con gli obiettivi di ritorno atteso indicati.",
+    ("MVP", "Team"): "Elementi utili da considerare: se il team ha capacità e esperienze coerenti per sviluppare l'mvp indicato.",
+    ("MVP", "Ritorno Atteso"): "Elementi utili da considerare: se i dati sullo stato dell'mvp, le sue caratteristiche e la traction generata (utenti, tester, revenue iniziali) sono coerenti con gli obiettivi di ritorno atteso.",
+    ("Team", "Ritorno Atteso"): "Elementi utili da considerare: se il team ha le abilità, esperienze e connessioni utili a raggiungere i risultati indicati."
+}
@@ -0,0 +1,121 @@
+import json
+import os
+
+# --- Calcolo delle metriche finali a partire dai punteggi dell'LLM ---
+# Funzioni pure, senza dipendenze da Firebase o OpenAI: usate dalla pipeline, dai job batch e dai benchmark.
+# Pesi delle variabili, miscela final_score/indice_coerenza e soglie delle classi sono dati versionati
+# in scoring_configs.json: una nuova versione si aggiunge lì e si applica a tutto il corpus con
+# core_metrics_rescoring.py, senza rieseguire l'LLM. core_metrics registra la versione usata.
+
+SCORING_CONFIGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scoring_configs.json")
+SCORING_VERSION = os.environ.get("SCORING_VERSION", "v1")
+
+with open(SCORING_CONFIGS_PATH, "r", encoding="utf-8") as _configs_file:
+    SCORING_CONFIGS = json.load(_configs_file)
+
+
+def get_scoring_config(version=None):
+    """Configurazione di scoring della versione indicata (default: SCORING_VERSION), con la chiave 'version'."""
+    version = version or SCORING_VERSION
+    if version not in SCORING_CONFIGS:
+        raise ValueError(f"Versione di scoring sconosciuta: {version}. Disponibili: {', '.join(SCORING_CONFIGS)}.")
+    return {"version": version, **SCORING_CONFIGS[version]}
+
+
+def classify_score(final_adjusted_score, config):
+    """Classe del pitch: la prima soglia (in ordine decrescente) raggiunta dal punteggio."""
+    for threshold, label in config["class_thresholds"]:
+        if final_adjusted_score >= threshold:
+            return label
+    return config["default_class"]
+
+
+def build_core_metrics(final_score, ic, final_adjusted_score, config, z_score=None):
+    """Dizionario core_metrics (valori arrotondati come sempre a 2 decimali)."""
+    return {
+        "indice_coerenza": round(ic, 2),
+        "final_score": round(final_score, 2),
+        "final_adjusted_score": round(final_adjusted_score, 2),
+        "z_score": z_score,
+        "classe_pitch": classify_score(final_adjusted_score, config),
+        "scoring_version": config["version"],
+    }
+
+
+def perform_additional_calculations(gpt_analysis_data, config=None):
+    """
+    Calcola lo score finale, l'indice di coerenza e la classe della startup
+    basandosi sui dati analizzati dall'IA, con la configurazione di scoring indicata
+    (default: quella di SCORING_VERSION).
+    """
+    config = config or get_scoring_config()
+    variabili_valutate_dict = {v['nome']: v['punteggio'] for v in gpt_analysis_data.get('variabili_valutate', [])}
+    coerenza_coppie = gpt_analysis_data.get('coerenza_coppie', [])
+
+    total_coherence_score = sum(item['punteggio'] for item in coerenza_coppie)
+    num_coherence_pairs = len(coerenza_coppie) if coerenza_coppie else 0
+    ic = (total_coherence_score / num_coherence_pairs) if num_coherence_pairs > 0 else 0
+
+    weights = config["weights"]
+    final_score = sum(variabili_valutate_dict.get(var, 0) * weights.get(var, 0) for var in weights)
+
+    final_adjusted_score = (final_score * config["blend"]["final_score"]) + (ic * config["blend"]["indice_coerenza"])
+
+    gpt_analysis_data["core_metrics"] = build_core_metrics(final_score, ic, final_adjusted_score, config)
+
+    return gpt_analysis_data
+
+
+def compute_core_metrics_arrays(documents, config):
+    """
+    Versione vettoriale di perform_additional_calculations per molti documenti: carica i punteggi
+    di variabili_valutate e coerenza_coppie in array NumPy e calcola final_score, indice_coerenza e
+    final_adjusted_score (non arrotondati) e la classe di tutti i documenti in un solo passaggio.
+    Le somme seguono lo stesso ordine del calcolo per singolo documento, quindi i risultati
+    coincidono bit per bit. Restituisce un dict di array allineati a `documents`.
+    """
+    import numpy as np
+
+    weights = config["weights"]
+    variables = list(weights)
+    variable_index = {name: index for index, name in enumerate(variables)}
+    count = len(documents)
+    max_pairs = max((len(data.get('coerenza_coppie') or []) for data in documents), default=0)
+
+    variable_scores = np.zeros((count, len(variables)), dtype=np.float64)
+    coherence_scores = np.zeros((count, max_pairs), dtype=np.float64)
+    coherence_counts = np.zeros(count, dtype=np.int64)
+    for row, data in enumerate(documents):
+        for item in data.get('variabili_valutate') or []:
+            column = variable_index.get(item.get('nome'))
+            if column is not None:
+                variable_scores[row, column] = item.get('punteggio') or 0
+        pairs = data.get('coerenza_coppie') or []
+        for column, item in enumerate(pairs):
+            coherence_scores[row, column] = item.get('punteggio') or 0
+        coherence_counts[row] = len(pairs)
+
+    # Accumulo colonna per colonna (non np.sum/np.dot) per riprodurre esattamente le somme sequenziali
+    final_score = np.zeros(count)
+    for column, name in enumerate(variables):
+        final_score = final_score + variable_scores[:, column] * weights[name]
+    coherence_total = np.zeros(count)
+    for column in range(max_pairs):
+        coherence_total = coherence_total + coherence_scores[:, column]
+    ic = np.divide(coherence_total, coherence_counts, out=np.zeros(count), where=coherence_counts > 0)
+
+    final_adjusted_score = (final_score * config["blend"]["final_score"]) + (ic * config["blend"]["indice_coerenza"])
+
+    classes = np.full(count, config["default_class"], dtype=object)
+    assigned = np.zeros(count, dtype=bool)
+    for threshold, label in config["class_thresholds"]:
+        match = ~assigned & (final_adjusted_score >= threshold)
+        classes[match] = label
+        assigned |= match
+
+    return {
+        "final_score": final_score,
+        "indice_coerenza": ic,
+        "final_adjusted_score": final_adjusted_score,
+        "classe_pitch": classes,
+    }
@@ -0,0 +1,236 @@
+import argparse
+import copy
+import math
+import os
+import random
+import time
+
+from rubrics import PREDEFINED_SECTORS
+
+# --- Statistiche di settore per lo z_score ---
+# Per ogni settore di PREDEFINED_SECTORS e sull'intero corpus si mantengono count, sum e sumsq del
+# final_adjusted_score, da cui media e deviazione standard. Le somme sono distribuite su STATS_SHARDS
+# documenti artifacts/{APP_ID}/public/data/score_stats/final_adjusted_score_{NN}: ogni salvataggio
+# applica i propri incrementi (firestore.Increment) a uno shard casuale senza leggerlo, quindi i
+# salvataggi di utenti diversi non si contendono un unico documento. Chi calcola uno z_score legge
+# tutti gli shard (fuori dalla transazione) e li somma: lo z_score può ignorare i salvataggi
+# concorrenti, le statistiche no.
+# Dopo il passaggio dal vecchio documento unico (Welford) eseguire `python sector_stats.py rebuild`.
+
+STATS_DOC_PREFIX = 'final_adjusted_score'
+STATS_SHARDS = int(os.environ.get("SECTOR_STATS_SHARDS", "16"))
+# Sotto questa numerosità lo z_score di settore non è significativo: si usano le statistiche globali
+MIN_SECTOR_SAMPLES = 10
+# Sotto questa numerosità non viene calcolato alcuno z_score
+MIN_GLOBAL_SAMPLES = 5
+FIRESTORE_WRITE_BATCH_SIZE = 400
+MOMENT_FIELDS = ('count', 'sum', 'sumsq')
+
+
+def _stats_collection(db, app_id):
+    return db.collection('artifacts', app_id, 'public', 'data', 'score_stats')
+
+
+def stats_shard_ref(db, app_id, shard):
+    return _stats_collection(db, app_id).document(f"{STATS_DOC_PREFIX}_{shard:02d}")
+
+
+def stats_shard_refs(db, app_id):
+    """Riferimenti di tutti gli shard delle statistiche."""
+    return [stats_shard_ref(db, app_id, shard) for shard in range(STATS_SHARDS)]
+
+
+def empty_stats():
+    return {'global': _empty_moments(), 'sectors': {sector: _empty_moments() for sector in PREDEFINED_SECTORS}}
+
+
+def _empty_moments():
+    return {'count': 0, 'sum': 0.0, 'sumsq': 0.0}
+
+
+def _add_moments(total, moments, sign=1):
+    for field in MOMENT_FIELDS:
+        total[field] += sign * (moments or {}).get(field, 0)
+
+
+def merge_stats(snapshots):
+    """Somma gli shard (snapshot Firestore) in un'unica struttura di statistiche."""
+    stats = empty_stats()
+    for snapshot in snapshots:
+        if not snapshot.exists:
+            continue
+        data = snapshot.to_dict() or {}
+        _add_moments(stats['global'], data.get('global'))
+        for sector, moments in (data.get('sectors') or {}).items():
+            _add_moments(stats['sectors'].setdefault(sector, _empty_moments()), moments)
+    return stats
+
+
+def read_sector_stats(db, app_id, transaction=None):
+    """Statistiche correnti: somma di tutti gli shard in un solo get_all."""
+    return merge_stats(db.get_all(stats_shard_refs(db, app_id), transaction=transaction))
+
+
+def stats_difference(new, old):
+    """Differenza campo per campo new - old (l'incremento che porta old a new)."""
+    delta = copy.deepcopy(new)
+    _add_moments(delta['global'], old['global'], sign=-1)
+    for sector, moments in old['sectors'].items():
+        _add_moments(delta['sectors'].setdefault(sector, _empty_moments()), moments, sign=-1)
+    return delta
+
+
+def add_stats_increment(writer, db, app_id, delta, shard=None):
+    """
+    Aggiunge a `writer` (batch o transazione) l'applicazione di `delta` (stessa struttura di
+    empty_stats, valori anche negativi) a uno shard, casuale se non indicato: una scrittura in merge
+    con soli firestore.Increment, senza leggere lo shard. Ritorna il numero di scritture (0 o 1).
+    """
+    from firebase_admin import firestore
+
+    def increments(moments):
+        return {field: firestore.Increment(moments[field]) for field in MOMENT_FIELDS if moments[field]}
+
+    update = {'sectors': {}}
+    if increments(delta['global']):
+        update['global'] = increments(delta['global'])
+    for sector, moments in delta['sectors'].items():
+        if increments(moments):
+            update['sectors'][sector] = increments(moments)
+    if 'global' not in update and not update['sectors']:
+        return 0
+    shard = random.randrange(STATS_SHARDS) if shard is None else shard
+    writer.set(stats_shard_ref(db, app_id, shard), update, merge=True)
+    return 1
+
+
+def _sector_key(sector):
+    return sector if sector in PREDEFINED_SECTORS else 'Altro'
+
+
+def _score_of(data):
+    """(settore, final_adjusted_score, chiave delle metriche) di un'analisi; score None se assente."""
+    metrics_key = 'core_metrics' if data.get('core_metrics') else 'calcoli_aggiuntivi'
+    score = (data.get(metrics_key) or {}).get('final_adjusted_score')
+    return _sector_key(data.get('settore')), score, metrics_key
+
+
+def _update_score(stats, data, sign):
+    sector, score, _ = _score_of(data)
+    if score is None:
+        return
+    moments = {'count': 1, 'sum': score, 'sumsq': score * score}
+    _add_moments(stats['sectors'].setdefault(sector, _empty_moments()), moments, sign)
+    _add_moments(stats['global'], moments, sign)
+
+
+def add_score(stats, data):
+    """Aggiunge il punteggio dell'analisi alle statistiche (o a un incremento), sul posto."""
+    _update_score(stats, data, 1)
+
+
+def remove_score(stats, data):
+    """Toglie il punteggio di un'analisi già conteggiata (es. sovrascritta o eliminata), sul posto."""
+    _update_score(stats, data, -1)
+
+
+def compute_z_score(stats, sector, score):
+    """
+    z_score del punteggio rispetto al proprio settore, o rispetto al corpus se il settore
+    ha meno di MIN_SECTOR_SAMPLES analisi. None se i dati non bastano.
+    """
+    if score is None:
+        return None
+    moments = stats['sectors'].get(_sector_key(sector)) or _empty_moments()
+    if moments['count'] < MIN_SECTOR_SAMPLES:
+        moments = stats['global']
+    count = moments['count']
+    if count < MIN_GLOBAL_SAMPLES:
+        return None
+    mean = moments['sum'] / count
+    variance = (moments['sumsq'] - moments['sum'] * mean) / (count - 1)
+    # Varianza nulla a meno degli errori di arrotondamento delle somme (anche negativa): punteggi tutti uguali
+    if variance <= 1e-9 * (1 + mean * mean):
+        return 0.0
+    return round((score - mean) / math.sqrt(variance), 3)
+
+
+def apply_z_score(stats, data):
+    """Scrive lo z_score nelle metriche dell'analisi (core_metrics o calcoli_aggiuntivi)."""
+    sector, score, metrics_key = _score_of(data)
+    if data.get(metrics_key) is not None:
+        data[metrics_key]['z_score'] = compute_z_score(stats, sector, score)
+
+
+def rebuild_sector_stats(db, app_id):
+    """
+    Backfill: ricalcola da zero le statistiche leggendo tutte le analisi, poi riscrive lo z_score
+    dei soli documenti in cui cambia (con updated_at e la versione delle analisi dei rispettivi
+    utenti). Da eseguire sui dati esistenti e dopo un re-scoring dell'intero corpus.
+    Shard e analisi sono letti nella stessa transazione di sola lettura (un'istantanea coerente, entro
+    il limite di durata delle transazioni di Firestore) e agli shard viene applicata come incremento
+    solo la differenza tra il ricalcolo e l'istantanea: i salvataggi concorrenti restano conteggiati.
+    """
+    from firebase_admin import firestore
+
+    @firestore.transactional
+    def _snapshot(transaction):
+        current = read_sector_stats(db, app_id, transaction=transaction)
+        query = db.collection_group('pitch_deck_analyses').select(['settore', 'core_metrics', 'calcoli_aggiuntivi'])
+        documents = []
+        for doc in query.stream(transaction=transaction):
+            path = doc.reference.path.split('/')
+            if path[0] == 'artifacts' and path[1] == app_id:
+                documents.append((doc.reference, doc.to_dict()))
+        return current, documents
+
+    current, documents = _snapshot(db.transaction(read_only=True))
+    stats = empty_stats()
+    for _, data in documents:
+        add_score(stats, data)
+    batch = db.batch()
+    add_stats_increment(batch, db, app_id, stats_difference(stats, current), shard=0)
+    # Documento unico delle versioni precedenti (Welford), sostituito dagli shard
+    batch.delete(_stats_collection(db, app_id).document(STATS_DOC_PREFIX))
+    batch.commit()
+
+    from analysis_sync import add_version_bump
+    batch = db.batch()
+    pending = updated = 0
+    now = time.time()
+    # Utenti con documenti aggiornati: la versione delle loro analisi va incrementata (vedi analysis_sync)
+    changed_users = set()
+    for doc_ref, data in documents:
+        sector, score, metrics_key = _score_of(data)
+        if data.get(metrics_key) is None:
+            continue
+        z_score = compute_z_score(stats, sector, score)
+        if data[metrics_key].get('z_score') == z_score:
+            continue
+        batch.update(doc_ref, {f'{metrics_key}.z_score': z_score, 'updated_at': now})
+        path = doc_ref.path.split('/')
+        if path[2] == 'users':
+            changed_users.add(path[3])
+        pending += 1
+        updated += 1
+        if pending >= FIRESTORE_WRITE_BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    for user_id in changed_users:
+        add_version_bump(batch, db, app_id, user_id, now)
+        pending += 1
+        if pending >= FIRESTORE_WRITE_BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    print(f"INFO: Statistiche di settore ricostruite su {stats['global']['count']} punteggi, {updated} documenti aggiornati.")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Statistiche di settore del final_adjusted_score.")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: ricalcola statistiche e z_score di tutte le analisi.")
+    args = parser.parse_args()
+    from clients import APP_ID, get_firestore_client
+    rebuild_sector_stats(get_firestore_client(), APP_ID)
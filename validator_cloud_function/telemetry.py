@@ -0,0 +1,211 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+# --- Telemetria leggera: span per fase, contatori e log strutturati ---
+# Ogni richiesta (o job) apre una traccia con start_trace(); dentro, span("download"), span("analyze"), ...
+# misurano le singole fasi e count(...) accumula contatori (token LLM, letture/scritture Firestore,
+# dimensioni dei payload). Alla chiusura la traccia viene emessa come un unico record JSON su stdout,
+# che Cloud Logging interpreta come log strutturato (campi "severity" e "message").
+# La traccia corrente è in una ContextVar: le funzioni interne non devono riceverla come parametro
+# e i thread del pool la ereditano se eseguiti con contextvars.copy_context().run (vedi parallel_stages).
+#
+# LOG_LEVEL controlla anche i dump verbosi (prompt, risposte grezze, header delle richieste):
+# vengono stampati da debug_log solo con LOG_LEVEL=DEBUG, quindi sono spenti in produzione.
+# Con LOG_LEVEL=WARNING o superiore vengono emesse solo le tracce concluse con errore.
+
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+
+def log_level_value(level=None):
+    return LOG_LEVELS.get((level or LOG_LEVEL).upper(), LOG_LEVELS["INFO"])
+
+
+def is_debug_enabled():
+    return log_level_value() <= LOG_LEVELS["DEBUG"]
+
+
+def debug_log(message):
+    """Stampa un messaggio diagnostico verboso solo se LOG_LEVEL=DEBUG."""
+    if is_debug_enabled():
+        print(f"DEBUG: {message}")
+
+
+class StdoutExporter:
+    """Scrive ogni record come una riga JSON su stdout (log strutturato per Cloud Logging)."""
+
+    def export(self, record):
+        print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class InMemoryExporter:
+    """Conserva i record in memoria: per test e benchmark, al posto dell'output su stdout."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def find(self, trace_name):
+        return [record for record in self.records if record["trace"] == trace_name]
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+
+_exporter = StdoutExporter()
+
+
+def set_exporter(exporter):
+    """Imposta l'exporter dei record e restituisce quello precedente."""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+class Trace:
+    """Traccia di una richiesta o di un job: span delle fasi, contatori e attributi."""
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.spans = []
+        self.counters = {}
+        self.error = None
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Misura la fase `name`. Il dict restituito può essere arricchito con attributi
+        durante la fase; un'eccezione marca lo span come "error" e viene rilanciata.
+        """
+        record = {"name": name, "status": "ok", **attributes}
+        start = time.monotonic()
+        try:
+            yield record
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = str(e)
+            raise
+        finally:
+            record["duration_s"] = round(time.monotonic() - start, 3)
+            with self._lock:
+                self.spans.append(record)
+
+    def count(self, name, value=1):
+        if not value:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def fail(self, error):
+        """Marca la traccia come fallita anche se l'errore è gestito (non propagato) dal chiamante."""
+        self.error = str(error)
+
+    def to_record(self, status="ok", error=None):
+        record = {
+            "severity": "ERROR" if status == "error" else "INFO",
+            "message": f"trace {self.name} {status}",
+            "trace": self.name,
+            "trace_id": self.trace_id,
+            "status": status,
+            "duration_s": round(time.monotonic() - self._start, 3),
+            "attributes": dict(self.attributes),
+            "spans": list(self.spans),
+            "counters": dict(self.counters),
+        }
+        if error:
+            record["error"] = error
+        return record
+
+
+_current_trace = contextvars.ContextVar("telemetry_trace", default=None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def start_trace(name, **attributes):
+    """Apre una traccia come traccia corrente e la emette alla chiusura (anche in caso di eccezione)."""
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    status, error = "ok", None
+    try:
+        yield trace
+    except Exception as e:
+        status, error = "error", str(e)
+        raise
+    finally:
+        _current_trace.reset(token)
+        if trace.error and status == "ok":
+            status, error = "error", trace.error
+        if status == "error" or log_level_value() <= LOG_LEVELS["INFO"]:
+            try:
+                _exporter.export(trace.to_record(status, error))
+            except Exception as e:
+                print(f"ATTENZIONE: esportazione della traccia {name} fallita: {e}")
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Span nella traccia corrente; senza traccia attiva non registra nulla."""
+    trace = current_trace()
+    if trace is None:
+        yield dict(attributes)
+        return
+    with trace.span(name, **attributes) as record:
+        yield record
+
+
+def count(name, value=1):
+    """Incrementa un contatore della traccia corrente (se presente)."""
+    trace = current_trace()
+    if trace is not None:
+        trace.count(name, value)
+
+
+def traced(name):
+    """Decoratore: esegue la funzione dentro span(name)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(usage):
+    """Somma i token di una risposta LLM ({prompt_tokens, completion_tokens, ...}) ai contatori della traccia."""
+    count("llm_calls")
+    for key, value in (usage or {}).items():
+        if isinstance(value, (int, float)):
+            count(f"llm_{key}", value)
+
+
+def payload_size(data):
+    """Dimensione in byte della serializzazione JSON di `data` (per i contatori dei payload)."""
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False, default=str)
+    return len(data.encode("utf-8"))
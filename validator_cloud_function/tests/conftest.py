@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli delle funzioni sono file piatti nella cartella superiore (come nel deploy delle Cloud Functions)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,13 @@
+import json
+
+from analysis_schema import EXPECTED_PAIRS, EXPECTED_VARIABLES, build_reask_messages
+
+
+def test_reask_messages_include_previous_response():
+    analysis = {"settore": "Altro", "variabili_valutate": [], "coerenza_coppie": []}
+    messages = build_reask_messages(analysis, EXPECTED_VARIABLES[:1], EXPECTED_PAIRS[:1])
+
+    assert [message["role"] for message in messages] == ["assistant", "user"]
+    assert json.loads(messages[0]["content"]) == analysis
+    assert EXPECTED_VARIABLES[0] in messages[1]["content"]
+    assert EXPECTED_PAIRS[0] in messages[1]["content"]
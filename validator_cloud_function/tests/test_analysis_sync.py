@@ -0,0 +1,16 @@
+import pytest
+
+from analysis_sync import SYNC_OVERLAP_S, TOMBSTONE_RETENTION_S, parse_since
+
+NOW = 1_800_000_000.0
+
+
+def test_parse_since_returns_lower_bound():
+    assert parse_since(str(NOW - 10), now=NOW) == NOW - 10 - SYNC_OVERLAP_S
+    assert parse_since(str(NOW - TOMBSTONE_RETENTION_S - 1), now=NOW) is None
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf", "-1", str(NOW + SYNC_OVERLAP_S + 1), "abc"])
+def test_parse_since_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        parse_since(value, now=NOW)
@@ -0,0 +1,21 @@
+from near_duplicates import same_business_plan
+
+
+def test_reuse_requires_same_business_plan():
+    with_plan = {"pitch_deck": "deck", "business_plan": "plan", "has_business_plan": True}
+    without_plan = {"pitch_deck": "deck", "business_plan": None, "has_business_plan": False}
+
+    assert same_business_plan(with_plan, "plan", True)
+    assert same_business_plan(without_plan, None, False)
+    assert not same_business_plan(with_plan, "other_plan", True)
+    assert not same_business_plan(with_plan, None, False)
+    assert not same_business_plan(without_plan, "plan", True)
+    # Business plan corrente senza chiave nel text store: non verificabile
+    assert not same_business_plan(with_plan, None, True)
+
+
+def test_unknown_previous_input_is_not_reused():
+    assert not same_business_plan(None, None, False)
+    assert not same_business_plan({"pitch_deck": None, "business_plan": None}, None, False)
+    # Analisi precedenti senza has_business_plan: si usa la presenza della chiave
+    assert not same_business_plan({"pitch_deck": "deck", "business_plan": "plan"}, None, False)
@@ -0,0 +1,27 @@
+import time
+
+import pytest
+
+from parallel_stages import StageError, make_stage, run_parallel_stages
+
+
+def test_timeout_runs_from_stage_start():
+    # Con un solo worker "second" parte dopo "first": l'attesa in coda non consuma il suo timeout
+    stages = {
+        "first": make_stage(time.sleep, args=(0.2,)),
+        "second": make_stage(lambda: time.sleep(0.15) or "ok", timeout=0.3),
+    }
+
+    results, timings = run_parallel_stages(stages, max_workers=1)
+
+    assert results["second"] == "ok"
+    assert timings["second"]["status"] == "ok"
+
+
+def test_required_stage_timeout_raises():
+    stages = {"slow": make_stage(time.sleep, args=(0.3,), timeout=0.05)}
+
+    with pytest.raises(StageError) as excinfo:
+        run_parallel_stages(stages)
+
+    assert excinfo.value.timings["slow"]["status"] == "timeout"
@@ -0,0 +1,49 @@
+import statistics
+
+import pytest
+
+from sector_stats import add_score, compute_z_score, empty_stats, merge_stats, remove_score, stats_difference
+
+
+class _Snapshot:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+def _analysis(score, sector="Retail"):
+    return {"settore": sector, "core_metrics": {"final_adjusted_score": score}}
+
+
+def test_z_score_matches_sample_statistics():
+    scores = [40, 55, 61, 70, 72, 80, 90, 35, 66, 58, 77]
+    stats = empty_stats()
+    for score in scores:
+        add_score(stats, _analysis(score))
+
+    expected = (70 - statistics.mean(scores)) / statistics.stdev(scores)
+    assert compute_z_score(stats, "Retail", 70) == pytest.approx(round(expected, 3))
+
+
+def test_shards_and_deltas_add_up():
+    # Due shard con incrementi parziali (anche negativi) danno le stesse statistiche del calcolo diretto
+    first, second = empty_stats(), empty_stats()
+    for score in (50, 60, 70):
+        add_score(first, _analysis(score))
+    add_score(second, _analysis(90))
+    remove_score(second, _analysis(60))
+    merged = merge_stats([_Snapshot(first), _Snapshot(second), _Snapshot(None)])
+
+    direct = empty_stats()
+    for score in (50, 70, 90):
+        add_score(direct, _analysis(score))
+    assert merged["global"] == pytest.approx(direct["global"])
+    assert merged["sectors"]["Retail"] == pytest.approx(direct["sectors"]["Retail"])
+
+    # Il ricalcolo di rebuild applica solo la differenza rispetto all'istantanea letta
+    correction = stats_difference(direct, first)
+    rebuilt = merge_stats([_Snapshot(first), _Snapshot(correction)])
+    assert rebuilt["global"] == pytest.approx(direct["global"])
@@ -0,0 +1,23 @@
+from text_condensation import dedupe_pages
+
+
+def test_numeric_table_rows_are_kept():
+    pages, removed = dedupe_pages(['Ricavi 2025\n150\n2026\n300\n2027\n900', 'x'])
+    assert pages == ['Ricavi 2025\n150\n2026\n300\n2027\n900', 'x']
+    assert removed == 0
+
+
+def test_prefixed_page_numbers_are_removed():
+    pages, removed = dedupe_pages(['Mercato\nPagina 2 di 10', 'Team\nslide 3'])
+    assert pages == ['Mercato', 'Team']
+    assert removed == 2
+
+
+def test_bare_page_numbers_repeated_at_page_edges_are_removed():
+    pages, removed = dedupe_pages([
+        'Problema\nCosti 2025\n150\n1',
+        'Soluzione\n2',
+        'Ricavi\n300\n900\n3',
+    ])
+    assert pages == ['Problema\nCosti 2025\n150', 'Soluzione', 'Ricavi\n300\n900']
+    assert removed == 3
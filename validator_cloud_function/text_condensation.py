@@ -0,0 +1,274 @@
+import os
+import re
+from collections import Counter
+
+from rubrics import RUBRICS
+
+try:
+    import tiktoken
+except ImportError:  # Il conteggio torna all'approssimazione ~4 caratteri per token
+    tiktoken = None
+
+# --- Condensazione del testo prima delle chiamate LLM ---
+# Il testo estratto (pitch deck + business plan) viene portato entro un budget di token
+# di input: si eliminano intestazioni/piè di pagina ripetuti e boilerplate, e il business
+# plan viene diviso in sezioni ordinate per rilevanza rispetto alle 7 variabili di RUBRICS.
+# Il pitch deck ha sempre la precedenza: il budget residuo va alle sezioni più rilevanti.
+
+ANALYSIS_INPUT_TOKEN_BUDGET = int(os.environ.get("ANALYSIS_INPUT_TOKEN_BUDGET", "24000"))
+SUMMARY_INPUT_TOKEN_BUDGET = int(os.environ.get("SUMMARY_INPUT_TOKEN_BUDGET", "6000"))
+TOKENIZER_ENCODING = os.environ.get("TOKENIZER_ENCODING", "o200k_base")
+
+BUSINESS_PLAN_SEPARATOR = "\n\n--- CONTENUTO DEL BUSINESS PLAN ---\n\n"
+
+# Una riga presente in testa o in coda (prime/ultime EDGE_LINES righe) su almeno questa
+# frazione delle pagine è considerata intestazione/piè di pagina
+REPEATED_LINE_PAGE_RATIO = 0.5
+REPEATED_LINE_MIN_PAGES = 3
+EDGE_LINES = 3
+
+# Righe tipiche di boilerplate (numeri di pagina con prefisso, avvisi di riservatezza, copyright)
+_BOILERPLATE_PATTERNS = [
+    re.compile(r"^(pagina|page|pag\.?|p\.|slide)\s*\d+\s*((di|of|/)\s*\d+)?$", re.IGNORECASE),
+    re.compile(r"^(strettamente\s+)?(riservato|confidenziale|confidential|strictly confidential)\b.*$", re.IGNORECASE),
+    re.compile(r"^(©|\(c\)|copyright)\s.*$", re.IGNORECASE),
+    re.compile(r"^(tutti i diritti riservati|all rights reserved)\.?$", re.IGNORECASE),
+]
+# Numero di pagina senza prefisso ("12", "3 / 20"): una riga con solo un numero è spesso il dato di
+# una tabella, quindi viene rimossa solo se è la prima o l'ultima riga della pagina e lo stesso
+# schema si ripete su abbastanza pagine (vedi dedupe_pages)
+_BARE_PAGE_NUMBER = re.compile(r"^\d+\s*((di|of|/)\s*\d+)?$", re.IGNORECASE)
+
+# Parole chiave aggiuntive (IT/EN) per le variabili, oltre ai termini delle rubriche
+_VARIABLE_KEYWORDS = {
+    "Problema": ["problema", "problem", "pain", "bisogno", "need", "inefficien", "sfida"],
+    "Target": ["target", "clienti", "customer", "utenti", "user", "segment", "persona", "b2b", "b2c"],
+    "Soluzione": ["soluzione", "solution", "prodotto", "product", "piattaforma", "platform", "tecnologia", "brevett"],
+    "Mercato": ["mercato", "market", "tam", "sam", "som", "competitor", "concorren", "cagr", "trend"],
+    "MVP": ["mvp", "prototip", "prototype", "beta", "pilot", "traction", "trazione", "utilizzo", "download"],
+    "Team": ["team", "founder", "fondator", "ceo", "cto", "cmo", "advisor", "esperienza", "experience"],
+    "Ritorno Atteso": ["ricavi", "revenue", "fatturato", "ebitda", "margin", "irr", "valuation", "valutazione",
+                       "investimento", "round", "break-even", "proiezion", "conto economico", "cash flow"],
+}
+
+_STOPWORDS = {
+    "della", "delle", "degli", "dello", "nella", "nelle", "negli", "sulla", "sulle", "dalla", "dalle",
+    "come", "anche", "quanto", "questo", "questa", "quale", "quali", "essere", "rispetto", "valutate",
+    "variabili", "capacità", "presenza", "eventuali", "altri", "altre", "sufficientemente", "valuta",
+}
+
+_encoder = None
+
+
+def _get_encoder():
+    global _encoder
+    if _encoder is None and tiktoken is not None:
+        try:
+            _encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"ATTENZIONE: tokenizer '{TOKENIZER_ENCODING}' non disponibile ({e}); uso una stima dei token.")
+            _encoder = False
+    return _encoder or None
+
+
+def count_tokens(text):
+    """Conta i token del testo con tiktoken (se installato) o con una stima di ~4 caratteri per token."""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Tronca il testo al numero massimo di token indicato."""
+    if max_tokens <= 0:
+        return ""
+    encoder = _get_encoder()
+    if encoder:
+        tokens = encoder.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoder.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _line_signature(line):
+    return " ".join(line.lower().split())
+
+
+def _edge_lines(lines):
+    content = [line for line in lines if line.strip()]
+    return content[:EDGE_LINES] + content[-EDGE_LINES:]
+
+
+def _is_boilerplate(line):
+    stripped = line.strip()
+    return not stripped or any(pattern.match(stripped) for pattern in _BOILERPLATE_PATTERNS)
+
+
+def _bare_number_edges(lines):
+    """Indici della prima e/o ultima riga non vuota della pagina che contengono solo un numero di pagina."""
+    content = [index for index, line in enumerate(lines) if line.strip()]
+    return {index for index in content[:1] + content[-1:] if _BARE_PAGE_NUMBER.match(lines[index].strip())}
+
+
+def dedupe_pages(page_texts):
+    """
+    Rimuove intestazioni/piè di pagina ripetuti e righe di boilerplate dalle pagine.
+    Restituisce (pagine ripulite, numero di righe rimosse).
+    """
+    page_lines = [text.splitlines() for text in page_texts]
+    repeated = set()
+    threshold = max(REPEATED_LINE_MIN_PAGES, int(len(page_texts) * REPEATED_LINE_PAGE_RATIO))
+    bare_number_edges = [set() for _ in page_lines]
+    if len(page_texts) >= REPEATED_LINE_MIN_PAGES:
+        occurrences = Counter(sig for lines in page_lines for sig in {_line_signature(l) for l in _edge_lines(lines)})
+        repeated = {sig for sig, count in occurrences.items() if count >= threshold}
+        candidates = [_bare_number_edges(lines) for lines in page_lines]
+        if sum(1 for edges in candidates if edges) >= threshold:
+            bare_number_edges = candidates
+
+    removed = 0
+    cleaned_pages = []
+    for lines, number_edges in zip(page_lines, bare_number_edges):
+        kept = []
+        edges = {_line_signature(line) for line in _edge_lines(lines)}
+        for index, line in enumerate(lines):
+            signature = _line_signature(line)
+            if _is_boilerplate(line) or index in number_edges or (signature in repeated and signature in edges):
+                removed += 1 if line.strip() else 0
+                continue
+            kept.append(line)
+        cleaned_pages.append("\n".join(kept))
+    return cleaned_pages, removed
+
+
+def join_page_texts(page_texts):
+    """Unisce le pagine nello stesso formato usato da pdf_extraction.join_pages."""
+    return "".join(text for text in page_texts if text).replace('\n\n', '\n').strip()
+
+
+_HEADING_RE = re.compile(r"^((\d+(\.\d+)*[.)]?)|capitolo|sezione|chapter|section|[IVX]+\.)\s+\S", re.IGNORECASE)
+
+
+def _is_heading(line):
+    stripped = line.strip()
+    if not stripped or len(stripped) > 80 or stripped.endswith((".", ",", ";", ":")):
+        return False
+    letters = [c for c in stripped if c.isalpha()]
+    return bool(_HEADING_RE.match(stripped)) or (len(letters) >= 4 and all(c.isupper() for c in letters))
+
+
+def split_sections(text, max_section_tokens=1500):
+    """
+    Divide il testo del business plan in sezioni usando i titoli (numerati o in maiuscolo);
+    le sezioni troppo lunghe vengono ulteriormente divise a blocchi di righe.
+    """
+    sections = []
+    current = []
+    for line in text.splitlines():
+        if _is_heading(line) and current:
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("\n".join(current))
+
+    result = []
+    for section in sections:
+        if count_tokens(section) <= max_section_tokens:
+            result.append(section)
+            continue
+        chunk = []
+        chunk_tokens = 0
+        for line in section.splitlines():
+            line_tokens = count_tokens(line)
+            if chunk and chunk_tokens + line_tokens > max_section_tokens:
+                result.append("\n".join(chunk))
+                chunk, chunk_tokens = [], 0
+            chunk.append(line)
+            chunk_tokens += line_tokens
+        if chunk:
+            result.append("\n".join(chunk))
+    return [section for section in result if section.strip()]
+
+
+def _build_variable_keywords():
+    keywords = {}
+    for variable, details in RUBRICS.items():
+        terms = {w for w in re.findall(r"[a-zàèéìòù]{5,}", details["criteri"].lower()) if w not in _STOPWORDS}
+        terms.update(_VARIABLE_KEYWORDS.get(variable, []))
+        terms.add(variable.lower())
+        keywords[variable] = sorted(terms)
+    return keywords
+
+
+VARIABLE_KEYWORDS = _build_variable_keywords()
+
+
+def score_section(section):
+    """Restituisce {variabile: punteggio di rilevanza} per la sezione (occorrenze di parole chiave per 1000 caratteri)."""
+    lowered = section.lower()
+    length = max(len(lowered), 200)
+    return {
+        variable: sum(lowered.count(term) for term in terms) * 1000 / length
+        for variable, terms in VARIABLE_KEYWORDS.items()
+    }
+
+
+def select_sections(sections, budget_tokens):
+    """
+    Seleziona le sezioni entro il budget: prima la sezione più rilevante per ogni variabile
+    (così ogni variabile ha evidenze), poi le altre in ordine di rilevanza complessiva.
+    Le sezioni scelte vengono restituite nell'ordine originale del documento.
+    """
+    scored = [(index, section, score_section(section), count_tokens(section)) for index, section in enumerate(sections)]
+    order = []
+    for variable in VARIABLE_KEYWORDS:
+        best = max(scored, key=lambda item: item[2][variable], default=None)
+        if best and best[2][variable] > 0 and best[0] not in order:
+            order.append(best[0])
+    for item in sorted(scored, key=lambda item: sum(item[2].values()), reverse=True):
+        if item[0] not in order:
+            order.append(item[0])
+
+    chosen = set()
+    used = 0
+    for index in order:
+        tokens = scored[index][3]
+        if used + tokens <= budget_tokens:
+            chosen.add(index)
+            used += tokens
+    return [sections[index] for index in sorted(chosen)], used
+
+
+def condense_for_llm(deck_pages, business_plan_pages=None, budget_tokens=ANALYSIS_INPUT_TOKEN_BUDGET):
+    """
+    Prepara il testo da inviare all'LLM entro budget_tokens.
+    deck_pages / business_plan_pages: liste con il testo di ogni pagina.
+    Restituisce (testo, report) dove il report contiene token in ingresso/uscita e sezioni mantenute.
+    """
+    raw_deck = join_page_texts(deck_pages)
+    raw_plan = join_page_texts(business_plan_pages or [])
+    report = {"tokens_in": count_tokens(raw_deck) + count_tokens(raw_plan), "budget_tokens": budget_tokens}
+
+    deck_pages_clean, removed_deck = dedupe_pages(deck_pages)
+    deck_text = join_page_texts(deck_pages_clean)
+    deck_tokens = count_tokens(deck_text)
+    if deck_tokens > budget_tokens:
+        deck_text = truncate_to_tokens(deck_text, budget_tokens)
+        deck_tokens = count_tokens(deck_text)
+    report["removed_lines"] = removed_deck
+
+    text = deck_text
+    if business_plan_pages is not None:
+        plan_pages_clean, removed_plan = dedupe_pages(business_plan_pages)
+        report["removed_lines"] += removed_plan
+        sections = split_sections("\n".join(plan_pages_clean))
+        remaining = budget_tokens - deck_tokens - count_tokens(BUSINESS_PLAN_SEPARATOR)
+        selected, _ = select_sections(sections, max(remaining, 0))
+        report["business_plan_sections"] = {"total": len(sections), "kept": len(selected)}
+        text += BUSINESS_PLAN_SEPARATOR + "\n".join(selected)
+
+    report["tokens_out"] = count_tokens(text)
+    return text, report
@@ -0,0 +1,101 @@
+import gzip
+import hashlib
+import json
+import os
+
+# --- Archivio del testo estratto, indirizzato per contenuto ---
+# Il PDF caricato viene eliminato subito dopo l'estrazione: senza una copia del testo un errore
+# successivo (LLM, salvataggio) costringe l'utente a ricaricare il file e nessuna rianalisi è possibile.
+# Le pagine estratte vengono salvate compresse (JSON + gzip) con chiave = SHA-256 del contenuto:
+# lo stesso testo produce sempre la stessa chiave e viene scritto una sola volta.
+# La chiave è registrata nel job (text_keys, per i tentativi successivi) e nell'analisi salvata
+# (source_text, per il re-scoring in blocco), così download ed estrazione avvengono una volta sola.
+
+TEXT_STORE_BACKEND = os.environ.get("TEXT_STORE_BACKEND", "gcs")  # gcs | local | none
+TEXT_STORE_BUCKET = os.environ.get("TEXT_STORE_BUCKET", "validatr-mvp.firebasestorage.app")
+TEXT_STORE_PREFIX = os.environ.get("TEXT_STORE_PREFIX", "extracted_texts")
+TEXT_STORE_DIR = os.environ.get("TEXT_STORE_DIR", "/tmp/validatr_text_store")
+# Da incrementare se cambia il formato serializzato (le chiavi esistenti restano leggibili tramite "format")
+TEXT_FORMAT_VERSION = 1
+
+
+def text_key(pages):
+    """Chiave di contenuto delle pagine: SHA-256 esadecimale della lista serializzata."""
+    return hashlib.sha256(json.dumps(pages, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def encode_pages(pages):
+    """Serializza le pagine in JSON compresso con gzip (mtime fisso: stesso contenuto, stessi byte)."""
+    payload = json.dumps({"format": TEXT_FORMAT_VERSION, "pages": pages}, ensure_ascii=False)
+    return gzip.compress(payload.encode("utf-8"), compresslevel=9, mtime=0)
+
+
+def decode_pages(data):
+    return json.loads(gzip.decompress(data).decode("utf-8"))["pages"]
+
+
+class LocalTextStore:
+    """Backend su filesystem locale (sviluppo, test, benchmark): un file .json.gz per chiave."""
+
+    def __init__(self, directory=TEXT_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def put(self, pages):
+        key = text_key(pages)
+        path = self._path(key)
+        if not os.path.exists(path):
+            # Scrittura atomica: un lettore concorrente non vede mai un file parziale
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(encode_pages(pages))
+            os.replace(temp_path, path)
+        return key
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return decode_pages(f.read())
+        except FileNotFoundError:
+            return None
+
+
+class GCSTextStore:
+    """Backend su Cloud Storage: oggetti gs://{bucket}/{prefix}/{chiave}.json.gz."""
+
+    def __init__(self, storage_client, bucket_name=TEXT_STORE_BUCKET, prefix=TEXT_STORE_PREFIX):
+        self.bucket = storage_client.bucket(bucket_name)
+        self.prefix = prefix
+
+    def _blob(self, key):
+        return self.bucket.blob(f"{self.prefix}/{key}.json.gz")
+
+    def put(self, pages):
+        from google.api_core.exceptions import PreconditionFailed
+        key = text_key(pages)
+        try:
+            # if_generation_match=0: scrive solo se l'oggetto non esiste, in una sola richiesta
+            self._blob(key).upload_from_string(encode_pages(pages), content_type="application/gzip", if_generation_match=0)
+        except PreconditionFailed:
+            pass
+        return key
+
+    def get(self, key):
+        from google.api_core.exceptions import NotFound
+        try:
+            return decode_pages(self._blob(key).download_as_bytes())
+        except NotFound:
+            return None
+
+
+def create_text_store(backend=TEXT_STORE_BACKEND):
+    """Crea il backend configurato (gcs, local o none)."""
+    if backend == "none":
+        return None
+    if backend == "local":
+        return LocalTextStore()
+    from clients import get_storage_client
+    return GCSTextStore(get_storage_client())